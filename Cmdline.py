@@ -2,12 +2,21 @@
 """Command-line interface for payroll file processing.
 
 This script provides a command-line interface to process Excel payroll files
-according to definition file specifications.
+according to definition file specifications, one file at a time or as a
+batch of many companies and months. With --server the job is handed to a
+running job server (jobserver.py) instead of being processed here, with
+--watch every payroll file dropped into a folder is processed.
+
+Only the argument parser is loaded at start up, openpyxl and the processing
+modules are imported once the arguments are known, so --help and argument
+errors come back at once.
 """
 
 import argparse
+import json
 import sys
-from processFiles import processFiles
+
+from logsetup import setuplogging
 
 
 def main():
@@ -15,18 +24,147 @@ def main():
     parser = argparse.ArgumentParser(
         description="Process Excel payroll files according to definition specifications"
     )
-    parser.add_argument("--defn", required=True, help="Definition filename (INI format)")
-    parser.add_argument("--excl", required=True, help="Excel filename (.xlsx)")
-    parser.add_argument("--month", required=True, help="Month (e.g., Jan, Feb, Mar)")
-    parser.add_argument("--year", required=True, help="Year (e.g., 2025)")
-    parser.add_argument("--unit", required=True, help="Business unit name")
+    parser.add_argument("--defn", help="Definition filename (INI format)")
+    parser.add_argument("--excl", help="Excel filename (.xlsx), or a CSV (.csv) or TSV (.tsv) export")
+    parser.add_argument("--month", help="Month (e.g., Jan, Feb, Mar)")
+    parser.add_argument("--year", help="Year (e.g., 2025)")
+    parser.add_argument("--unit", help="Business unit name")
     parser.add_argument("--debug", action="store_true", help="Enable debug logging")
+    parser.add_argument("--read-only", action="store_true",
+                        help="Stream the Excel file read-only and write only the tabs to the output")
+    parser.add_argument("--write-only", action="store_true",
+                        help="Stream the tabs to a write-only output that does not include the source sheet")
+    parser.add_argument("--split", action="store_true",
+                        help="Write every tab to a workbook of its own next to the Excel file, saved in "
+                             "parallel with --workers")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of processes building the sections, and saving the workbooks of "
+                             "--split, in parallel (default: 1, all in this process)")
+    parser.add_argument("--engine", choices=["auto", "numpy", "python"], default="auto",
+                        help="Filter and add up the rows with NumPy or plain Python "
+                             "(default: auto, NumPy when installed)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Read the recipe and payroll file again instead of using their caches")
+    parser.add_argument("--clear-cache", action="store_true",
+                        help="Empty the recipe and payroll caches before running, or only that "
+                             "when no files are given")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only rebuild the sections whose recipe or source data changed since the last run")
+    parser.add_argument("--report", metavar="FILE",
+                        help="Write the run report (timings per phase and section, row counts, peak memory) "
+                             "as JSON to FILE")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="Profile the run with cProfile and write the statistics to FILE")
+
+    batch = parser.add_argument_group("batch mode")
+    batch.add_argument("--batch", metavar="MANIFEST",
+                       help="CSV or JSON manifest of jobs with defn, excl, month, year and unit")
+    batch.add_argument("--batch-glob", metavar="PATTERN",
+                       help="Process every Excel file matching PATTERN with --defn, --month and --year, "
+                            "the unit is the company of the recipe named in the file name or --unit")
+    batch.add_argument("--batch-workers", type=int, default=None,
+                       help="Number of jobs run at the same time (default: number of CPUs)")
+    batch.add_argument("--summary", metavar="FILE", help="Write the batch summary as JSON to FILE")
+
+    watch = parser.add_argument_group("watch mode")
+    watch.add_argument("--watch", metavar="FOLDER",
+                       help="Process every payroll file dropped into FOLDER with --defn, taking the unit, month "
+                            "and year from the file name or --unit, --month and --year")
+    watch.add_argument("--watch-interval", type=float, default=2.0,
+                       help="Seconds between two looks at the folder (default: 2)")
+    watch.add_argument("--watch-workers", type=int, default=None,
+                       help="Number of files processed at the same time (default: number of CPUs)")
+    watch.add_argument("--watch-once", action="store_true",
+                       help="Stop once the files already in the folder are processed")
+
+    server = parser.add_argument_group("server mode")
+    server.add_argument("--server", metavar="URL", nargs="?", const="http://127.0.0.1:8765",
+                        help="Submit the job to a running job server (default URL: http://127.0.0.1:8765) "
+                             "and wait for its result")
+    server.add_argument("--no-wait", action="store_true",
+                        help="With --server, print the id of the submitted job and return at once")
     
     args = parser.parse_args()
+    setuplogging(args.debug)
+    options = {"readonly": args.read_only, "writeonly": args.write_only, "engine": args.engine,
+               "usecache": not args.no_cache, "incremental": args.incremental, "splitoutput": args.split}
 
-    status, result = processFiles(
-        args.defn, args.excl, args.month, args.year, args.unit, args.debug
-    )
+    if args.clear_cache:
+        from cachestore import clearcache
+        print(f"Removed {clearcache()} cache entries")
+        if not (args.batch or args.batch_glob or args.defn or args.excl):
+            sys.exit(0)
+
+    if args.watch:
+        from watchfolder import watchfolder
+
+        if not args.defn:
+            parser.error("--watch needs --defn")
+        failcntr = watchfolder(args.watch, args.defn, args.month, args.year, args.unit, args.watch_workers,
+                               args.watch_interval, args.watch_once, **options)
+        sys.exit(1 if failcntr else 0)
+
+    if args.batch or args.batch_glob:
+        from batch import globjobs, printsummary, readmanifest, runbatch
+
+        if args.batch:
+            batchjobs = readmanifest(args.batch)
+        else:
+            missargs = [name for name in ("defn", "month", "year") if not getattr(args, name)]
+            if missargs:
+                parser.error("--batch-glob needs " + ", ".join("--" + name for name in missargs))
+            batchjobs = globjobs(args.batch_glob, args.defn, args.month, args.year, args.unit)
+
+        summary = runbatch(batchjobs, args.batch_workers, **options)
+        printsummary(summary)
+        if args.summary:
+            with open(args.summary, "w") as summfile:
+                json.dump(summary, summfile, indent=2)
+        sys.exit(1 if summary["failed"] else 0)
+
+    missargs = [name for name in ("defn", "excl", "month", "year", "unit") if not getattr(args, name)]
+    if missargs:
+        parser.error("the following arguments are required: " + ", ".join("--" + name for name in missargs))
+
+    if args.server:
+        from jobserver import submitjob, waitforjob
+
+        jobsdefn = {"defn": args.defn, "excl": args.excl, "month": args.month, "year": args.year, "unit": args.unit}
+        try:
+            jobsrslt = submitjob(args.server, jobsdefn, dict(options, workers=args.workers))
+            print(f"Job: {jobsrslt['id']}")
+            if args.no_wait:
+                sys.exit(0)
+            jobsrslt = waitforjob(args.server, jobsrslt["id"])
+        except (OSError, ValueError) as e:
+            print("Status: Failed")
+            print(f"Result: {e}")
+            sys.exit(1)
+
+        if args.report and jobsrslt["report"]:
+            with open(args.report, "w") as rprtfile:
+                json.dump(jobsrslt["report"], rprtfile, indent=2)
+        print(f"Status: {jobsrslt['status']}")
+        if jobsrslt["result"]:
+            print(f"Result: {jobsrslt['result']}")
+        sys.exit(1 if jobsrslt["status"] == "Failed" else 0)
+
+    from processFiles import processFiles
+    from runreport import RunReport
+
+    runreport = RunReport()
+    procargs = (args.defn, args.excl, args.month, args.year, args.unit, args.debug)
+    procopts = dict(options, workers=args.workers, runreport=runreport)
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        status, result = profiler.runcall(processFiles, *procargs, **procopts)
+        profiler.dump_stats(args.profile)
+    else:
+        status, result = processFiles(*procargs, **procopts)
+
+    if args.report:
+        runreport.writejson(args.report)
     
     print(f"Status: {status}")
     if result:
@@ -3,13 +3,16 @@ import sys
 import os
 from os import path
 import datetime
-import configparser
+import importlib
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import tkinter as tk
 from tkinter import ttk
 from tkinter import filedialog
 from tkinter import messagebox
-from PIL import Image, ImageTk
-from processFiles import processFiles
+from logsetup import setuplogging
+from recipeplan import loadrecipeplan
 
 class Payroll:
     """Main GUI application for Excel payroll file processing.
@@ -18,7 +21,15 @@ class Payroll:
     - Select recipe definition files (INI format)
     - Choose company, month, and year
     - Select payroll Excel files
-    - Process files to generate formatted output sheets
+    - Process files to generate formatted output sheets, on a background
+      thread with a progress bar and a Cancel button
+
+    The recipe and the payroll file are loaded on background threads as soon
+    as they are selected, processing then starts from the loaded files.
+
+    The window is shown before the heavy modules are loaded: the background
+    image and PIL follow once the window is up, and processFiles with openpyxl
+    is imported on a background thread.
     """
 
     def __init__(self, root):
@@ -33,30 +44,15 @@ class Payroll:
         
         self.root.resizable(False, False)
 
-        # Load background image with error handling
-        try:
-            if hasattr(sys, '_MEIPASS'):
-                img_path = os.path.join(sys._MEIPASS, "background.png")
-            else:
-                img_path = os.path.abspath("background.png")
-
-            bg_image = Image.open(img_path)
-            bg_image = bg_image.resize((800, 600))
-            self.bg_photo = ImageTk.PhotoImage(bg_image)
-        except FileNotFoundError:
-            print(f"Warning: Background image not found at {img_path}")
-            self.bg_photo = None
-        except Exception as e:
-            print(f"Warning: Could not load background image: {e}")
-            self.bg_photo = None
-
         #
-        # Create a canvas to display the background image
+        # Create a canvas to display the background image, the image is
+        # loaded once the window is shown
         #
         canvas = tk.Canvas(root, width=800, height=600)
         canvas.pack()
-        if self.bg_photo:
-            canvas.create_image(0, 0, anchor=tk.NW, image=self.bg_photo)
+        self.canvas = canvas
+        self.bg_photo = None
+        self.root.after_idle(self.loadbackground)
 
         self.dropdownwdth = 100
         self.filenamewdth = 400
@@ -140,8 +136,8 @@ class Payroll:
         #
         # Process button
         #
-        process_button = tk.Button(root, text="Process", command=self.process_data)
-        canvas.create_window(self.butnxpos, self.ypos, window=process_button, anchor="nw", width=self.butnwdth)
+        self.process_button = tk.Button(root, text="Process", command=self.process_data)
+        canvas.create_window(self.butnxpos, self.ypos, window=self.process_button, anchor="nw", width=self.butnwdth)
         
         self.butnxpos += self.butnwdth + 10
         #
@@ -150,6 +146,65 @@ class Payroll:
         exit_button = tk.Button(root, text="Exit",    command=root.quit)
         canvas.create_window(self.butnxpos, self.ypos, window=exit_button, anchor="nw", width=self.butnwdth)
 
+        self.butnxpos += self.butnwdth + 10
+        #
+        # Cancel button, only enabled while processing
+        #
+        self.cancel_button = tk.Button(root, text="Cancel", command=self.cancel_processing, state="disabled")
+        canvas.create_window(self.butnxpos, self.ypos, window=self.cancel_button, anchor="nw", width=self.butnwdth)
+
+        #
+        # Progress, to the right of the month and year dropdowns
+        #
+        self.progxpos = self.valuxpos + self.dropdownwdth + 20
+        self.progwdth = self.butnxpos + self.butnwdth - self.progxpos
+
+        self.progbar = ttk.Progressbar(root, orient="horizontal", mode="determinate")
+        canvas.create_window(self.progxpos, self.ypos - 3 * self.yposincr, window=self.progbar, width=self.progwdth, anchor="nw")
+
+        self.progvalu = tk.StringVar()
+        proglabl = tk.Label(root, textvariable=self.progvalu, anchor="w")
+        canvas.create_window(self.progxpos, self.ypos - 2 * self.yposincr, window=proglabl, width=self.progwdth, anchor="nw")
+
+        # The worker thread hands its progress to the Tk thread through a queue
+        self.worker = None
+        self.cancel = threading.Event()
+        self.progqueu = queue.Queue()
+
+        # The selected recipe and payroll file are loaded ahead of processing,
+        # each as (filename, filestamp, future)
+        self.prefetcher = ThreadPoolExecutor(max_workers=2, thread_name_prefix="prefetch")
+        self.rcpeprefetch = None
+        self.prolprefetch = None
+
+        # Import processFiles and openpyxl while the form is filled in
+        self.prefetcher.submit(importlib.import_module, "processFiles")
+
+    def loadbackground(self):
+        """Load the background image and put it behind the form."""
+        from PIL import Image, ImageTk
+
+        # Load background image with error handling
+        try:
+            if hasattr(sys, '_MEIPASS'):
+                img_path = os.path.join(sys._MEIPASS, "background.png")
+            else:
+                img_path = os.path.abspath("background.png")
+
+            bg_image = Image.open(img_path)
+            bg_image = bg_image.resize((800, 600))
+            self.bg_photo = ImageTk.PhotoImage(bg_image)
+        except FileNotFoundError:
+            print(f"Warning: Background image not found at {img_path}")
+            self.bg_photo = None
+        except Exception as e:
+            print(f"Warning: Could not load background image: {e}")
+            self.bg_photo = None
+
+        if self.bg_photo:
+            bg_item = self.canvas.create_image(0, 0, anchor=tk.NW, image=self.bg_photo)
+            self.canvas.tag_lower(bg_item)
+
     
     def rcpeflnmslct(self):
         """Handle recipe file selection and populate company dropdown.
@@ -163,30 +218,119 @@ class Payroll:
         )
         if flnmslct:
             self.rcpeflnmvalu.set(flnmslct)
-            
-            # Parse INI file
-            config = configparser.ConfigParser(delimiters=('='))
-            config.read(flnmslct)
-
-            self.complist = []
-            if "COMPANIES" in config:
-                for compkeyn in config["COMPANIES"].keys():
-                    self.complist.append(config["COMPANIES"].get(compkeyn))
-                self.compdropdown.config(values=self.complist)
-                self.compdropdown.configure(state="readonly")
-                    
+
+            # Compile the recipe in the background, the companies are taken
+            # from the compiled plan once it is ready
+            self.rcpeprefetch = self.startprefetch(flnmslct, loadrecipeplan, flnmslct)
+            self.root.after(50, self.fillcompanies, self.rcpeprefetch)
+
+    def fillcompanies(self, rcpeprefetch):
+        """Fill the company dropdown from a compiled recipe.
+
+        Args:
+            rcpeprefetch: The (filename, filestamp, future) of the recipe
+        """
+        if rcpeprefetch is not self.rcpeprefetch:
+            # Another recipe was selected in the meantime
+            return
+        rcpefutr = rcpeprefetch[2]
+        if not rcpefutr.done():
+            self.root.after(50, self.fillcompanies, rcpeprefetch)
+            return
+
+        try:
+            recipeplan = rcpefutr.result()
+        except Exception as e:
+            self.compdropdown.configure(state="disabled")
+            messagebox.showerror("Error", f"Could not read the recipe file: {e}")
+            return
+
+        self.complist = list(recipeplan.companies)
+        if self.complist:
+            self.compdropdown.config(values=self.complist)
+            self.compdropdown.configure(state="readonly")
+
+    def startprefetch(self, filename, loadfunc, *loadargs):
+        """Start loading a file on the prefetch threads.
+
+        Args:
+            filename: The file that is loaded
+            loadfunc: Function that loads it
+            *loadargs: Arguments of loadfunc
+
+        Returns:
+            tuple: (filename, filestamp, future) of the load
+        """
+        return (filename, self.filestamp(filename), self.prefetcher.submit(loadfunc, *loadargs))
+
+    def filestamp(self, filename):
+        """Return the size and modification time of a file.
+
+        Args:
+            filename: Path to the file
+
+        Returns:
+            tuple: (size, mtime_ns), or None when the file cannot be read
+        """
+        try:
+            filestat = os.stat(filename)
+        except OSError:
+            return None
+        return (filestat.st_size, filestat.st_mtime_ns)
+
+    def takeprefetch(self, prefetch, filename):
+        """Wait for a prefetched file and return what was loaded.
+
+        Args:
+            prefetch: The (filename, filestamp, future) of the load, or None
+            filename: The file that is about to be processed
+
+        Returns:
+            object: The loaded file, or None when it was not prefetched, has
+                    changed since or failed to load. processFiles then loads
+                    it itself and reports any error.
+        """
+        if prefetch is None:
+            return None
+        prefname, prefstamp, preffutr = prefetch
+        if prefname != filename:
+            return None
+        try:
+            loaded = preffutr.result()
+        except Exception:
+            return None
+        if prefstamp is None or prefstamp != self.filestamp(filename):
+            return None
+        return loaded
+
     def prolflnmslct(self):
         """Handle payroll Excel file selection.
         
-        Opens a file dialog to select an Excel (.xlsx) file.
+        Opens a file dialog to select an Excel (.xlsx) file or a CSV or TSV export.
         """
         file_path = filedialog.askopenfilename(
             title="Select Payroll Excel File", 
-            filetypes=[("Excel files", "*.xlsx"), ("All files", "*.*")]
+            filetypes=[("Excel files", "*.xlsx"), ("CSV and TSV exports", "*.csv *.tsv"), ("All files", "*.*")]
         )
         if file_path:
             self.prolflnmvalu.set(file_path)
 
+            # Load the payroll file in the background while the rest is
+            # filled in
+            self.prolprefetch = self.startprefetch(file_path, self.loadpayroll, file_path)
+
+    def loadpayroll(self, filename):
+        """Load a payroll file for processing, on a prefetch thread.
+
+        Args:
+            filename: Path to the payroll file
+
+        Returns:
+            tuple: The payroll file as returned by loadsource
+        """
+        from processFiles import loadsource
+        return loadsource(filename)
+
 
     def yearvalulist(self):
         """Generate a list of years (previous, current, next).
@@ -224,15 +368,105 @@ class Payroll:
             messagebox.showerror("Error", "Please select a Payroll file")
             return
     
-        # Process files and handle result
-        status, result = processFiles(defnfilename, exclfilename, cldrmnth, cldryear, compname, False)
-        
-        if status == "Failed":
-            messagebox.showerror("Error", f"Processing failed: {result}")
-        else:
-            messagebox.showinfo("Success", "Processing completed successfully!")
+        if self.worker is not None:
+            return
+
+        # Process the files on a worker thread, the window stays responsive
+        # and polls the worker for progress
+        self.cancel.clear()
+        self.progbar.configure(value=0, maximum=1)
+        self.progvalu.set("Processing...")
+        self.process_button.configure(state="disabled")
+        self.cancel_button.configure(state="normal")
+
+        # A loaded payroll workbook gets the tabs added, it is used only once
+        rcpeprefetch = self.rcpeprefetch
+        prolprefetch, self.prolprefetch = self.prolprefetch, None
+
+        self.worker = threading.Thread(
+            target=self.process_worker,
+            args=(defnfilename, exclfilename, cldrmnth, cldryear, compname, rcpeprefetch, prolprefetch),
+            daemon=True
+        )
+        self.worker.start()
+        self.root.after(100, self.poll_worker)
+
+    def process_worker(self, defnfilename, exclfilename, cldrmnth, cldryear, compname,
+                       rcpeprefetch=None, prolprefetch=None):
+        """Run processFiles on the worker thread.
+
+        Tk may only be used from the main thread, so the progress and the
+        result are put on the queue for poll_worker.
+
+        Args:
+            defnfilename: Path to the recipe file
+            exclfilename: Path to the payroll file
+            cldrmnth: Calendar month
+            cldryear: Calendar year
+            compname: Company name
+            rcpeprefetch: The prefetch of the recipe, if any
+            prolprefetch: The prefetch of the payroll file, if any
+        """
+        from processFiles import processFiles
+
+        def progress(defnname, sectnmbr, sectcount, rowsdone):
+            self.progqueu.put(("progress", (defnname, sectnmbr, sectcount, rowsdone)))
+
+        try:
+            self.progqueu.put(("status", "Loading files..."))
+            recipeplan = self.takeprefetch(rcpeprefetch, defnfilename)
+            source = self.takeprefetch(prolprefetch, exclfilename)
+            status, result = processFiles(defnfilename, exclfilename, cldrmnth, cldryear, compname, False,
+                                          recipeplan=recipeplan, progress=progress, cancel=self.cancel,
+                                          source=source)
+        except Exception as e:
+            status, result = "Failed", e
+        self.progqueu.put(("done", (status, result)))
+
+    def poll_worker(self):
+        """Show the progress of the worker and its result when it is done."""
+        while True:
+            try:
+                kind, data = self.progqueu.get_nowait()
+            except queue.Empty:
+                self.root.after(100, self.poll_worker)
+                return
+
+            if kind == "status":
+                self.progvalu.set(data)
+                continue
+
+            if kind == "progress":
+                defnname, sectnmbr, sectcount, rowsdone = data
+                self.progbar.configure(value=sectnmbr, maximum=sectcount)
+                self.progvalu.set(f"{defnname}: section {sectnmbr} of {sectcount}, {rowsdone} rows done")
+                continue
+
+            status, result = data
+            self.worker.join()
+            self.worker = None
+            self.process_button.configure(state="normal")
+            self.cancel_button.configure(state="disabled")
+
+            if status == "Failed":
+                self.progvalu.set("Processing failed")
+                messagebox.showerror("Error", f"Processing failed: {result}")
+            elif status == "Cancelled":
+                self.progvalu.set("Processing cancelled")
+            else:
+                self.progvalu.set("Processing completed")
+                messagebox.showinfo("Success", "Processing completed successfully!")
+            return
+
+    def cancel_processing(self):
+        """Ask the worker to stop before its next section."""
+        if self.worker is not None:
+            self.cancel.set()
+            self.progvalu.set("Cancelling...")
+            self.cancel_button.configure(state="disabled")
 
 if __name__ == "__main__":
+    setuplogging()
     root = tk.Tk()
     app = Payroll(root)
     root.mainloop()
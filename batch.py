@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""Batch processing of many payroll files in one invocation.
+
+A batch is a list of jobs, each one a definition file, an Excel payroll file,
+a month, a year and a business unit. Jobs come from a CSV or JSON manifest or
+from a glob of payroll files. Every recipe is compiled once for the whole
+batch and the jobs run concurrently on a pool of worker processes.
+"""
+
+import csv
+import glob
+import json
+import os
+import time
+from os import path
+from concurrent.futures import ProcessPoolExecutor
+
+from logsetup import setuplogging
+from processFiles import isoutputfile, outputsuffixes, processFiles
+from recipeplan import loadrecipeplan
+
+# The fields of a job, in the order of a CSV manifest without a header
+JOB_FIELDS = ["defn", "excl", "month", "year", "unit"]
+
+
+def readmanifest(manifest):
+    """Read the jobs of a batch from a CSV or JSON manifest.
+
+    A JSON manifest is a list of objects with the JOB_FIELDS as keys. A CSV
+    manifest has a header line naming the JOB_FIELDS. Relative file names
+    are taken from the folder of the manifest.
+
+    Args:
+        manifest: Path to the .json or .csv manifest
+
+    Returns:
+        list: Job dictionaries with the JOB_FIELDS as keys
+    """
+    with open(manifest, "r", newline="") as manifile:
+        if manifest.lower().endswith(".json"):
+            jobslist = json.load(manifile)
+        else:
+            jobslist = list(csv.DictReader(manifile))
+
+    manifldr = path.dirname(path.abspath(manifest))
+    batchjobs = []
+    for jobsindx, jobsdefn in enumerate(jobslist, 1):
+        # A short CSV line or a JSON null leaves a field empty, not "None"
+        jobsdefn = {key.strip(): "" if value is None else str(value).strip()
+                    for key, value in jobsdefn.items() if key}
+        missfields = [field for field in JOB_FIELDS if not jobsdefn.get(field)]
+        if missfields:
+            raise ValueError(f"Job {jobsindx} in {manifest} is missing: {', '.join(missfields)}")
+        for field in ("defn", "excl"):
+            jobsdefn[field] = path.join(manifldr, jobsdefn[field])
+        batchjobs.append({field: jobsdefn[field] for field in JOB_FIELDS})
+    return batchjobs
+
+
+def globjobs(pattern, defnfilename, cldrmnth, cldryear, busnunitname=None):
+    """Make a job for every payroll file matching a glob pattern.
+
+    The business unit of a file is the first company of the recipe's
+    [COMPANIES] section that appears in the file name, or busnunitname when
+    none does. The outputs of earlier runs, the tabs workbooks, upload files
+    and split workbooks, are left out by the same rule as in a watched
+    folder.
+
+    Args:
+        pattern: Glob pattern of the Excel payroll files
+        defnfilename: Path to the INI definition file used for all files
+        cldrmnth: Calendar month
+        cldryear: Calendar year
+        busnunitname: Business unit for files that do not name a company
+
+    Returns:
+        list: Job dictionaries with the JOB_FIELDS as keys
+    """
+    recipeplan = loadrecipeplan(defnfilename)
+    complist = recipeplan.companies
+    rcpesuffixes = outputsuffixes(recipeplan)
+    batchjobs = []
+    for exclfilename in sorted(glob.glob(pattern)):
+        if isoutputfile(exclfilename, rcpesuffixes):
+            continue
+        filebase = path.basename(exclfilename).lower()
+        unitname = next((compname for compname in complist if compname.lower() in filebase), busnunitname)
+        batchjobs.append({
+            "defn": defnfilename, "excl": exclfilename,
+            "month": cldrmnth, "year": cldryear, "unit": unitname,
+        })
+    return batchjobs
+
+
+def runbatchjob(jobsdefn, recipeplan, options):
+    """Run one job of a batch, in a worker process.
+
+    The job is one of the batch pool's processes, it does not start a pool
+    of its own: processFiles runs with one worker whatever the options say.
+
+    Args:
+        jobsdefn: Job dictionary with the JOB_FIELDS as keys
+        recipeplan: The compiled RecipePlan of the job's definition file
+        options: Extra keyword arguments for processFiles
+
+    Returns:
+        dict: The job with its status, result and time taken in seconds
+    """
+    strttime = time.perf_counter()
+    if not jobsdefn["unit"]:
+        status, result = "Failed", "No business unit for this file"
+    else:
+        status, result = processFiles(
+            jobsdefn["defn"], jobsdefn["excl"], jobsdefn["month"], jobsdefn["year"],
+            jobsdefn["unit"], False, recipeplan=recipeplan, **dict(options, workers=1)
+        )
+    jobsrslt = dict(jobsdefn)
+    jobsrslt["status"] = status
+    jobsrslt["result"] = str(result)
+    jobsrslt["seconds"] = round(time.perf_counter() - strttime, 3)
+    return jobsrslt
+
+
+def runbatch(batchjobs, workers=None, **options):
+    """Run the jobs of a batch on a pool of worker processes.
+
+    Every distinct definition file is compiled (or taken from the recipe
+    cache) once, up front, and the plan is shared by its jobs. A recipe that
+    cannot be read fails its jobs without stopping the others.
+
+    Args:
+        batchjobs: Job dictionaries with the JOB_FIELDS as keys
+        workers: Number of jobs run at the same time, defaults to the
+                 number of CPUs
+        **options: Extra keyword arguments for processFiles, e.g. readonly
+
+    Returns:
+        dict: Summary with the per job results in manifest order, the
+              number of jobs that failed and the wall time in seconds
+    """
+    strttime = time.perf_counter()
+
+    # Compile every recipe only once
+    recipeplans = {}
+    defnerrs = {}
+    for jobsdefn in batchjobs:
+        defnfilename = jobsdefn["defn"]
+        if defnfilename in recipeplans or defnfilename in defnerrs:
+            continue
+        try:
+            recipeplans[defnfilename] = loadrecipeplan(defnfilename, options.get("usecache", True))
+        except (OSError, ValueError) as e:
+            defnerrs[defnfilename] = str(e)
+
+    jobsrslts = [None] * len(batchjobs)
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=setuplogging) as executor:
+        futures = {}
+        for jobsindx, jobsdefn in enumerate(batchjobs):
+            if jobsdefn["defn"] in defnerrs:
+                jobsrslts[jobsindx] = dict(jobsdefn, status="Failed", result=defnerrs[jobsdefn["defn"]], seconds=0.0)
+                continue
+            future = executor.submit(runbatchjob, jobsdefn, recipeplans[jobsdefn["defn"]], options)
+            futures[future] = jobsindx
+        for future, jobsindx in futures.items():
+            try:
+                jobsrslts[jobsindx] = future.result()
+            except Exception as e:
+                jobsrslts[jobsindx] = dict(batchjobs[jobsindx], status="Failed", result=str(e), seconds=0.0)
+
+    return {
+        "jobs": jobsrslts,
+        "failed": sum(1 for jobsrslt in jobsrslts if jobsrslt["status"] != "Success"),
+        "seconds": round(time.perf_counter() - strttime, 3),
+    }
+
+
+def printsummary(summary):
+    """Print one line per job and a total line for a batch summary.
+
+    Args:
+        summary: Summary as returned by runbatch
+    """
+    for jobsrslt in summary["jobs"]:
+        line = f"{jobsrslt['status']:<8} {jobsrslt['seconds']:>8.2f}s  {jobsrslt['unit']}  {jobsrslt['excl']}"
+        if jobsrslt["result"]:
+            line += f"  ({jobsrslt['result']})"
+        print(line)
+    jobscntr = len(summary["jobs"])
+    print(f"Jobs: {jobscntr}, succeeded: {jobscntr - summary['failed']}, "
+          f"failed: {summary['failed']}, wall time: {summary['seconds']:.2f}s")
@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+"""Throughput benchmark with synthetic payroll workbooks.
+
+Synthetic payroll files are generated from the real column vocabulary in
+maincolumns and Dalisu.ini, at a configurable number of rows and columns and
+with a configurable share of empty or zero values in the _NZ_ columns. Every
+case runs in its own process: processFiles is timed end to end, followed by
+a run of the same work phase by phase (load, header map, filtering, totals,
+populate, save), with the times of every section. Wall times and the peak
+resident memory of each case are written to a JSON results file.
+
+Generated workbooks are kept in the work folder and reused by later runs
+with the same size, density and seed.
+
+Usage:
+    python benchmark.py --rows 1000 10000 100000 --cols 20 200 --output results.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from os import path
+from datetime import datetime, timedelta
+
+from openpyxl import Workbook, load_workbook
+
+from runreport import RunReport, peakmemory
+
+BENCHFLDR = path.dirname(path.abspath(__file__))
+
+# Columns of the synthetic files that are not in maincolumns
+SYNTHETIC_PREFIX = "Earning"
+
+# Employee details every synthetic file has, recipes select on them
+DETAIL_COLUMNS = ["PersonCode", "Surname", "Initials", "IdentityNo", "Gender", "Race"]
+
+# The synthetic recipe needs the detail columns and 8 number columns
+MIN_COLUMNS = len(DETAIL_COLUMNS) + 8
+
+SURNAMES = ["Nkosi", "Dlamini", "Botha", "Naidoo", "van der Merwe", "Mokoena", "Smith", "Pillay",
+            "Khumalo", "Pretorius", "Mahlangu", "Venter", "Zulu", "Ndlovu", "Jacobs", "Sithole"]
+GENDERS = ["M", "F"]
+RACES = ["African", "Coloured", "Indian", "White"]
+
+
+def loadvocabulary():
+    """Return the column names of a payroll file, as they appear in recipes.
+
+    Returns:
+        tuple: (textcols, numbcols) - the employee detail columns and the
+               earning and deduction columns, in maincolumns order
+    """
+    with open(path.join(BENCHFLDR, "maincolumns"), "r") as colmfile:
+        colmnames = [line.strip().replace("_", " ") for line in colmfile if line.strip()]
+
+    frstnumb = colmnames.index("Basic Salary (A000)")
+    textcols = colmnames[:frstnumb]
+    numbcols = [colmname for colmname in colmnames[frstnumb:] if colmname != "Grand Total"]
+
+    # The recipe columns of Dalisu.ini have to be present as well
+    from recipeplan import loadrecipeplan
+    for sectplan in loadrecipeplan(path.join(BENCHFLDR, "Dalisu.ini")).sections:
+        for colmplan in sectplan.columns:
+            if colmplan.aftrcolms is None and colmplan.maincolm not in textcols + numbcols \
+                    and "(" in colmplan.maincolm:
+                numbcols.append(colmplan.maincolm)
+    return textcols, numbcols
+
+
+def pickcolumns(colscntr):
+    """Choose the header row of a synthetic file with colscntr columns.
+
+    Args:
+        colscntr: Number of columns, at least MIN_COLUMNS
+
+    Returns:
+        tuple: (colmhdrs, textcols, numbcols) - the header row and which of
+               its columns hold text and numbers
+    """
+    textvcbl, numbvcbl = loadvocabulary()
+    textcntr = max(len(DETAIL_COLUMNS), min(len(textvcbl), colscntr // 4))
+    textcols = DETAIL_COLUMNS + [colmname for colmname in textvcbl if colmname not in DETAIL_COLUMNS]
+    textcols = sorted(textcols[:textcntr], key=textvcbl.index)
+    numbcntr = colscntr - len(textcols)
+    numbcols = numbvcbl[:numbcntr]
+    numbcols += [f"{SYNTHETIC_PREFIX} {colmnmbr} (X{colmnmbr:03d})"
+                 for colmnmbr in range(1, numbcntr - len(numbcols) + 1)]
+    return textcols + numbcols, textcols, numbcols
+
+
+def textvalue(colmname, rownmbr, rndmgenr):
+    """Make up the value of an employee detail column.
+
+    Args:
+        colmname: Name of the column
+        rownmbr: Number of the employee
+        rndmgenr: random.Random used for the data
+
+    Returns:
+        object: The value of the cell
+    """
+    if colmname == "PersonCode":
+        return f"E{rownmbr:06d}"
+    if colmname == "Surname":
+        return rndmgenr.choice(SURNAMES)
+    if colmname == "Initials":
+        return rndmgenr.choice("ABCDEJKLMNPST") + rndmgenr.choice("ABCDEJKLMNPST")
+    if colmname == "Gender":
+        return rndmgenr.choice(GENDERS)
+    if colmname == "Race":
+        return rndmgenr.choice(RACES)
+    if colmname == "IdentityNo":
+        return f"{rndmgenr.randrange(10 ** 12, 10 ** 13):013d}"
+    if colmname.endswith("Date") or colmname in ("GroupStart", "DateOfBirth"):
+        if colmname == "TermDate" and rndmgenr.random() < 0.9:
+            return None
+        return datetime(1970, 1, 1) + timedelta(days=rndmgenr.randrange(20000))
+    if colmname.endswith("Code"):
+        return rndmgenr.randrange(100, 999)
+    return f"{colmname} {rndmgenr.randrange(1, 20)}"
+
+
+def makeworkbook(exclfilename, rowscntr, colscntr, zerodens, seed=0):
+    """Write a synthetic payroll file.
+
+    The earning and deduction columns are empty or zero in zerodens of the
+    rows, like the sparse deduction columns of a real payroll.
+
+    Args:
+        exclfilename: Path of the .xlsx file to write
+        rowscntr: Number of employees
+        colscntr: Number of columns
+        zerodens: Share (0 to 1) of empty or zero values in number columns
+        seed: Seed of the random data
+    """
+    colmhdrs, textcols, numbcols = pickcolumns(colscntr)
+    rndmgenr = random.Random(seed)
+
+    exclbook = Workbook(write_only=True)
+    exclshet = exclbook.create_sheet("Payroll")
+    exclshet.append(colmhdrs)
+    for rownmbr in range(1, rowscntr + 1):
+        rowvals = [textvalue(colmname, rownmbr, rndmgenr) for colmname in textcols]
+        for colmname in numbcols:
+            if rndmgenr.random() < zerodens:
+                rowvals.append(None if rndmgenr.random() < 0.5 else 0)
+            else:
+                rowvals.append(round(rndmgenr.uniform(10, 50000), 2))
+        exclshet.append(rowvals)
+    exclbook.save(exclfilename)
+
+
+def makerecipe(defnfilename, colmhdrs, textcols, numbcols):
+    """Write a definition file with the kinds of sections found in practice.
+
+    Args:
+        defnfilename: Path of the INI file to write
+        colmhdrs: Header row of the synthetic file
+        textcols: Its employee detail columns
+        numbcols: Its earning and deduction columns
+    """
+    dtalcols = DETAIL_COLUMNS[:3]
+    lines = []
+
+    # One deduction per tab, the usual union or medical aid schedule
+    for dedncolm in numbcols[:3]:
+        lines.append(f"[{dedncolm[-5:-1]}.TAB]")
+        lines.append(f"{dtalcols[0]} = Salary Number _NZ_")
+        lines.extend(f"{colmname} = {colmname}" for colmname in dtalcols[1:])
+        lines.append(f"{dedncolm} = Deducted Amount _NZ_ _SUM_")
+
+    # Several totals with the amounts to pay over added up after them
+    summcols = numbcols[:8]
+    lines.append("[TOTALS]")
+    lines.extend(f"{colmname} = {colmname}" for colmname in dtalcols)
+    lines.extend(f"{colmname} = {colmname} _SUM_" for colmname in summcols)
+    lines.append(f"_FIRST_ = {' + '.join(summcols[:len(summcols) // 2])}")
+    lines.append(f"_SECOND_ = {' + '.join(summcols[len(summcols) // 2:])}")
+
+    # Anyone with any of the medical aid deductions
+    lines.append("[MEDICAL]")
+    lines.extend(f"{colmname} = {colmname}" for colmname in dtalcols)
+    lines.extend(f"{colmname} = {colmname} _ANZ_ _SUM_" for colmname in numbcols[3:7])
+
+    # Every column of the file
+    lines.append("[ALL]")
+    lines.extend(f"{colmname} = {colmname}" for colmname in colmhdrs)
+
+    with open(defnfilename, "w") as defnfile:
+        defnfile.write("\n".join(lines) + "\n")
+
+
+def timephases(defnfilename, exclfilename, engine, readonly):
+    """Run the work of processFiles one phase at a time.
+
+    The workbooks are opened and written the way processFiles does for the
+    same readonly setting, so the phases add up to about its wall time.
+
+    Args:
+        defnfilename: Path to the INI definition file
+        exclfilename: Path to the Excel payroll file
+        engine: "numpy" or "python"
+        readonly: Load the payroll file read-only
+
+    Returns:
+        tuple: (phases, sections) - seconds per phase and, per section, the
+               seconds of its filtering, totals and populate phases
+    """
+    import columnar
+    from processFiles import StyleRegistry, filtrrows, layoutTheSheet, readmainshet, writesheetrows
+    from recipeplan import loadrecipeplan
+
+    phases = dict.fromkeys(["load", "headermap", "filter", "totals", "populate", "save"], 0.0)
+    sections = {}
+
+    strttime = time.perf_counter()
+    exclmainbook = load_workbook(exclfilename, read_only=readonly, data_only=True)
+    exclmainshet = exclmainbook[exclmainbook.sheetnames[0]]
+    phases["load"] = time.perf_counter() - strttime
+
+    strttime = time.perf_counter()
+    maincolmhdrs, mainrows = readmainshet(exclmainshet)
+    sectbinds = [(sectplan.defnname, sectplan.bind(maincolmhdrs))
+                 for sectplan in loadrecipeplan(defnfilename, usecache=False).sections]
+    maintabl = columnar.ColumnTable(mainrows) if engine == "numpy" else None
+    phases["headermap"] = time.perf_counter() - strttime
+
+    if readonly:
+        exclmainbook.close()
+        destbook = Workbook()
+    else:
+        destbook = exclmainbook
+    cellstyl = StyleRegistry()
+    for defnname, sectbind in sectbinds:
+        if sectbind is None:
+            continue
+        thisdefn, totlcols, nzrocols, anzrcols, aftrtotldefn = sectbind
+        srcecols = [maincolmhdrs[maincolm] - 1 for maincolm, thiscolm in thisdefn]
+
+        strttime = time.perf_counter()
+        numbspan = None
+        if maintabl is not None:
+            destrows, keptindx, numbspan = maintabl.filtrsection(srcecols, totlcols, nzrocols, anzrcols)
+        else:
+            destrows = list(filtrrows(mainrows, srcecols, nzrocols, anzrcols))
+            destrows = [tuple(0.00 if destvals[colmnmbr - 1] is None and colmnmbr in totlcols else valu
+                              for colmnmbr, valu in enumerate(destvals, 1)) for destvals in destrows]
+        filttime = time.perf_counter() - strttime
+
+        totltime = popltime = 0.0
+        if destrows:
+            strttime = time.perf_counter()
+            sheetrows, mergrnge, colsused = layoutTheSheet(
+                destrows, thisdefn, defnname, "Benchmark", "Jun", "2025", totlcols, aftrtotldefn, numbspan
+            )
+            totltime = time.perf_counter() - strttime
+
+            strttime = time.perf_counter()
+            destshet = destbook.create_sheet(title=defnname)
+            writesheetrows(destshet, sheetrows, mergrnge, colsused, cellstyl)
+            popltime = time.perf_counter() - strttime
+
+        sections[defnname] = {
+            "headcount": len(destrows), "filter": round(filttime, 4),
+            "totals": round(totltime, 4), "populate": round(popltime, 4),
+        }
+        phases["filter"] += filttime
+        phases["totals"] += totltime
+        phases["populate"] += popltime
+
+    strttime = time.perf_counter()
+    destbook.save(exclfilename.replace(".xlsx", " Phases.xlsx"))
+    phases["save"] = time.perf_counter() - strttime
+
+    os.remove(exclfilename.replace(".xlsx", " Phases.xlsx"))
+    return {phase: round(secs, 4) for phase, secs in phases.items()}, sections
+
+
+def runcase(defnfilename, exclfilename, engine, readonly):
+    """Run one benchmark case, in the process of its own.
+
+    Args:
+        defnfilename: Path to the INI definition file
+        exclfilename: Path to the Excel payroll file
+        engine: "auto", "numpy" or "python"
+        readonly: Load the payroll file read-only
+
+    Returns:
+        dict: Wall time, phase and section times, peak memory and the run
+              report of processFiles for the case
+    """
+    import columnar
+    from processFiles import processFiles
+
+    logging.getLogger().setLevel(logging.WARNING)
+    if engine == "auto":
+        engine = "numpy" if columnar.available() else "python"
+
+    # Without the caches every run loads and parses the payroll file, which
+    # is what the case measures, and the cache folder is left alone
+    runreport = RunReport()
+    strttime = time.perf_counter()
+    status, result = processFiles(defnfilename, exclfilename, "Jun", "2025", "Benchmark", False,
+                                  readonly=readonly, engine=engine, runreport=runreport,
+                                  usecache=False)
+    walltime = time.perf_counter() - strttime
+    peakrss = peakmemory()
+    if status != "Success":
+        raise RuntimeError(f"processFiles failed on {exclfilename}: {result}")
+    os.remove(exclfilename.replace(".xlsx", " Tabs.xlsx"))
+
+    phases, sections = timephases(defnfilename, exclfilename, engine, readonly)
+    return {
+        "engine": engine, "readonly": readonly, "wall": round(walltime, 4),
+        "peakrss_kb": peakrss, "phases": phases, "sections": sections,
+        "report": runreport.todict(),
+    }
+
+
+def main():
+    """Generate the workbooks, run every case and write the results."""
+    parser = argparse.ArgumentParser(description="Benchmark processFiles on synthetic payroll workbooks")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="Numbers of rows to test (default: 1000 10000 100000)")
+    parser.add_argument("--cols", type=int, nargs="+", default=[20, 200],
+                        help="Numbers of columns to test (default: 20 200)")
+    parser.add_argument("--zero-density", type=float, default=0.3,
+                        help="Share of empty or zero values in number columns (default: 0.3)")
+    parser.add_argument("--engine", choices=["auto", "numpy", "python"], default="auto",
+                        help="Row filtering engine of processFiles (default: auto)")
+    parser.add_argument("--read-only", action="store_true", help="Load the payroll files read-only")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic data (default: 0)")
+    parser.add_argument("--workdir", default=path.join(BENCHFLDR, "benchdata"),
+                        help="Folder for the generated workbooks (default: ./benchdata)")
+    parser.add_argument("--output", default="benchmark.json", help="JSON results file (default: benchmark.json)")
+    parser.add_argument("--case", nargs=4, metavar=("DEFN", "EXCL", "ENGINE", "READONLY"),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # A single case, run by the parent in a fresh process
+    if args.case:
+        defnfilename, exclfilename, engine, readonly = args.case
+        json.dump(runcase(defnfilename, exclfilename, engine, readonly == "True"), sys.stdout)
+        return
+
+    if min(args.cols) < MIN_COLUMNS:
+        parser.error(f"--cols must be at least {MIN_COLUMNS}")
+
+    os.makedirs(args.workdir, exist_ok=True)
+    results = {
+        "started": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cases": [],
+    }
+    for colscntr in args.cols:
+        colmhdrs, textcols, numbcols = pickcolumns(colscntr)
+        defnfilename = path.join(args.workdir, f"bench-{colscntr}c.ini")
+        makerecipe(defnfilename, colmhdrs, textcols, numbcols)
+
+        for rowscntr in args.rows:
+            exclfilename = path.join(
+                args.workdir, f"bench-{rowscntr}r-{colscntr}c-{args.zero_density:g}z-{args.seed}s.xlsx"
+            )
+            gnrttime = None
+            if not path.exists(exclfilename):
+                print(f"Generating {path.basename(exclfilename)}", flush=True)
+                strttime = time.perf_counter()
+                makeworkbook(exclfilename, rowscntr, colscntr, args.zero_density, args.seed)
+                gnrttime = round(time.perf_counter() - strttime, 2)
+
+            print(f"Running {rowscntr} rows x {colscntr} columns", flush=True)
+            caseproc = subprocess.run(
+                [sys.executable, path.abspath(__file__), "--case",
+                 defnfilename, exclfilename, args.engine, str(args.read_only)],
+                capture_output=True, text=True, cwd=BENCHFLDR
+            )
+            if caseproc.returncode != 0:
+                print(caseproc.stderr, file=sys.stderr)
+                sys.exit(f"Case {path.basename(exclfilename)} failed")
+
+            caserslt = {"rows": rowscntr, "cols": colscntr, "zerodensity": args.zero_density,
+                        "generate": gnrttime}
+            caserslt.update(json.loads(caseproc.stdout))
+            results["cases"].append(caserslt)
+            print(f"  wall {caserslt['wall']:.2f}s, peak RSS {caserslt['peakrss_kb']} KB, "
+                  + ", ".join(f"{phase} {secs:.2f}s" for phase, secs in caserslt["phases"].items()),
+                  flush=True)
+
+    with open(args.output, "w") as rsltfile:
+        json.dump(results, rsltfile, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
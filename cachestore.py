@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""On-disk cache helpers.
+
+Cached objects are pickled into a per-user cache folder. Writes go to a
+temporary file that replaces the cache entry in one step, so a reader never
+sees half a file, and a cache that cannot be read or written only costs the
+work it would have saved. Reading an entry marks it as recently used, so a
+cache folder that grows past its size limit loses its least recently used
+entries first.
+"""
+
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+from os import path
+
+logger = logging.getLogger(__name__)
+
+# Size limit of a cache folder in MB, $PAROOL_CACHE_MB when set
+CACHE_LIMIT_MB = 512
+
+
+def cachefldr(kind):
+    """Return (and create) the cache folder for one kind of cached object.
+
+    The base folder is $PAROOL_CACHE_DIR when set, otherwise the platform's
+    user cache folder.
+
+    Args:
+        kind: Name of the sub folder, e.g. "recipes"
+
+    Returns:
+        str: Path of the folder
+    """
+    basefldr = os.environ.get("PAROOL_CACHE_DIR")
+    if not basefldr:
+        basefldr = os.environ.get("LOCALAPPDATA") or os.environ.get("XDG_CACHE_HOME") \
+            or path.join(path.expanduser("~"), ".cache")
+        basefldr = path.join(basefldr, "parool")
+    thisfldr = path.join(basefldr, kind)
+    os.makedirs(thisfldr, exist_ok=True)
+    return thisfldr
+
+
+def cacheentry(kind, filename):
+    """Return the cache entry of a file, one entry per path.
+
+    Args:
+        kind: Name of the cache folder, e.g. "recipes"
+        filename: Path of the file the entry is made from
+
+    Returns:
+        str: Path of the cache entry
+    """
+    fullname = path.abspath(filename)
+    return path.join(cachefldr(kind), hashlib.sha1(fullname.encode("utf-8")).hexdigest() + ".pickle")
+
+
+def cachelimit():
+    """Return the size limit of a cache folder.
+
+    Returns:
+        int: Limit in bytes
+    """
+    try:
+        limitmb = float(os.environ.get("PAROOL_CACHE_MB", CACHE_LIMIT_MB))
+    except ValueError:
+        limitmb = CACHE_LIMIT_MB
+    return int(limitmb * 1024 * 1024)
+
+
+def prunecache(kind, maxbytes=None):
+    """Remove the least recently used entries until a cache fits its limit.
+
+    Args:
+        kind: Name of the cache folder
+        maxbytes: Size limit in bytes, cachelimit() when omitted
+
+    Returns:
+        int: Number of entries removed
+    """
+    if maxbytes is None:
+        maxbytes = cachelimit()
+    thisfldr = cachefldr(kind)
+    entries = []
+    for entryname in os.listdir(thisfldr):
+        try:
+            entrstat = os.stat(path.join(thisfldr, entryname))
+        except OSError:
+            continue
+        entries.append((entrstat.st_mtime, entrstat.st_size, entryname))
+
+    totlsize = sum(entrsize for entrtime, entrsize, entryname in entries)
+    removed = 0
+    for entrtime, entrsize, entryname in sorted(entries):
+        if totlsize <= maxbytes:
+            break
+        try:
+            os.unlink(path.join(thisfldr, entryname))
+        except OSError:
+            continue
+        totlsize -= entrsize
+        removed += 1
+        logger.debug("Removed cache entry %s of %s", entryname, kind)
+    return removed
+
+
+def clearcache(kind=None):
+    """Remove every entry of a cache, or of all caches.
+
+    Args:
+        kind: Name of the cache folder, all of them when omitted
+
+    Returns:
+        int: Number of entries removed
+    """
+    basefldr = path.dirname(cachefldr(kind or "recipes"))
+    kinds = [kind] if kind else os.listdir(basefldr)
+    removed = 0
+    for thiskind in kinds:
+        thisfldr = path.join(basefldr, thiskind)
+        if not path.isdir(thisfldr):
+            continue
+        for entryname in os.listdir(thisfldr):
+            try:
+                os.unlink(path.join(thisfldr, entryname))
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+def filedigest(filename):
+    """Compute the SHA-256 of a file's content.
+
+    Args:
+        filename: Path to the file
+
+    Returns:
+        str: Hex digest of the content
+    """
+    digest = hashlib.sha256()
+    with open(filename, "rb") as filehndl:
+        for chunk in iter(lambda: filehndl.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def readcache(cachefile):
+    """Load a cached object.
+
+    Args:
+        cachefile: Path of the cache entry
+
+    Returns:
+        object: The cached object, or None when it is missing or unreadable
+    """
+    try:
+        with open(cachefile, "rb") as filehndl:
+            cacheobjt = pickle.load(filehndl)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.debug("Ignoring unreadable cache entry %s: %s", cachefile, e)
+        return None
+
+    # Mark the entry as recently used
+    try:
+        os.utime(cachefile)
+    except OSError:
+        pass
+    return cacheobjt
+
+
+def writecache(cachefile, cacheobjt):
+    """Store an object in the cache.
+
+    Args:
+        cachefile: Path of the cache entry
+        cacheobjt: The object to pickle
+
+    Returns:
+        bool: True when the entry was written
+    """
+    try:
+        os.makedirs(path.dirname(cachefile), exist_ok=True)
+        filehndl, tempname = tempfile.mkstemp(dir=path.dirname(cachefile), suffix=".tmp")
+        try:
+            with os.fdopen(filehndl, "wb") as tempobjt:
+                pickle.dump(cacheobjt, tempobjt, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tempname, cachefile)
+        except BaseException:
+            os.unlink(tempname)
+            raise
+    except OSError as e:
+        logger.debug("Could not write cache entry %s: %s", cachefile, e)
+        return False
+    return True
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""Optional NumPy engine for filtering the rows of a section and adding them up.
+
+The arrays are views of the buffers of the RowStore of the main sheet. The
+first time a column is used by any section its numeric values and its empty
+/ zero flags are worked out once from its buffers and its dictionary, after
+that the _NZ_ and _ANZ_ rules, the positions of the numbers in the _SUM_
+columns and the control totals are vectorised operations over those arrays.
+Only the rows that survive are read out of the RowStore as Python tuples for
+the layout.
+
+NumPy is not a requirement: when it cannot be imported available() is False
+and processFiles keeps to the plain Python path. It is imported on the first
+call of available(), not when this module is, so a run that does not use the
+engine does not pay for loading it.
+"""
+
+import rowstore
+
+# NumPy once imported, False when it is not installed
+np = None
+
+
+def available():
+    """Check whether the NumPy engine can be used, importing NumPy on first use.
+
+    Returns:
+        bool: True when NumPy could be imported
+    """
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            np = False
+        else:
+            np = numpy
+    return np is not False
+
+
+class ColumnTable:
+    """The main sheet as arrays, with per column flags built on first use."""
+
+    def __init__(self, mainrows):
+        """Take the rows of the main sheet.
+
+        Args:
+            mainrows: RowStore of the main Excel sheet as read by readmainshet
+        """
+        if not available():
+            raise ImportError("The numpy engine needs NumPy to be installed")
+        self.mainrows = mainrows
+        self.rowscntr = len(mainrows)
+        self.colmflgs = {}
+
+    def columnflags(self, colmindx):
+        """Return the arrays describing one source column.
+
+        Args:
+            colmindx: Zero based index of the column in the main sheet
+
+        Returns:
+            tuple: (numbvals, isnumb, isnone, iszero) - the numbers with 0
+                   elsewhere, and the masks of the numbers, the empty cells
+                   and the values that count as empty for the _NZ_ rule
+        """
+        colmflgs = self.colmflgs.get(colmindx)
+        if colmflgs is None:
+            column = self.mainrows.columns[colmindx]
+
+            # What every value of the dictionary is, code 0 is the empty cell
+            dictisnumb = np.array([isinstance(valu, (int, float)) and not isinstance(valu, bool)
+                                   for valu in column.dictvals], dtype=bool)
+            dictnumb = np.array([float(valu) if isnumb else 0.0
+                                 for valu, isnumb in zip(column.dictvals, dictisnumb)], dtype=float)
+            dictisblnk = np.array([isinstance(valu, str) and valu.strip() == "" for valu in column.dictvals],
+                                  dtype=bool)
+
+            if column.codes is not None:
+                codes = np.frombuffer(column.codes, dtype=column.codes.typecode)
+                isnumb = dictisnumb[codes]
+                numbvals = dictnumb[codes]
+                isnone = codes == 0
+                isblnk = dictisblnk[codes]
+            else:
+                values = np.frombuffer(column.values, dtype=float)
+                if column.kinds is None:
+                    kinds = np.full(self.rowscntr, rowstore.FLOAT, dtype=np.uint8)
+                else:
+                    kinds = np.frombuffer(column.kinds, dtype=np.uint8)
+                iscoded = kinds == rowstore.CODED
+                codes = np.where(iscoded, values, 0).astype(np.intp)
+                isnumb = (kinds == rowstore.FLOAT) | (kinds == rowstore.INT) | dictisnumb[codes]
+                numbvals = np.where(iscoded, dictnumb[codes], values)
+                isnone = kinds == rowstore.NULL
+                isblnk = dictisblnk[codes]
+            iszero = isnone | isblnk | (isnumb & (np.abs(numbvals) < 1e-12))
+            colmflgs = (numbvals, isnumb, isnone, iszero)
+            self.colmflgs[colmindx] = colmflgs
+        return colmflgs
+
+    def keepmask(self, srcecols, nzrocols, anzrcols):
+        """Work out which rows pass the _NZ_ and _ANZ_ rules.
+
+        Args:
+            srcecols: Zero based main sheet index of every report column
+            nzrocols: List of column indices that must be non-zero
+            anzrcols: List of column indices for any-non-zero check
+
+        Returns:
+            ndarray: Boolean mask over the rows of the main sheet
+        """
+        keep = np.ones(self.rowscntr, dtype=bool)
+
+        # _NZ_ columns may not be empty or zero
+        for colmnmbr in nzrocols:
+            keep &= ~self.columnflags(srcecols[colmnmbr - 1])[3]
+
+        # At least one of the _ANZ_ columns must have a value
+        if anzrcols:
+            anzrsumm = np.zeros(self.rowscntr, dtype=float)
+            for colmnmbr in anzrcols:
+                anzrsumm += np.abs(self.columnflags(srcecols[colmnmbr - 1])[0])
+            keep &= anzrsumm != 0
+
+        return keep
+
+    def filtrsection(self, srcecols, totlcols, nzrocols, anzrcols):
+        """Project and filter the rows of a section.
+
+        Empty values in the columns being added up become 0.00, the same as
+        on the plain Python path.
+
+        Args:
+            srcecols: Zero based main sheet index of every report column
+            totlcols: List of column indices to total
+            nzrocols: List of column indices that must be non-zero
+            anzrcols: List of column indices for any-non-zero check
+
+        Returns:
+            tuple: (destrows, keptindx, numbspan) - the kept rows as tuples,
+                   their indices in the main sheet and, per total column,
+                   the offsets of the first and last kept row with a number
+        """
+        keptindx = np.flatnonzero(self.keepmask(srcecols, nzrocols, anzrcols))
+        keptlist = keptindx.tolist()
+        destcols = [self.mainrows.take(srcecolm, keptlist) for srcecolm in srcecols]
+
+        numbspan = {}
+        for colmnmbr in totlcols:
+            numbvals, isnumb, isnone, iszero = self.columnflags(srcecols[colmnmbr - 1])
+            keptnone = isnone[keptindx]
+            if keptnone.any():
+                destcols[colmnmbr - 1] = [0.00 if valu is None else valu for valu in destcols[colmnmbr - 1]]
+            numbposn = np.flatnonzero(isnumb[keptindx] | keptnone)
+            if numbposn.size:
+                numbspan[colmnmbr] = (int(numbposn[0]), int(numbposn[-1]))
+
+        destrows = list(zip(*destcols)) if destcols else [()] * len(keptlist)
+        return destrows, keptindx, numbspan
+
+    def sectiontotals(self, keptindx, srcecols, totlcols, aftrtotldefn):
+        """Add up the kept rows of a section.
+
+        These are the values the =SUM formulas of the sheet work out to, so
+        they can be checked without opening the workbook in Excel.
+
+        Args:
+            keptindx: Indices of the kept rows as returned by filtrsection
+            srcecols: Zero based main sheet index of every report column
+            totlcols: List of column indices to total
+            aftrtotldefn: Dictionary of additional totals to add after main totals
+
+        Returns:
+            dict: "colmtotl" the total of each _SUM_ column, "rowstotl" the
+                  array of row totals, "grndtotl" the total of the row
+                  totals and "aftrtotl" the total of each _NAME_ line
+        """
+        colmtotl = {}
+        rowstotl = np.zeros(len(keptindx), dtype=float)
+        for colmnmbr in totlcols:
+            numbvals = self.columnflags(srcecols[colmnmbr - 1])[0][keptindx]
+            colmtotl[colmnmbr] = float(numbvals.sum())
+            rowstotl += numbvals
+
+        aftrtotl = {}
+        for aftrname, aftrcols in aftrtotldefn.items():
+            aftrtotl[aftrname] = float(sum(colmtotl[colmnmbr] for colmnmbr in aftrcols))
+
+        return {
+            "colmtotl": colmtotl,
+            "rowstotl": rowstotl,
+            "grndtotl": float(rowstotl.sum()),
+            "aftrtotl": aftrtotl,
+        }
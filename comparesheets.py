@@ -2,128 +2,522 @@
 """Excel workbook comparison utility.
 
 This script compares two Excel workbooks for differences in content,
-formatting, and structure.
+formatting, and structure. Both workbooks are streamed read-only in a single
+pass and every difference is collected into a machine-readable report.
+
+Rows are compared by position, or aligned on a key column such as
+PersonCode or Salary Number: the rows of the first sheet are indexed on
+their key, so an employee that was added or removed shows up as one row
+and not as a shift of every row below it.
+
+In fingerprint mode a content hash of every sheet is cached next to each
+workbook, sheets with the same hash on both sides are skipped and the other
+sheets are compared on a process pool.
 """
 
+import argparse
+import hashlib
+import json
+import os
 import sys
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from itertools import zip_longest
+
 import openpyxl
+from openpyxl.utils import get_column_letter
+
+# Number of rows searched for the header with the key column
+HEADER_ROWS = 50
+
+# Bump when the content of a fingerprint changes, older caches are then
+# computed again
+FINGERPRINT_VERSION = 1
 
 
-def load_workbook(path):
+def load_workbook(path, read_only=True):
     """Load an Excel workbook with formulas evaluated.
-    
+
     Args:
         path: Path to the Excel file
-        
+        read_only: Stream the workbook instead of loading it in full
+
     Returns:
         openpyxl.Workbook: The loaded workbook
     """
-    return openpyxl.load_workbook(path, data_only=True)
+    return openpyxl.load_workbook(path, read_only=read_only, data_only=True)
+
+
+def cell_signature(cell, styles=True):
+    """Reduce a cell to the parts that are compared.
+
+    Cells that are not stored in a read-only sheet have no format, their
+    format is not compared.
+
+    Args:
+        cell: The cell, regular or read-only, or None past the end of a row
+        styles: Include the font and number format
+
+    Returns:
+        tuple: (value, format) where format is (font, number_format) or None
+    """
+    if cell is None:
+        return None, None
+    if not styles or cell.font is None:
+        return cell.value, None
+    font = cell.font
+    return cell.value, ((font.name, font.size, font.bold, font.italic), cell.number_format)
+
+
+def cell_differences(sig1, sig2):
+    """List how two cell signatures differ.
+
+    Args:
+        sig1: Signature of the first cell from cell_signature
+        sig2: Signature of the second cell from cell_signature
+
+    Returns:
+        list: (what, old, new) for the value, font and number format
+    """
+    value1, format1 = sig1
+    value2, format2 = sig2
+    differences = []
+
+    # Compare value (literal or evaluated formula result)
+    if value1 != value2:
+        differences.append(("value", value1, value2))
+
+    # Compare font properties and number format (e.g., date vs plain number)
+    if format1 is not None and format2 is not None:
+        if format1[0] != format2[0]:
+            differences.append(("font", list(format1[0]), list(format2[0])))
+        if format1[1] != format2[1]:
+            differences.append(("number_format", format1[1], format2[1]))
+    return differences
 
 
 def compare_cells(cell1, cell2):
     """Compare two cells for equality in value and formatting.
-    
+
     Args:
         cell1: First cell to compare
         cell2: Second cell to compare
-        
+
     Returns:
         bool: True if cells are equal, False otherwise
     """
-    # Compare value (literal or evaluated formula result)
-    if cell1.value != cell2.value:
-        return False
+    return not cell_differences(cell_signature(cell1), cell_signature(cell2))
+
+
+def sheet_rows(sheet, styles=True):
+    """Stream the rows of a worksheet as cell signatures.
+
+    Args:
+        sheet: The worksheet
+        styles: Include the font and number format
+
+    Yields:
+        tuple: (row number, list of cell signatures)
+    """
+    for rownmbr, row in enumerate(sheet.iter_rows(min_row=1), 1):
+        yield rownmbr, [cell_signature(cell, styles) for cell in row]
+
+
+def row_differences(name, row1, row2, key=None):
+    """Compare two rows cell by cell.
+
+    Args:
+        name: Name of the sheet
+        row1: (row number, signatures) of the first sheet
+        row2: (row number, signatures) of the second sheet
+        key: Key value the rows were aligned on
+
+    Yields:
+        dict: One difference for every cell part that differs
+    """
+    rownmbr1, sigs1 = row1
+    rownmbr2, sigs2 = row2
+    for colmnmbr, (sig1, sig2) in enumerate(zip_longest(sigs1, sigs2, fillvalue=(None, None)), 1):
+        for what, old, new in cell_differences(sig1, sig2):
+            colmltr = get_column_letter(colmnmbr)
+            yield {
+                "sheet": name, "type": "cell", "key": key,
+                "cell1": f"{colmltr}{rownmbr1}", "cell2": f"{colmltr}{rownmbr2}",
+                "what": what, "old": old, "new": new,
+            }
+
+
+def row_change(name, kind, row, key=None):
+    """Describe a row that is only in one of the sheets.
+
+    Args:
+        name: Name of the sheet
+        kind: "row_removed" for the first sheet, "row_added" for the second
+        row: (row number, signatures) of the row
+        key: Key value of the row
+
+    Returns:
+        dict: The difference
+    """
+    rownmbr, sigs = row
+    rowfield = "row1" if kind == "row_removed" else "row2"
+    return {"sheet": name, "type": kind, "key": key, rowfield: rownmbr,
+            "values": [value for value, cellformat in sigs]}
+
+
+def find_key_column(rowsiter, key):
+    """Read the rows above and including the header with the key column.
+
+    Args:
+        rowsiter: Iterator from sheet_rows
+        key: Header of the key column
+
+    Returns:
+        tuple: (toprows, keyindex) - the rows read and the position of the
+               key in the header, None when it was not found within
+               HEADER_ROWS rows
+    """
+    toprows = []
+    for row in rowsiter:
+        toprows.append(row)
+        values = [value for value, cellformat in row[1]]
+        if key in values:
+            return toprows, values.index(key)
+        if len(toprows) >= HEADER_ROWS:
+            break
+    return toprows, None
+
+
+def row_key(row, keyindex):
+    """Return the key value of a row, None when it has none.
+
+    Args:
+        row: (row number, signatures) of the row
+        keyindex: Position of the key column
+
+    Returns:
+        object: The key value
+    """
+    sigs = row[1]
+    if keyindex >= len(sigs):
+        return None
+    value = sigs[keyindex][0]
+    if value is None or (isinstance(value, str) and value.strip() == ""):
+        return None
+    return value
+
+
+def diff_rows_by_position(name, rows1, rows2):
+    """Compare two row streams row by row.
+
+    Args:
+        name: Name of the sheet
+        rows1: Rows of the first sheet from sheet_rows
+        rows2: Rows of the second sheet from sheet_rows
 
-    # Compare font properties
-    f1, f2 = cell1.font, cell2.font
-    if (
-        f1.name != f2.name or
-        f1.size != f2.size or
-        f1.bold != f2.bold or
-        f1.italic != f2.italic
-    ):
-        return False
+    Yields:
+        dict: Every difference
+    """
+    for row1, row2 in zip_longest(rows1, rows2):
+        if row2 is None:
+            yield row_change(name, "row_removed", row1)
+        elif row1 is None:
+            yield row_change(name, "row_added", row2)
+        else:
+            yield from row_differences(name, row1, row2)
+
+
+def diff_sheets(name, sheet1, sheet2, key=None, styles=True):
+    """Compare two worksheets in one streaming pass.
 
-    # Compare number format (e.g., date vs plain number)
-    if cell1.number_format != cell2.number_format:
-        return False
+    Without a key the rows are compared by position. With a key the rows
+    above and including the header are compared by position and the rows
+    below it are matched on the value in the key column. Rows without a
+    key, like the grand total, are matched in the order they appear.
 
-    return True
+    Args:
+        name: Name of the sheet, for the report
+        sheet1: First worksheet to compare
+        sheet2: Second worksheet to compare
+        key: Header of the column to align the rows on, or None
+        styles: Compare the font and number format as well as the value
+
+    Yields:
+        dict: Every difference between the sheets
+    """
+    if sheet1.max_row != sheet2.max_row or sheet1.max_column != sheet2.max_column:
+        yield {
+            "sheet": name, "type": "dimensions",
+            "old": f"{sheet1.max_row}x{sheet1.max_column}",
+            "new": f"{sheet2.max_row}x{sheet2.max_column}",
+        }
+
+    rows1 = sheet_rows(sheet1, styles)
+    rows2 = sheet_rows(sheet2, styles)
+    if key is None:
+        yield from diff_rows_by_position(name, rows1, rows2)
+        return
+
+    toprows1, keyindex1 = find_key_column(rows1, key)
+    toprows2, keyindex2 = find_key_column(rows2, key)
+    if keyindex1 is None or keyindex2 is None:
+        yield {"sheet": name, "type": "key_not_found", "key": key,
+               "in_file1": keyindex1 is not None, "in_file2": keyindex2 is not None}
+        yield from diff_rows_by_position(name, toprows1 + list(rows1), toprows2 + list(rows2))
+        return
+
+    yield from diff_rows_by_position(name, toprows1, toprows2)
+
+    # Index the rows of the first sheet on their key
+    keyindex = {}
+    unkeyed1 = deque()
+    for row1 in rows1:
+        rowkey = row_key(row1, keyindex1)
+        if rowkey is None:
+            unkeyed1.append(row1)
+        else:
+            keyindex.setdefault(rowkey, deque()).append(row1)
+
+    # Match the rows of the second sheet against the index
+    for row2 in rows2:
+        rowkey = row_key(row2, keyindex2)
+        if rowkey is None:
+            if unkeyed1:
+                yield from row_differences(name, unkeyed1.popleft(), row2)
+            else:
+                yield row_change(name, "row_added", row2)
+            continue
+        matches = keyindex.get(rowkey)
+        if matches:
+            yield from row_differences(name, matches.popleft(), row2, rowkey)
+        else:
+            yield row_change(name, "row_added", row2, rowkey)
+
+    # Whatever is left of the first sheet is not in the second one
+    leftover = [(row1, rowkey) for rowkey, matches in keyindex.items() for row1 in matches]
+    leftover.extend((row1, None) for row1 in unkeyed1)
+    for row1, rowkey in sorted(leftover, key=lambda item: item[0][0]):
+        yield row_change(name, "row_removed", row1, rowkey)
 
 
 def sheets_are_equal(sheet1, sheet2):
     """Compare two worksheets for equality.
-    
+
     Args:
         sheet1: First worksheet to compare
         sheet2: Second worksheet to compare
-        
+
     Returns:
         bool: True if sheets are equal, False otherwise
     """
-    if sheet1.max_row != sheet2.max_row or sheet1.max_column != sheet2.max_column:
-        print(f"Sheet dimensions differ: {sheet1.max_row}x{sheet1.max_column} vs {sheet2.max_row}x{sheet2.max_column}")
-        return False
+    difference = next(diff_sheets(sheet1.title, sheet1, sheet2), None)
+    if difference is not None:
+        print(f"Difference in '{sheet1.title}': {difference}")
+    return difference is None
+
+
+def sheet_fingerprint(sheet, styles=True):
+    """Hash the compared content of a worksheet.
+
+    Args:
+        sheet: The worksheet
+        styles: Include the font and number format
+
+    Returns:
+        str: Hex digest of the values (and formats) of every cell
+    """
+    digest = hashlib.sha256()
+    for rownmbr, sigs in sheet_rows(sheet, styles):
+        digest.update(repr(sigs).encode("utf-8"))
+        digest.update(b"\n")
+    return digest.hexdigest()
 
-    for row in range(1, sheet1.max_row + 1):
-        for col in range(1, sheet1.max_column + 1):
-            c1 = sheet1.cell(row, col)
-            c2 = sheet2.cell(row, col)
-            if not compare_cells(c1, c2):
-                print(f"Difference at {c1.coordinate}: '{c1.value}' != '{c2.value}'")
-                return False
-    return True
 
+def fingerprint_file(path):
+    """Return the name of the fingerprint cache kept next to a workbook.
+
+    Args:
+        path: Path to the Excel file
+
+    Returns:
+        str: Path of the cache file
+    """
+    return path + ".fingerprint.json"
+
+
+def workbook_fingerprints(path, styles=True, usecache=True):
+    """Return the fingerprint of every sheet of a workbook.
+
+    The fingerprints are cached next to the workbook and used again as long
+    as its size and modification time do not change.
+
+    Args:
+        path: Path to the Excel file
+        styles: Include the font and number format
+        usecache: Read and write the fingerprint cache
+
+    Returns:
+        dict: Sheet name to fingerprint, in workbook order
+    """
+    filestat = os.stat(path)
+    cachekey = [FINGERPRINT_VERSION, filestat.st_size, filestat.st_mtime_ns, styles]
+    if usecache:
+        try:
+            with open(fingerprint_file(path), "r") as cachfile:
+                cached = json.load(cachfile)
+            if cached.get("key") == cachekey:
+                return cached["sheets"]
+        except (OSError, ValueError):
+            pass
+
+    workbook = load_workbook(path)
+    try:
+        fingerprints = {name: sheet_fingerprint(workbook[name], styles) for name in workbook.sheetnames}
+    finally:
+        workbook.close()
+
+    if usecache:
+        try:
+            with open(fingerprint_file(path), "w") as cachfile:
+                json.dump({"key": cachekey, "sheets": fingerprints}, cachfile, indent=2)
+        except OSError:
+            pass
+    return fingerprints
+
+
+def diff_sheet_job(diffjob):
+    """Compare one sheet of two workbooks, in a worker process.
+
+    Args:
+        diffjob: (path1, path2, name, key, styles)
+
+    Returns:
+        list: Every difference between the sheets
+    """
+    path1, path2, name, key, styles = diffjob
+    wb1 = load_workbook(path1)
+    wb2 = load_workbook(path2)
+    try:
+        return list(diff_sheets(name, wb1[name], wb2[name], key, styles))
+    finally:
+        wb1.close()
+        wb2.close()
+
+
+def compare_workbooks(path1, path2, key=None, styles=True, sheets=None, fingerprints=False, workers=1):
+    """Compare two Excel workbooks and collect every difference.
+
+    With fingerprints the sheets whose content hashes match are skipped
+    without comparing them cell by cell. With more than one worker the
+    remaining sheets are compared on a process pool, one sheet per worker.
 
-def compare_workbooks(path1, path2):
-    """Compare two Excel workbooks for equality.
-    
     Args:
         path1: Path to first Excel file
         path2: Path to second Excel file
-        
+        key: Header of the column to align the rows on, or None
+        styles: Compare the font and number format as well as the value
+        sheets: Names of the sheets to compare, all of them when None
+        fingerprints: Skip the sheets with matching (cached) fingerprints
+        workers: Number of processes comparing sheets at the same time
+
     Returns:
-        bool: True if workbooks are equal, False otherwise
+        dict: Diff report with the differences, their counts by type,
+              the sheets skipped on their fingerprint and whether the
+              workbooks are identical
     """
-    try:
-        wb1 = load_workbook(path1)
-        wb2 = load_workbook(path2)
-    except FileNotFoundError as e:
-        print(f"Error: {e}")
-        return False
+    with ProcessPoolExecutor(max_workers=workers) if workers > 1 else ExitStack() as executor:
+        if fingerprints:
+            if workers > 1:
+                fingerprints1, fingerprints2 = executor.map(workbook_fingerprints, (path1, path2), (styles, styles))
+            else:
+                fingerprints1 = workbook_fingerprints(path1, styles)
+                fingerprints2 = workbook_fingerprints(path2, styles)
+            names1 = list(fingerprints1)
+            names2 = list(fingerprints2)
+        else:
+            fingerprints1 = fingerprints2 = {}
+            wb1 = load_workbook(path1)
+            wb2 = load_workbook(path2)
+            names1 = wb1.sheetnames
+            names2 = wb2.sheetnames
+            wb1.close()
+            wb2.close()
 
-    sheets1 = set(wb1.sheetnames)
-    sheets2 = set(wb2.sheetnames)
+        differences = []
+        skipped = []
+        diffnames = []
+        for name in names1:
+            if sheets and name not in sheets:
+                continue
+            if name not in names2:
+                differences.append({"sheet": name, "type": "sheet_removed"})
+            elif fingerprints and fingerprints1[name] == fingerprints2[name]:
+                skipped.append(name)
+            else:
+                diffnames.append(name)
 
-    if sheets1 != sheets2:
-        print("Sheet names differ:")
-        print("  Only in file1:", sheets1 - sheets2)
-        print("  Only in file2:", sheets2 - sheets1)
-        return False
+        diffjobs = [(path1, path2, name, key, styles) for name in diffnames]
+        if workers > 1:
+            sheetdiffs = executor.map(diff_sheet_job, diffjobs)
+        else:
+            sheetdiffs = map(diff_sheet_job, diffjobs)
+        for sheetdiff in sheetdiffs:
+            differences.extend(sheetdiff)
 
-    for name in sheets1:
-        print(f"Comparing sheet: {name}")
-        s1 = wb1[name]
-        s2 = wb2[name]
-        if not sheets_are_equal(s1, s2):
-            print(f"Sheet '{name}' differs.")
-            return False
+    for name in names2:
+        if name not in names1 and (not sheets or name in sheets):
+            differences.append({"sheet": name, "type": "sheet_added"})
 
-    print("Files are identical in content and formatting.")
-    return True
+    return {
+        "file1": path1,
+        "file2": path2,
+        "key": key,
+        "identical": not differences,
+        "skipped": skipped,
+        "counts": dict(Counter(difference["type"] for difference in differences)),
+        "differences": differences,
+    }
 
 
 def main():
     """Main entry point for the comparison script."""
-    if len(sys.argv) != 3:
-        print("Usage: python comparesheets.py file1.xlsx file2.xlsx")
-        sys.exit(1)
-    
-    result = compare_workbooks(sys.argv[1], sys.argv[2])
-    sys.exit(0 if result else 1)
+    parser = argparse.ArgumentParser(description="Compare two Excel workbooks and report every difference")
+    parser.add_argument("file1", help="First Excel file, e.g. last month's output")
+    parser.add_argument("file2", help="Second Excel file")
+    parser.add_argument("--key", help="Align the rows on this column header, e.g. PersonCode or 'Salary Number'")
+    parser.add_argument("--values-only", action="store_true", help="Do not compare fonts and number formats")
+    parser.add_argument("--sheet", action="append", help="Only compare this sheet, may be repeated")
+    parser.add_argument("--report", metavar="FILE", help="Write the diff report as JSON to FILE, - for stdout")
+    parser.add_argument("--fingerprint", action="store_true",
+                        help="Skip sheets whose content hashes match, the hashes are cached next to the files")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of processes comparing sheets at the same time (default: 1)")
+    args = parser.parse_args()
+
+    try:
+        report = compare_workbooks(args.file1, args.file2, args.key, not args.values_only, args.sheet,
+                                   args.fingerprint, args.workers)
+    except FileNotFoundError as e:
+        print(f"Error: {e}")
+        sys.exit(2)
+
+    if args.report == "-":
+        json.dump(report, sys.stdout, indent=2, default=str)
+    else:
+        if args.report:
+            with open(args.report, "w") as reptfile:
+                json.dump(report, reptfile, indent=2, default=str)
+        if report["skipped"]:
+            print(f"Skipped {len(report['skipped'])} sheets with matching fingerprints")
+        if report["identical"]:
+            print("Files are identical in content and formatting.")
+        else:
+            counts = ", ".join(f"{count} {kind}" for kind, count in report["counts"].items())
+            print(f"Files differ: {counts}")
+
+    sys.exit(0 if report["identical"] else 1)
 
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""Streaming writer of the provider upload files of .FILE sections.
+
+A provider upload file (union, medical aid) is a CSV file: the SKIP lines
+the provider skips, the column headers and one line per kept row. The rows
+are written as they come from the filter, nothing but the running totals is
+kept in memory and no worksheet is made.
+
+The SKIP lines carry the same information as the top of a tab, as far as
+they go: the title, the headcount and the totals of the _SUM_ columns, then
+blank lines. The headcount and totals are only known after the last row, so
+the rows go to a temporary file first and are copied behind the SKIP lines.
+"""
+
+import csv
+import logging
+import os
+import shutil
+import tempfile
+from os import path
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Encoding of the upload files
+FLAT_ENCODING = "utf-8"
+
+# Permissions of a new upload file, the ones open() gives a file under the
+# umask. The temporary file it is made in is only readable by its owner. The
+# umask can only be read by setting it, so that is done once, on import.
+FILE_UMASK = os.umask(0)
+os.umask(FILE_UMASK)
+FILE_MODE = 0o666 & ~FILE_UMASK
+
+
+def flatvalue(valu, isamount=False):
+    """Render a cell value as a field of an upload file.
+
+    Args:
+        valu: The value from the payroll file
+        isamount: True for the values of a _SUM_ column, they are written
+                  with two decimals and an empty one as 0.00
+
+    Returns:
+        str: The field
+    """
+    if isinstance(valu, bool):
+        return "TRUE" if valu else "FALSE"
+    if isamount and (valu is None or isinstance(valu, (int, float))):
+        return f"{valu or 0:.2f}"
+    if valu is None:
+        return ""
+    if isinstance(valu, datetime):
+        if valu.time() == datetime.min.time():
+            return valu.strftime("%Y-%m-%d")
+        return valu.isoformat(sep=" ")
+    return str(valu)
+
+
+def skiplines(skipcntr, title, headcntr, colmhdrs, totlcols, colmtotl):
+    """Make the lines that go before the column headers.
+
+    Args:
+        skipcntr: Number of lines, the SKIP of the section
+        title: Title of the section
+        headcntr: Number of rows
+        colmhdrs: The column headers
+        totlcols: Column numbers of the _SUM_ columns
+        colmtotl: Total of every _SUM_ column by column number
+
+    Returns:
+        list: skipcntr lines, each one a list of fields
+    """
+    totlline = [""] * len(colmhdrs)
+    if totlcols:
+        for colmnmbr in totlcols:
+            totlline[colmnmbr - 1] = flatvalue(colmtotl[colmnmbr], True)
+        if totlcols[0] > 1:
+            totlline[totlcols[0] - 2] = "Total"
+    lines = [[title], ["Total Headcount: " + str(headcntr)], totlline if totlcols else []]
+    return lines[:skipcntr] + [[] for _ in range(skipcntr - len(lines))]
+
+
+def writeflatfile(flatfilename, destrows, colmhdrs, totlcols, title, skipcntr=0, delimiter=","):
+    """Stream the kept rows of a .FILE section to its upload file.
+
+    Nothing is written when no rows are kept, and the upload file of an
+    earlier run is removed so that it is not taken for this month's. The
+    file is replaced in one go when it is complete, it keeps the permissions
+    of the file it replaces.
+
+    Args:
+        flatfilename: Path of the upload file
+        destrows: Iterator of the kept rows, as produced by filtrrows
+        colmhdrs: The column headers
+        totlcols: Column numbers of the _SUM_ columns
+        title: Title of the section, for the SKIP lines
+        skipcntr: Number of lines before the column headers
+        delimiter: Field delimiter
+
+    Returns:
+        int: Number of rows written
+    """
+    flatfldr = path.dirname(path.abspath(flatfilename))
+    totlindx = [colmnmbr - 1 for colmnmbr in totlcols]
+    colmtotl = dict.fromkeys(totlcols, 0.0)
+    headcntr = 0
+
+    tempnames = []
+    try:
+        with tempfile.NamedTemporaryFile("w", dir=flatfldr, suffix=".tmp", delete=False,
+                                         newline="", encoding=FLAT_ENCODING) as datafile:
+            tempnames.append(datafile.name)
+            datawrtr = csv.writer(datafile, delimiter=delimiter)
+            datawrtr.writerow(colmhdrs)
+            for destvals in destrows:
+                headcntr += 1
+                for colmindx in totlindx:
+                    valu = destvals[colmindx]
+                    if isinstance(valu, (int, float)) and not isinstance(valu, bool):
+                        colmtotl[colmindx + 1] += valu
+                datawrtr.writerow([flatvalue(valu, colmindx in totlindx) for colmindx, valu in enumerate(destvals)])
+
+        if headcntr == 0:
+            if path.exists(flatfilename):
+                os.remove(flatfilename)
+                logger.info("Removed %s of an earlier run, no rows are kept", path.basename(flatfilename))
+            return 0
+
+        with tempfile.NamedTemporaryFile("w", dir=flatfldr, suffix=".tmp", delete=False,
+                                         newline="", encoding=FLAT_ENCODING) as flatfile:
+            tempnames.append(flatfile.name)
+            csv.writer(flatfile, delimiter=delimiter).writerows(
+                skiplines(skipcntr, title, headcntr, colmhdrs, totlcols, colmtotl)
+            )
+            with open(datafile.name, "r", newline="", encoding=FLAT_ENCODING) as datacopy:
+                shutil.copyfileobj(datacopy, flatfile)
+        try:
+            os.chmod(flatfile.name, os.stat(flatfilename).st_mode & 0o7777)
+        except FileNotFoundError:
+            os.chmod(flatfile.name, FILE_MODE)
+        os.replace(flatfile.name, flatfilename)
+    finally:
+        # The upload file has replaced its temporary file when all went well,
+        # whatever temporary file is left is removed
+        for tempname in tempnames:
+            if path.exists(tempname):
+                os.remove(tempname)
+
+    return headcntr
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""Incremental regeneration of the report tabs.
+
+Every section is hashed from its bound definition, the content hash of the
+source file and the month, year and business unit of the run. The laid out
+rows of a section are kept in a section store under that hash, so a re-run
+only builds the sections whose recipe or input changed and takes the others
+from the store.
+
+The hash of the whole run is kept with the size and modification time of the
+output it produced. When a re-run has the same hash and the output has not
+been touched since, the output is already up to date and nothing is done.
+"""
+
+import hashlib
+import logging
+import os
+from os import path
+
+from cachestore import cacheentry, cachefldr, prunecache, readcache, writecache
+
+logger = logging.getLogger(__name__)
+
+# Bump when the layout of the sheets changes, stored sections and run
+# manifests of older versions are then rebuilt
+INCREMENTAL_VERSION = 3
+
+
+def plandigest(recipeplan):
+    """Hash the compiled sections of a recipe.
+
+    Args:
+        recipeplan: The compiled RecipePlan
+
+    Returns:
+        str: Hex digest of every section and its columns, in order
+    """
+    digest = hashlib.sha256()
+    for sectplan in recipeplan.sections:
+        colmsigs = [
+            tuple(getattr(colmplan, slotname) for slotname in colmplan.__slots__)
+            for colmplan in sectplan.columns
+        ]
+        digest.update(repr((sectplan.defnname, sectplan.skip, colmsigs)).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def runkey(recipeplan, srcedigest, cldrmnth, cldryear, busnunitname, outputmode):
+    """Hash everything the output of a run depends on.
+
+    Args:
+        recipeplan: The compiled RecipePlan
+        srcedigest: Content hash of the source file
+        cldrmnth: Calendar month
+        cldryear: Calendar year
+        busnunitname: Business unit name
+        outputmode: How the output workbook is made, e.g. "tabs" or "full"
+
+    Returns:
+        str: Hex digest of the run
+    """
+    runparms = (INCREMENTAL_VERSION, plandigest(recipeplan), srcedigest,
+                cldrmnth, cldryear, busnunitname, outputmode)
+    return hashlib.sha256(repr(runparms).encode("utf-8")).hexdigest()
+
+
+def sectionkey(sectjob, srcedigest):
+    """Hash a bound section together with its source data.
+
+    Args:
+        sectjob: The buildTheSheet arguments after maincolmhdrs
+        srcedigest: Content hash of the source file
+
+    Returns:
+        str: Hex digest of the section
+    """
+    thisdefn, defnname, busnunitname, cldrmnth, cldryear, totlcols, nzrocols, anzrcols, aftrtotldefn = sectjob
+    sectparms = (INCREMENTAL_VERSION, srcedigest, thisdefn, defnname, busnunitname, cldrmnth,
+                 cldryear, totlcols, nzrocols, anzrcols, list(aftrtotldefn.items()))
+    return hashlib.sha256(repr(sectparms).encode("utf-8")).hexdigest()
+
+
+def outputstate(newxfilename):
+    """Return what identifies an output file on disk.
+
+    Args:
+        newxfilename: Path of the output workbook
+
+    Returns:
+        list: [size, mtime_ns] of the file, or None when it does not exist
+    """
+    try:
+        filestat = os.stat(newxfilename)
+    except OSError:
+        return None
+    return [filestat.st_size, filestat.st_mtime_ns]
+
+
+def isuptodate(newxfilename, thisrunkey):
+    """Check whether the output was made by a run with the same hash.
+
+    Args:
+        newxfilename: Path of the output workbook
+        thisrunkey: Hash of this run from runkey
+
+    Returns:
+        bool: True when the output and the upload files the run wrote exist,
+              were made by the same run and have not been changed since
+    """
+    manifest = readcache(cacheentry("runs", newxfilename))
+    if not manifest or manifest.get("runkey") != thisrunkey:
+        return False
+    if manifest.get("output") is None or manifest.get("output") != outputstate(newxfilename):
+        return False
+    return all(flatstate == outputstate(flatname) for flatname, flatstate in manifest.get("files", {}).items())
+
+
+def saverun(newxfilename, thisrunkey, flatnames=()):
+    """Remember the hash of the run that made an output.
+
+    Args:
+        newxfilename: Path of the output workbook, already saved
+        thisrunkey: Hash of the run from runkey
+        flatnames: Paths of the upload files of the .FILE sections the run
+                   wrote
+    """
+    writecache(cacheentry("runs", newxfilename), {
+        "runkey": thisrunkey,
+        "output": outputstate(newxfilename),
+        "files": {flatname: outputstate(flatname) for flatname in flatnames},
+    })
+
+
+def loadsection(sectkey):
+    """Take a built section from the section store.
+
+    Args:
+        sectkey: Hash of the section from sectionkey
+
+    Returns:
+        tuple: (headcntr, sheetlayt) as buildTheSheet with the rows in a
+               list, or None when the section is not in the store
+    """
+    return readcache(path.join(cachefldr("sections"), sectkey + ".pickle"))
+
+
+def storesection(sectkey, headcntr, sheetlayt):
+    """Put a built section into the section store.
+
+    Args:
+        sectkey: Hash of the section from sectionkey
+        headcntr: Number of data rows of the section
+        sheetlayt: (sheetrows, mergrnge, colsused) with the rows in a list,
+                   or None when the section has no rows
+
+    Returns:
+        bool: True when the section was stored
+    """
+    stored = writecache(path.join(cachefldr("sections"), sectkey + ".pickle"), (headcntr, sheetlayt))
+    prunecache("sections")
+    return stored
@@ -0,0 +1,542 @@
+#!/usr/bin/env python3
+"""Resident job server for processFiles with warm caches.
+
+The server listens on a localhost HTTP port and takes jobs, each one a
+definition file, a payroll file, a month, a year and a business unit like
+the jobs of a batch. The jobs run on a pool of worker threads in this one
+process, so openpyxl is imported once and the compiled recipes and the
+tables of the payroll files stay in memory between jobs. Both are kept in
+least recently used caches with a limit on their size in memory.
+
+A loaded payroll workbook gets the tabs of a job added to it, so only the
+table of the main sheet can be shared. The table is cached for jobs that
+write the tabs to new workbooks (read-only, write-only, split output or a
+CSV or TSV source), a job that adds the tabs to the payroll workbook loads
+it every time.
+
+The API, all JSON:
+    POST /jobs        submit a job, returns its id
+    GET  /jobs        every job the server knows, newest last
+    GET  /jobs/<id>   status, result and run report of a job
+    GET  /status      the jobs by status and the state of the caches
+
+Cmdline.py --server submits a job to a running server and waits for it.
+
+Usage:
+    python jobserver.py --port 8765 --jobs 2 --cache-mb 2048
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from os import path
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib import error, request
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8765
+DEFAULT_URL = f"http://127.0.0.1:{DEFAULT_PORT}"
+
+# Memory the caches of the server may take, $PAROOL_SERVER_MB overrides it
+SERVER_CACHE_MB = 1024
+
+# The fields of a job, as in a batch manifest
+JOB_FIELDS = ["defn", "excl", "month", "year", "unit"]
+
+# The processFiles options a job may set
+JOB_OPTIONS = {"readonly": bool, "writeonly": bool, "engine": str, "usecache": bool,
+               "incremental": bool, "workers": int, "splitoutput": bool}
+
+# Number of finished jobs the server remembers
+JOB_HISTORY = 1000
+
+def tablesize(maincolmhdrs, mainrows):
+    """Return the memory taken by the table of a payroll file.
+
+    Args:
+        maincolmhdrs: Column headers as read by readmainshet
+        mainrows: RowStore as read by readmainshet
+
+    Returns:
+        int: Size in bytes
+    """
+    return mainrows.nbytes() + sys.getsizeof(maincolmhdrs)
+
+
+def recipesize(recipeplan):
+    """Estimate the memory taken by a compiled recipe.
+
+    Args:
+        recipeplan: The compiled RecipePlan
+
+    Returns:
+        int: Estimated size in bytes
+    """
+    import pickle
+    return len(pickle.dumps(recipeplan))
+
+
+def filestamp(filename):
+    """Return what identifies the version of a file on disk.
+
+    Args:
+        filename: Path to the file
+
+    Returns:
+        tuple: (absolute path, size, mtime_ns) of the file
+    """
+    filestat = os.stat(filename)
+    return (path.abspath(filename), filestat.st_size, filestat.st_mtime_ns)
+
+
+class LRUCache:
+    """Values that are dropped least recently used first over a memory limit."""
+
+    def __init__(self, maxbytes):
+        """Start an empty cache.
+
+        Args:
+            maxbytes: Total size of the values kept, in bytes
+        """
+        self.maxbytes = maxbytes
+        self.entries = OrderedDict()
+        self.usedbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Return a value and mark it as recently used.
+
+        Args:
+            key: Key of the value
+
+        Returns:
+            object: The value, or None when it is not in the cache
+        """
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key][0]
+
+    def put(self, key, value, size):
+        """Add a value, dropping the least recently used ones over the limit.
+
+        A value larger than the whole limit is not kept.
+
+        Args:
+            key: Key of the value
+            value: The value
+            size: Size of the value in bytes
+        """
+        with self.lock:
+            if key in self.entries:
+                self.usedbytes -= self.entries.pop(key)[1]
+            if size > self.maxbytes:
+                return
+            self.entries[key] = (value, size)
+            self.usedbytes += size
+            while self.usedbytes > self.maxbytes:
+                self.usedbytes -= self.entries.popitem(last=False)[1][1]
+
+    def stats(self):
+        """Return the state of the cache.
+
+        Returns:
+            dict: Number of entries, bytes used, limit, hits and misses
+        """
+        with self.lock:
+            return {"entries": len(self.entries), "bytes": self.usedbytes, "maxbytes": self.maxbytes,
+                    "hits": self.hits, "misses": self.misses}
+
+
+class JobServer:
+    """The jobs, the worker pool and the caches of a running server."""
+
+    def __init__(self, jobs=1, cachemb=None):
+        """Start the worker pool.
+
+        Args:
+            jobs: Number of jobs run at the same time
+            cachemb: Memory of the caches in megabytes, shared between the
+                     recipes (a tenth) and the payroll tables
+        """
+        if cachemb is None:
+            cachemb = int(os.environ.get("PAROOL_SERVER_MB", SERVER_CACHE_MB))
+        cachebytes = cachemb * 1024 * 1024
+        self.recipes = LRUCache(cachebytes // 10)
+        self.sources = LRUCache(cachebytes - cachebytes // 10)
+        self.executor = ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="job")
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        # Jobs writing the same output run one after the other. Every output
+        # has a lock and the number of jobs using it, the entry is dropped
+        # when the last one is done.
+        self.outputlocks = {}
+
+    def submit(self, jobsdefn):
+        """Check a job and queue it.
+
+        Args:
+            jobsdefn: Dictionary with the JOB_FIELDS and optional JOB_OPTIONS
+
+        Returns:
+            dict: The queued job
+
+        Raises:
+            ValueError: When a field is missing or an option is unknown
+        """
+        missfields = [field for field in JOB_FIELDS if not jobsdefn.get(field)]
+        if missfields:
+            raise ValueError("Job is missing: " + ", ".join(missfields))
+        options = jobsdefn.get("options") or {}
+        unknopts = [name for name in options if name not in JOB_OPTIONS]
+        if unknopts:
+            raise ValueError("Unknown options: " + ", ".join(unknopts))
+
+        jobsrslt = {field: str(jobsdefn[field]) for field in JOB_FIELDS}
+        jobsrslt.update(
+            id=uuid.uuid4().hex, options={name: JOB_OPTIONS[name](valu) for name, valu in options.items()},
+            status="queued", result="", submitted=time.time(), seconds=None, cache={}, report=None,
+        )
+        with self.lock:
+            self.jobs[jobsrslt["id"]] = jobsrslt
+            self.forgetjobs()
+        self.executor.submit(self.runjob, jobsrslt)
+        return dict(jobsrslt)
+
+    def forgetjobs(self):
+        """Drop the oldest finished jobs over JOB_HISTORY, with the lock held."""
+        for jobsid in list(self.jobs):
+            if len(self.jobs) <= JOB_HISTORY:
+                break
+            if self.jobs[jobsid]["status"] not in ("queued", "running"):
+                del self.jobs[jobsid]
+
+    def job(self, jobsid):
+        """Return a copy of a job.
+
+        Args:
+            jobsid: Id of the job
+
+        Returns:
+            dict: The job, or None when the server does not know it
+        """
+        with self.lock:
+            jobsrslt = self.jobs.get(jobsid)
+            return dict(jobsrslt, cache=dict(jobsrslt["cache"])) if jobsrslt is not None else None
+
+    def alljobs(self):
+        """Return a copy of every job, without the run reports.
+
+        Returns:
+            list: The jobs in the order they were submitted
+        """
+        with self.lock:
+            return [dict({key: valu for key, valu in jobsrslt.items() if key != "report"},
+                         cache=dict(jobsrslt["cache"]))
+                    for jobsrslt in self.jobs.values()]
+
+    def status(self):
+        """Return the state of the server.
+
+        Returns:
+            dict: Number of jobs by status and the state of both caches
+        """
+        with self.lock:
+            jobscntr = {}
+            for jobsrslt in self.jobs.values():
+                jobscntr[jobsrslt["status"]] = jobscntr.get(jobsrslt["status"], 0) + 1
+        return {"jobs": jobscntr, "recipes": self.recipes.stats(), "sources": self.sources.stats()}
+
+    def setcache(self, cachestat, name, how):
+        """Record where a job got its recipe or payroll file from.
+
+        The jobs are read by the request threads, so this is done with the
+        lock held.
+
+        Args:
+            cachestat: The cache dictionary of the job
+            name: "recipe" or "source"
+            how: "memory" or "loaded"
+        """
+        with self.lock:
+            cachestat[name] = how
+
+    def loadrecipe(self, defnfilename, usecache, cachestat):
+        """Return the compiled recipe of a job, from memory when it is there.
+
+        Args:
+            defnfilename: Path to the INI definition file
+            usecache: Whether the caches may be used at all
+            cachestat: The cache dictionary of the job, gets "recipe" set
+
+        Returns:
+            RecipePlan: The compiled plan
+        """
+        from recipeplan import loadrecipeplan
+
+        if not usecache:
+            self.setcache(cachestat, "recipe", "loaded")
+            return loadrecipeplan(defnfilename, False)
+        rcpekey = filestamp(defnfilename)
+        recipeplan = self.recipes.get(rcpekey)
+        if recipeplan is None:
+            self.setcache(cachestat, "recipe", "loaded")
+            recipeplan = loadrecipeplan(defnfilename)
+            self.recipes.put(rcpekey, recipeplan, recipesize(recipeplan))
+        else:
+            self.setcache(cachestat, "recipe", "memory")
+        return recipeplan
+
+    def loadsource(self, exclfilename, options, runreport, cachestat):
+        """Return the payroll file of a job, from memory when it can be shared.
+
+        Args:
+            exclfilename: Path to the payroll file
+            options: The processFiles options of the job
+            runreport: RunReport of the job
+            cachestat: The cache dictionary of the job, gets "source" set
+
+        Returns:
+            tuple: The payroll file as returned by loadsource
+        """
+        from processFiles import loadsource
+        from sourcefile import flatdelimiter
+
+        readonly = options.get("readonly", False) or options.get("splitoutput", False)
+        writeonly = options.get("writeonly", False)
+        usecache = options.get("usecache", True)
+        if not usecache or not (readonly or writeonly or flatdelimiter(exclfilename)):
+            self.setcache(cachestat, "source", "loaded")
+            return loadsource(exclfilename, readonly, writeonly, usecache, runreport)
+
+        srcekey = filestamp(exclfilename)
+        source = self.sources.get(srcekey)
+        if source is None:
+            self.setcache(cachestat, "source", "loaded")
+            source = loadsource(exclfilename, readonly, writeonly, usecache, runreport)
+            self.sources.put(srcekey, source, tablesize(source[1], source[2]))
+        else:
+            self.setcache(cachestat, "source", "memory")
+        return source
+
+    def runjob(self, jobsrslt):
+        """Run a job on a worker thread and record its outcome.
+
+        Args:
+            jobsrslt: The job as made by submit
+        """
+        from processFiles import processFiles
+        from runreport import RunReport
+
+        with self.lock:
+            jobsrslt["status"] = "running"
+        strttime = time.perf_counter()
+        options = dict(jobsrslt["options"])
+        runreport = RunReport()
+        newxfilename = path.splitext(path.abspath(jobsrslt["excl"]))[0] + " Tabs.xlsx"
+        with self.lock:
+            outputlock = self.outputlocks.setdefault(newxfilename, [threading.Lock(), 0])
+            outputlock[1] += 1
+
+        try:
+            with outputlock[0]:
+                recipeplan = self.loadrecipe(jobsrslt["defn"], options.get("usecache", True), jobsrslt["cache"])
+                source = self.loadsource(jobsrslt["excl"], options, runreport, jobsrslt["cache"])
+                status, result = processFiles(
+                    jobsrslt["defn"], jobsrslt["excl"], jobsrslt["month"], jobsrslt["year"],
+                    jobsrslt["unit"], False, recipeplan=recipeplan, runreport=runreport,
+                    source=source, **options
+                )
+        except Exception as e:
+            status, result = "Failed", e
+
+        with self.lock:
+            outputlock[1] -= 1
+            if outputlock[1] == 0:
+                del self.outputlocks[newxfilename]
+            jobsrslt["status"] = status
+            jobsrslt["result"] = str(result)
+            jobsrslt["seconds"] = round(time.perf_counter() - strttime, 3)
+            jobsrslt["report"] = runreport.todict()
+        logger.info("Job %s %s in %.2fs: %s", jobsrslt["id"], status, jobsrslt["seconds"], jobsrslt["excl"])
+
+    def shutdown(self):
+        """Wait for the running jobs and stop the worker pool."""
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    """The JSON API of a JobServer, the server is set on the class."""
+
+    jobserver = None
+
+    def sendjson(self, code, body):
+        """Send a JSON response.
+
+        Args:
+            code: HTTP status code
+            body: Data of the response
+        """
+        rspnbody = json.dumps(body).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(rspnbody)))
+        self.end_headers()
+        self.wfile.write(rspnbody)
+
+    def do_GET(self):
+        """Return the jobs, one job or the state of the server."""
+        if self.path == "/jobs":
+            self.sendjson(200, self.jobserver.alljobs())
+        elif self.path.startswith("/jobs/"):
+            jobsrslt = self.jobserver.job(self.path[len("/jobs/"):])
+            if jobsrslt is None:
+                self.sendjson(404, {"error": "Unknown job"})
+            else:
+                self.sendjson(200, jobsrslt)
+        elif self.path == "/status":
+            self.sendjson(200, self.jobserver.status())
+        else:
+            self.sendjson(404, {"error": "Unknown path"})
+
+    def do_POST(self):
+        """Submit a job."""
+        if self.path != "/jobs":
+            self.sendjson(404, {"error": "Unknown path"})
+            return
+        try:
+            rqstsize = int(self.headers.get("Content-Length", 0))
+            jobsdefn = json.loads(self.rfile.read(rqstsize) or b"{}")
+            if not isinstance(jobsdefn, dict):
+                raise ValueError("A job is a JSON object")
+            jobsrslt = self.jobserver.submit(jobsdefn)
+        except ValueError as e:
+            self.sendjson(400, {"error": str(e)})
+            return
+        self.sendjson(202, jobsrslt)
+
+    def log_message(self, format, *args):
+        """Log the requests through logging instead of stderr."""
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+def serve(port=DEFAULT_PORT, jobs=1, cachemb=None):
+    """Run a job server until it is interrupted.
+
+    Args:
+        port: Localhost port to listen on
+        jobs: Number of jobs run at the same time
+        cachemb: Memory of the caches in megabytes
+    """
+    jobserver = JobServer(jobs, cachemb)
+    handler = type("BoundJobRequestHandler", (JobRequestHandler,), {"jobserver": jobserver})
+    httpserver = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    logger.info("Job server listening on http://127.0.0.1:%d with %d job workers", port, jobs)
+    try:
+        httpserver.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpserver.server_close()
+        jobserver.shutdown()
+
+
+def callserver(serverurl, method, rqstpath, body=None):
+    """Call the API of a job server.
+
+    Args:
+        serverurl: Base URL of the server, e.g. DEFAULT_URL
+        method: "GET" or "POST"
+        rqstpath: Path of the call, e.g. "/jobs"
+        body: Data sent as JSON with a POST
+
+    Returns:
+        object: The JSON response
+
+    Raises:
+        ValueError: When the server refuses the call
+        OSError: When the server cannot be reached
+    """
+    rqstdata = json.dumps(body).encode("utf-8") if body is not None else None
+    httprqst = request.Request(serverurl.rstrip("/") + rqstpath, data=rqstdata, method=method,
+                               headers={"Content-Type": "application/json"})
+    try:
+        with request.urlopen(httprqst) as response:
+            return json.loads(response.read())
+    except error.HTTPError as e:
+        try:
+            message = json.loads(e.read()).get("error", e.reason)
+        except ValueError:
+            message = e.reason
+        raise ValueError(f"Server refused the call: {message}") from None
+
+
+def submitjob(serverurl, jobsdefn, options=None):
+    """Submit a job to a job server.
+
+    Args:
+        serverurl: Base URL of the server
+        jobsdefn: Dictionary with the JOB_FIELDS, relative file names are
+                  made absolute as the server runs in its own folder
+        options: processFiles options of the job, see JOB_OPTIONS
+
+    Returns:
+        dict: The queued job, with its id
+    """
+    jobsdefn = dict(jobsdefn)
+    for field in ("defn", "excl"):
+        jobsdefn[field] = path.abspath(jobsdefn[field])
+    jobsdefn["options"] = options or {}
+    return callserver(serverurl, "POST", "/jobs", jobsdefn)
+
+
+def waitforjob(serverurl, jobsid, interval=0.5):
+    """Wait until a job on a job server has finished.
+
+    Args:
+        serverurl: Base URL of the server
+        jobsid: Id of the job
+        interval: Seconds between two polls
+
+    Returns:
+        dict: The finished job with its status, result and run report
+    """
+    while True:
+        jobsrslt = callserver(serverurl, "GET", "/jobs/" + jobsid)
+        if jobsrslt["status"] not in ("queued", "running"):
+            return jobsrslt
+        time.sleep(interval)
+
+
+def main():
+    """Parse the command line and run the server."""
+    parser = argparse.ArgumentParser(description="Run processFiles jobs from a resident server with warm caches")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT,
+                        help=f"Localhost port to listen on (default: {DEFAULT_PORT})")
+    parser.add_argument("--jobs", type=int, default=1, help="Number of jobs run at the same time (default: 1)")
+    parser.add_argument("--cache-mb", type=int, default=None,
+                        help=f"Memory of the recipe and payroll caches in MB (default: {SERVER_CACHE_MB}, "
+                             "or $PAROOL_SERVER_MB)")
+    parser.add_argument("--debug", action="store_true", help="Enable debug logging")
+    args = parser.parse_args()
+
+    from logsetup import setuplogging
+    setuplogging(args.debug)
+    serve(args.port, args.jobs, args.cache_mb)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+#!/usr/bin/env python3
+"""Logging set up of the programs.
+
+The modules only create their loggers. The programs (Cmdline.py, Payroll.py
+and the worker processes of a batch) configure the output once when they
+start, so importing processFiles leaves the logging of the caller alone and
+costs nothing at import time.
+"""
+
+import logging
+
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+
+
+def setuplogging(debug=False):
+    """Send the log records to stderr, unless logging was already set up.
+
+    Args:
+        debug: Log debug records as well as the informational ones
+    """
+    logging.basicConfig(level=logging.DEBUG if debug else logging.INFO, format=LOG_FORMAT)
@@ -1,18 +1,27 @@
 #!/usr/bin/env python3
 import os
+import time
 from os import path
 from copy import copy
+from datetime import datetime
 from collections import defaultdict
-from openpyxl import load_workbook
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import PatternFill, Border, Side, Alignment, Font
 from openpyxl.utils import get_column_letter
+import columnar
+from cachestore import cacheentry, filedigest, prunecache, readcache, writecache
+from flatexport import writeflatfile
+from incremental import isuptodate, loadsection, runkey, saverun, sectionkey, storesection
+from recipeplan import loadrecipeplan
+from rowstore import RowStore
+from runreport import RunReport
+from sourcefile import flatdelimiter, readflatrows
 import logging
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+# The programs configure the logging, see logsetup
 logger = logging.getLogger(__name__)
 def check_file(filename):
     """Check if a file exists and is readable.
@@ -32,33 +41,6 @@ def check_file(filename):
         return True, ""
 
 
-def defnfileprse(file_path):
-    """Parse an INI-style definition file.
-    
-    Parses a file with [SECTIONS] and key=value pairs into a dictionary structure.
-    
-    Args:
-        file_path: Path to the INI file
-        
-    Returns:
-        dict: Dictionary with section names as keys and lists of [key, value] pairs as values
-    """
-    ini_data = dict()
-
-    with open(file_path, 'r') as file:
-        currsect = None
-        for line in file:
-            line = line.strip()
-            if line.startswith('[') and line.endswith(']'):
-                currsect = line[1:-1]
-                ini_data[currsect] = list()
-            elif '=' in line:
-                key, value = map(str.strip, line.split('=', 1))
-                if key:  # Simplified - empty string is falsy
-                    ini_data[currsect].append([key, value])
-    return ini_data
-
-
 # Define the underline formats for Total headers and values
 BORDER_THIN = Side(border_style="thin", color="000000")
 BORDER_THICK = Side(border_style="thick", color="000000")
@@ -66,6 +48,28 @@ CELL_BORDER_THIN = Border(bottom=BORDER_THIN)
 CELL_BORDER_THICK = Border(bottom=BORDER_THICK)
 NUMBER_FORMAT = "### ### ### ##0.00"
 
+# Shared fonts, fill and alignments, styles are immutable in openpyxl so one
+# instance serves every cell.
+FONT_NRML = Font(
+    name='Arial', size=10, bold=None, italic=False,
+    vertAlign=None, underline=None, strike=False, color='FF000000'
+)
+FONT_LRGE = Font(
+    name='Arial', size=14, bold=None, italic=False,
+    vertAlign=None, underline=None, strike=False, color='FF000000'
+)
+FILL_TOTL = PatternFill(
+    fill_type="lightGray", start_color='DAE3F3', end_color='DAE3F3'
+)
+ALIGN_TITL = Alignment(
+    horizontal='general', vertical='center', text_rotation=0,
+    wrap_text=False, shrink_to_fit=False, indent=0
+)
+ALIGN_TOTL = Alignment(
+    horizontal='general', vertical='bottom', text_rotation=0,
+    wrap_text=True, shrink_to_fit=False, indent=0
+)
+
 
 def makefontbold(cell):
     """Make a cell's font bold.
@@ -84,10 +88,7 @@ def fontsizenrml(cell):
     Args:
         cell: The Excel cell to modify
     """
-    cell.font = Font(
-        name='Arial', size=10, bold=None, italic=False,
-        vertAlign=None, underline=None, strike=False, color='FF000000'
-    )
+    cell.font = FONT_NRML
 
 
 def fontsizelrge(cell):
@@ -96,10 +97,7 @@ def fontsizelrge(cell):
     Args:
         cell: The Excel cell to modify
     """
-    cell.font = Font(
-        name='Arial', size=14, bold=None, italic=False,
-        vertAlign=None, underline=None, strike=False, color='FF000000'
-    )
+    cell.font = FONT_LRGE
 
 
 def fillcellcolr(cell):
@@ -108,9 +106,7 @@ def fillcellcolr(cell):
     Args:
         cell: The Excel cell to modify
     """
-    cell.fill = PatternFill(
-        fill_type="lightGray", start_color='DAE3F3', end_color='DAE3F3'
-    )
+    cell.fill = FILL_TOTL
 
 
 def frmttotltitl(cell):
@@ -122,15 +118,15 @@ def frmttotltitl(cell):
     fontsizenrml(cell)
     makefontbold(cell)
     fillcellcolr(cell)
-    cell.alignment = Alignment(
-        horizontal='general', vertical='bottom', text_rotation=0,
-        wrap_text=True, shrink_to_fit=False, indent=0
-    )
+    cell.alignment = ALIGN_TOTL
 
 
 def frmttotlvalu(cell):
     """Format a cell as a total value (bold, thick border, number format).
     
+    The cell above a total value is underlined with frmtthinline, the
+    sheet layout takes care of that so that rows can be written in order.
+
     Args:
         cell: The Excel cell to modify
     """
@@ -138,290 +134,884 @@ def frmttotlvalu(cell):
     makefontbold(cell)
     cell.border = CELL_BORDER_THICK
     cell.number_format = NUMBER_FORMAT
-    cellabov = cell.parent.cell(row=cell.row - 1, column=cell.column)
-    cellabov.border = CELL_BORDER_THIN 
 
 
-def populateTheSheet(exclmainshet, maincolmhdrs, destshet, thisdefn, defnname, 
-                     busnunitname, cldrmnth, cldryear, totlcols, nzrocols, 
-                     anzrcols, aftrtotldefn):
-    """Populate a worksheet with formatted data from the main Excel sheet.
-    
+def frmtthinline(cell):
+    """Underline a cell with a thin border, used above total values.
+
+    Args:
+        cell: The Excel cell to modify
+    """
+    cell.border = CELL_BORDER_THIN
+
+
+def frmtnumbvalu(cell):
+    """Apply the number format used for amounts.
+
+    Args:
+        cell: The Excel cell to modify
+    """
+    cell.number_format = NUMBER_FORMAT
+
+
+def frmttitlalgn(cell):
+    """Align the title of a sheet vertically centred without wrapping.
+
+    Args:
+        cell: The Excel cell to modify
+    """
+    cell.alignment = ALIGN_TITL
+
+
+# Named cell formats used by the sheet layout, each one a list of the
+# formatting helpers above applied in order.
+CELL_FORMATS = {
+    "titl": (fontsizelrge, makefontbold, frmttitlalgn),
+    "hedr": (frmttotltitl,),
+    "hedrline": (frmttotltitl, frmtthinline),
+    "bold": (makefontbold,),
+    "nrml": (fontsizenrml,),
+    "nrmlbold": (fontsizenrml, makefontbold),
+    "numb": (fontsizenrml, frmtnumbvalu),
+    "numbline": (fontsizenrml, frmtnumbvalu, frmtthinline),
+    "sidenumb": (fontsizenrml, makefontbold, frmtnumbvalu),
+    "sidenumbline": (fontsizenrml, makefontbold, frmtnumbvalu, frmtthinline),
+    "totlvalu": (frmttotlvalu,),
+    "fill": (fillcellcolr,),
+    "grndtotl": (fillcellcolr, frmttotlvalu),
+    "aftrtitl": (fontsizenrml, makefontbold, fillcellcolr),
+}
+
+
+def applycellfrmt(cell, frmtname):
+    """Apply one of the named CELL_FORMATS to a cell.
+
+    Args:
+        cell: The Excel cell to modify
+        frmtname: Key into CELL_FORMATS
+    """
+    for frmtfunc in CELL_FORMATS[frmtname]:
+        frmtfunc(cell)
+
+
+# Formats that show their numbers through NUMBER_FORMAT and formats whose
+# text wraps at spaces, used to measure the columns while writing
+NUMBER_FORMATS = frozenset(frmtname for frmtname, frmtfuncs in CELL_FORMATS.items()
+                           if frmtnumbvalu in frmtfuncs or frmttotlvalu in frmtfuncs)
+WRAP_FORMATS = frozenset(frmtname for frmtname, frmtfuncs in CELL_FORMATS.items()
+                         if frmttotltitl in frmtfuncs)
+
+# Column widths in characters: the room around the widest value and the
+# narrowest and widest column set
+COLUMN_WIDTH_PAD = 2
+COLUMN_WIDTH_MIN = 8
+COLUMN_WIDTH_MAX = 60
+
+
+def rendernumb(valu):
+    """Render a number the way NUMBER_FORMAT shows it.
+
+    Args:
+        valu: The number
+
+    Returns:
+        str: The number with space separated thousands and two decimals
+    """
+    return f"{valu:,.2f}".replace(",", " ")
+
+
+def renderedlength(valu, frmtname):
+    """Return the number of characters a value takes up in its cell.
+
+    Args:
+        valu: The value of the cell, not a formula
+        frmtname: Key into CELL_FORMATS of the cell
+
+    Returns:
+        int: Length of the value as shown, of the longest word for the
+             headers that wrap
+    """
+    if valu is None:
+        return 0
+    if frmtname in WRAP_FORMATS:
+        return max((len(word) for word in str(valu).split()), default=0)
+    if isinstance(valu, bool):
+        return 4 if valu else 5
+    if isinstance(valu, (int, float)):
+        if frmtname in NUMBER_FORMATS:
+            return len(rendernumb(valu))
+        # The General format shows at most 11 characters of a number
+        return min(len(str(valu)), 11)
+    if isinstance(valu, datetime):
+        return 10 if valu.time() == datetime.min.time() else 19
+    return len(str(valu))
+
+
+class ColumnWidths:
+    """Widest value of every column of a sheet, measured as it is written.
+
+    The totals are SUM formulas, their values are not known while writing.
+    A total can not be larger than the sum of all the amounts of the sheet,
+    so formulas in a number format are measured as that sum.
+    """
+
+    def __init__(self):
+        """Start with no columns measured."""
+        self.colmlens = defaultdict(int)
+        self.sumcols = set()
+        self.numbtotl = 0.0
+
+    def measure(self, colmnmbr, valu, frmtname):
+        """Take a cell into account.
+
+        Args:
+            colmnmbr: Column of the cell
+            valu: Value written to the cell
+            frmtname: Key into CELL_FORMATS of the cell
+        """
+        if frmtname == "titl":
+            # The title is merged over the columns before the totals
+            return
+        if isinstance(valu, str) and valu.startswith("="):
+            if frmtname in NUMBER_FORMATS:
+                self.sumcols.add(colmnmbr)
+                return
+            # The other formulas are the IF tests that show TRUE or FALSE
+            thislen = 5
+        else:
+            thislen = renderedlength(valu, frmtname)
+            if frmtname in NUMBER_FORMATS and isinstance(valu, (int, float)) and not isinstance(valu, bool):
+                self.numbtotl += abs(valu)
+        if thislen > self.colmlens[colmnmbr]:
+            self.colmlens[colmnmbr] = thislen
+
+    def apply(self, destshet, colsused):
+        """Set the widths of the columns of a worksheet.
+
+        Args:
+            destshet: Destination worksheet, before any rows are appended
+                      when it is write-only
+            colsused: Number of columns used by the sheet
+        """
+        sumslen = len(rendernumb(self.numbtotl))
+        for colmnmbr in range(1, colsused + 1):
+            thislen = self.colmlens.get(colmnmbr, 0)
+            if colmnmbr in self.sumcols:
+                thislen = max(thislen, sumslen)
+            colmwdth = min(max(thislen + COLUMN_WIDTH_PAD, COLUMN_WIDTH_MIN), COLUMN_WIDTH_MAX)
+            destshet.column_dimensions[get_column_letter(colmnmbr)].width = colmwdth
+
+
+class StyleRegistry:
+    """The CELL_FORMATS of one workbook, resolved once per run.
+
+    The first (unstyled) cell that uses a format gets it through
+    applycellfrmt, which registers the fonts, fills and borders with the
+    workbook. Every later cell with that format shares the resulting style
+    array, so there is no style construction or lookup per cell.
+
+    Setting a date or time value gives a cell a number format of its own,
+    which the formats without a number format keep. The style arrays are
+    therefore kept per format and number format the cell had before it was
+    styled, so a date cell never shares the style of a plain number.
+    """
+
+    def __init__(self):
+        self.frmtstyl = {}
+
+    def applycellfrmt(self, cell, frmtname):
+        """Apply one of the named CELL_FORMATS to a cell, its value already set.
+
+        Args:
+            cell: The Excel cell to modify, all cells must be in one workbook
+            frmtname: Key into CELL_FORMATS
+        """
+        stylkey = (frmtname, cell.number_format)
+        cellstyl = self.frmtstyl.get(stylkey)
+        if cellstyl is None:
+            applycellfrmt(cell, frmtname)
+            self.frmtstyl[stylkey] = copy(cell._style)
+        else:
+            cell._style = copy(cellstyl)
+
+
+def readmainshet(exclmainshet):
+    """Read the main sheet once, row by row, into an in-memory table.
+
+    The first row supplies the column headers, the following rows go into a
+    RowStore so that the sections can project their columns out of the table
+    without going back to the worksheet cells.
+
     Args:
         exclmainshet: Source Excel worksheet
-        maincolmhdrs: Dictionary mapping column names to column indices
-        destshet: Destination worksheet to populate
+
+    Returns:
+        tuple: (maincolmhdrs, mainrows) - dictionary mapping column names to
+               column indices and a RowStore of the rows (header excluded)
+    """
+    return readmainrows(exclmainshet.iter_rows(values_only=True))
+
+
+def readmainrows(rowsiter):
+    """Read the rows of a main sheet from any source into an in-memory table.
+
+    Args:
+        rowsiter: Iterator of row value tuples, the header row first
+
+    Returns:
+        tuple: (maincolmhdrs, mainrows) as readmainshet
+    """
+    hedrrow = next(rowsiter, ())
+
+    # Make a list of column headers from the input sheet
+    maincolmhdrs = {}
+    for colmcntr, maincolmname in enumerate(hedrrow, 1):
+        maincolmhdrs[maincolmname] = colmcntr
+
+    # Short rows are padded so that every header has a value in every row
+    mainrows = RowStore(rowsiter, len(hedrrow))
+
+    return maincolmhdrs, mainrows
+
+
+# Bump when the layout of a source cache entry changes, older entries are
+# then read from the source file again
+SOURCE_CACHE_VERSION = 2
+
+
+def readsourcetable(exclfilename, readonly=False, usecache=True, runreport=None, srcedigest=None):
+    """Read the main sheet of a source file into a table, through the source cache.
+
+    The RowStore of a source file is cached as it is, keyed by the
+    file's path, size, modification time and content hash, so a re-run on
+    the same export skips loading the workbook. The cache keeps to its size
+    limit by dropping the least recently used sources.
+
+    Args:
+        exclfilename: Path to the Excel payroll file, or to a CSV or TSV
+                      export of its main sheet
+        readonly: Open an Excel file read-only when it is not cached
+        usecache: Set to False to always read the source file
+        runreport: RunReport the load, headermap and cache phases go into
+        srcedigest: Content hash of the source file when the caller already
+                    has it, so the file is not hashed twice
+
+    Returns:
+        tuple: (maincolmhdrs, mainrows) as readmainshet
+    """
+    if runreport is None:
+        runreport = RunReport()
+
+    if usecache:
+        with runreport.phase("cache"):
+            filestat = os.stat(exclfilename)
+            cachekey = (SOURCE_CACHE_VERSION, path.abspath(exclfilename), filestat.st_size,
+                        filestat.st_mtime_ns, srcedigest or filedigest(exclfilename))
+            cachefile = cacheentry("sources", exclfilename)
+            cacheentr = readcache(cachefile)
+            if cacheentr is not None and cacheentr[0] == cachekey:
+                logger.debug("Source table of %s loaded from cache", exclfilename)
+                return cacheentr[1]
+
+    flatdlmt = flatdelimiter(exclfilename)
+    if flatdlmt:
+        with runreport.phase("headermap"):
+            maincolmhdrs, mainrows = readmainrows(readflatrows(exclfilename, flatdlmt))
+    else:
+        with runreport.phase("load"):
+            exclmainbook = load_workbook(exclfilename, read_only=readonly, data_only=True)
+            exclmainshet = exclmainbook[exclmainbook.sheetnames[0]]
+        with runreport.phase("headermap"):
+            maincolmhdrs, mainrows = readmainshet(exclmainshet)
+        exclmainbook.close()
+
+    if usecache:
+        with runreport.phase("cache"):
+            writecache(cachefile, (cachekey, (maincolmhdrs, mainrows)))
+            prunecache("sources")
+
+    return maincolmhdrs, mainrows
+
+
+def loadsource(exclfilename, readonly=False, writeonly=False, usecache=True, runreport=None,
+               srcedigest=None):
+    """Load a payroll file the way processFiles needs it.
+
+    When the tabs are added to the payroll workbook itself the workbook is
+    loaded and its main sheet read. When they go into a new workbook, or the
+    payroll file is a CSV or TSV export, only the table of the main sheet is
+    needed and it may come from the source cache.
+
+    Args:
+        exclfilename: Path to the Excel payroll file, or to a CSV or TSV
+                      export of its main sheet
+        readonly: As for processFiles
+        writeonly: As for processFiles
+        usecache: Set to False to always read the source file
+        runreport: RunReport the load, headermap and cache phases go into
+        srcedigest: Content hash of the source file, as for readsourcetable
+
+    Returns:
+        tuple: (exclmainbook, maincolmhdrs, mainrows), exclmainbook is None
+               when the tabs go into a new workbook
+    """
+    if runreport is None:
+        runreport = RunReport()
+
+    if readonly or writeonly or flatdelimiter(exclfilename):
+        maincolmhdrs, mainrows = readsourcetable(exclfilename, readonly, usecache, runreport, srcedigest)
+        return None, maincolmhdrs, mainrows
+
+    # Open the input Excel sheet and request the result of instead of the
+    # formulas itself.
+    with runreport.phase("load"):
+        exclmainbook = load_workbook(exclfilename, read_only=readonly, data_only=True)
+        exclmainshet = exclmainbook[exclmainbook.sheetnames[0]]
+
+    with runreport.phase("headermap"):
+        maincolmhdrs, mainrows = readmainshet(exclmainshet)
+    return exclmainbook, maincolmhdrs, mainrows
+
+
+def iszerovalu(valu):
+    """Check if a value counts as empty for the _NZ_ rule.
+
+    Args:
+        valu: The cell value to check
+
+    Returns:
+        bool: True for None, blank strings and numbers that are (near) zero
+    """
+    if isinstance(valu, (int, float)) and not isinstance(valu, bool):
+        return abs(valu) < 1e-12
+    if isinstance(valu, str):
+        return valu.strip() == ""
+    return valu is None
+
+
+def filtrrows(mainrows, srcecols, nzrocols, anzrcols):
+    """Project the rows of a definition and drop the ones that fail the rules.
+
+    The _NZ_ and _ANZ_ rules are evaluated on the source values before
+    anything is written, so rejected rows never reach the destination sheet.
+    Only the columns of the definition are read out of the RowStore.
+
+    Args:
+        mainrows: Rows of the main Excel sheet as read by readmainshet
+        srcecols: Zero based source column index for every destination column
+        nzrocols: List of column indices that must be non-zero
+        anzrcols: List of column indices for any-non-zero check
+
+    Yields:
+        tuple: The destination values of every row that is kept
+    """
+    nzroindx = [colmnmbr - 1 for colmnmbr in nzrocols]
+    anzrindx = [colmnmbr - 1 for colmnmbr in anzrcols]
+    for destvals in mainrows.project(srcecols):
+        # _NZ_ columns may not be empty or zero
+        if any(iszerovalu(destvals[colmindx]) for colmindx in nzroindx):
+            continue
+
+        # At least one of the _ANZ_ columns must have a value
+        if anzrindx:
+            anzrsumm = 0
+            for colmindx in anzrindx:
+                valu = destvals[colmindx]
+                if isinstance(valu, (int, float)) and not isinstance(valu, bool):
+                    anzrsumm += abs(valu)
+            if anzrsumm == 0:
+                continue
+
+        yield destvals
+
+
+def layoutTheSheet(destrows, thisdefn, defnname, busnunitname, cldrmnth,
+                   cldryear, totlcols, aftrtotldefn, numbspan=None):
+    """Lay out the rows of a report sheet in the order they are written.
+
+    Every row is a dictionary of column number to (value, format) pairs, the
+    format being a key into CELL_FORMATS. The title, headcount, totals and
+    control rows above the data are complete before the first data row, so
+    the rows can be streamed to any worksheet backend.
+
+    Args:
+        destrows: The kept rows of the definition as produced by filtrrows
         thisdefn: List of [source_column, dest_column] mappings
         defnname: Name of this definition/report
         busnunitname: Business unit name
         cldrmnth: Calendar month
         cldryear: Calendar year
         totlcols: List of column indices to total
-        nzrocols: List of column indices that must be non-zero
-        anzrcols: List of column indices for any-non-zero check
         aftrtotldefn: Dictionary of additional totals to add after main totals
-        
+        numbspan: Offsets of the first and last row with a number in each
+                  total column when already known, they are looked up in
+                  destrows otherwise
+
     Returns:
-        int: Number of data rows (headcount) in the populated sheet
+        tuple: (sheetrows, mergrnge, colsused) - iterator of (row, cells)
+               pairs, the title range to merge and the number of columns used
     """
-    headcntr = 0
+    headcntr = len(destrows)
     rowsstrt = 5 + len(aftrtotldefn) + 2
-    # Gather some details of the Main Excel
-    exclrowsused = exclmainshet.max_row
-    
-    # Add the title to A1
-    titlcell = destshet.cell(row = 1, column = 1)
-    fontsizelrge(titlcell)
-    makefontbold(titlcell)
-    titlcell.value = busnunitname + " - " + defnname + " - " + cldrmnth + " " + cldryear
-    titlcell.alignment = Alignment(horizontal='general',vertical='center',text_rotation=0,wrap_text=False,shrink_to_fit=False,indent=0)
+    rowslast = rowsstrt + headcntr
+    colsdefn = len(thisdefn)
 
-    destshet.row_dimensions[1].height = None
-    
-    destcolm = 1
-    dlterows = []
-    anzrsums = defaultdict(float)
-    # Create the Column headers
-    for maincolm,thiscolm in thisdefn:
-
-        # Insert the header
-        destcell = destshet.cell(row = rowsstrt, column = destcolm)
-        destcell.value = thiscolm
-        frmttotltitl(destcell)
-
-        # If it is a total column, add the header above also
-        if destcolm in totlcols:
-            destcell = destshet.cell(row = 1, column = destcolm)
-            destcell.value = thiscolm
-            frmttotltitl(destcell)
-
-        # Copy the cells below the column headers
-        rowscntr = 2
-        headcntr = 0
-        anzrrows = []
-        while rowscntr <= exclrowsused:
-            destcell = destshet.cell(row = rowscntr + rowsstrt - 1, column = destcolm)
-            destshet.row_dimensions[rowscntr].height = None
-            fromcell=exclmainshet.cell(row = rowscntr, column = maincolmhdrs[maincolm])
-            destcell.value = fromcell.value 
-            fontsizenrml(destcell)
-
-            # Initialize row sum if needed
-            if destcell.row not in anzrsums:
-                anzrsums[destcell.row] = 0
-                
-            if destcolm in nzrocols or destcolm in anzrcols:
-                if isinstance(destcell.value, (int, float)) and not isinstance(destcell.value, bool):
-                    if destcolm in anzrcols:
-                        anzrsums[destcell.row] += abs(destcell.value)
-                    if destcolm in nzrocols:
-                        if abs(destcell.value) < 1e-12:
-                            if destcell.row not in dlterows:
-                                dlterows.append(destcell.row)
-                elif isinstance(destcell.value, str):
-                    if destcolm in nzrocols:
-                        if destcell.value.strip() == "":
-                            if destcell.row not in dlterows:
-                                dlterows.append(destcell.row)
-                elif destcell.value is None:
-                    if destcolm in nzrocols:
-                        if destcell.row not in dlterows:
-                            dlterows.append(destcell.row)
-
-            # Clean up the values in columns being added up            
-            if destcolm in totlcols:
-                if destcell.value is None:
-                    destcell.value = 0.00
-                destcell.number_format = NUMBER_FORMAT
-
-            rowscntr += 1
-            headcntr += 1
-        destcolm += 1
+    if totlcols and totlcols[0] == 1:
+        raise ValueError("The first column of " + defnname + " cannot be a _SUM_ column")
+    if aftrtotldefn and len(totlcols) < 2:
+        raise ValueError("Totals after the main totals of " + defnname + " need at least two _SUM_ columns")
 
+    # The row totals on the right go into an extra column
     if len(totlcols) > 1:
-        destcell = destshet.cell(row = rowsstrt, column = destcolm)
-        destcell.value = "Total"
-        frmttotltitl(destcell)
-
-    # Remove rows that do not have anything in one of the _ANZ_ columns
-    # by adding the rows to the rows that should be deleted
-    if anzrcols:
-        for anzrrown in anzrsums.keys():
-            if anzrsums[anzrrown] == 0:
-                if anzrrown not in dlterows:
-                    dlterows.append(anzrrown)
-
-    # Remove the zero value ones _NZ_ columns from the sheet
-    dlterows.sort(reverse = True)
-    if dlterows:
-        for dlterown in dlterows:
-            destshet.delete_rows(dlterown,1)
-            headcntr -= 1
-
-    # If all the lines were eliminated, the sheet should not be created
-    if headcntr == 0: 
-        return headcntr
-
+        sidetotlcolm = colsdefn + 1
+    else:
+        sidetotlcolm = None
+    colsused = sidetotlcolm or colsdefn
 
-    # Add up the totals if there are any
-    
-    if len(totlcols) > 0:
-        rowsused = destshet.max_row
-        colsused = destshet.max_column
-        colmnmbr = 1
-
-        totllinecels = defaultdict(list)
-
-        while colmnmbr <= colsused:
-
-            totlcellblow = destshet.cell(row = rowsused + 1, column = colmnmbr)
-
-            # Colour all the cells in the total line
-            fillcellcolr(totlcellblow)
-
-            if colmnmbr in totlcols:
-                frmttotlvalu(totlcellblow)
-
-                totlcellabov = destshet.cell(row = 2           , column = colmnmbr)
-                frmttotlvalu(totlcellabov)
-
-                ctrlcellabov = destshet.cell(row = 3           , column = colmnmbr)
-                #fontsizelrge(ctrlcellabov)
-                fontsizenrml(ctrlcellabov)
-
-                rowscntr = rowsstrt + 1
-                totlcolmcels = defaultdict(list)
-                # ??????????????????????????????????????
-                while rowscntr <= rowsused:
-                    valucell = destshet.cell(row = rowscntr, column = colmnmbr)
-                    if type(valucell.value) in [int, float]:
-                        totlcolmcels[colmnmbr].append(valucell.coordinate)
-                        totllinecels[rowscntr].append(valucell.coordinate)
-                    
-                    rowscntr += 1
-
-                # load the cell value into bottom and above cells
-                totlcellblow.value = "=SUM(" + totlcolmcels[colmnmbr][0] + ":" + totlcolmcels[colmnmbr][-1] + ")"
-                totlcellabov.value = "=SUM(" + totlcolmcels[colmnmbr][0] + ":" + totlcolmcels[colmnmbr][-1] + ")"
-                ctrlcellabov.value = "=IF(" + totlcellblow.coordinate+ "=" + totlcellabov.coordinate + ",TRUE,FALSE)"
-                
-            if colmnmbr == 1:
-                totlcellblow.value = "Grand Total"
-                frmttotltitl(totlcellblow)
-
-            colmnmbr += 1
-   
-    rowscntr = rowsstrt + 1 
-    rowslast = destshet.max_row - 1
-    colmlast = destshet.max_column 
-    sidetotllist = []
-    
-    if len(totlcols) > 1:
-        # Row totals on the right
-        while rowscntr <= rowslast:
-            sidetotlcels = []
-            for colmnmbr in totlcols:
-                thiscell = destshet.cell(row = rowscntr, column = colmnmbr)
-                sidetotlcels.append(thiscell.coordinate)
-
-            thiscell = destshet.cell(row = rowscntr, column = colmlast)
-            fontsizenrml(thiscell)
-            makefontbold(thiscell)
-            thiscell.value = "=SUM(" + ",".join(sidetotlcels) + ")"
-            thiscell.number_format = NUMBER_FORMAT
-            sidetotllist.append(thiscell.coordinate)
-            rowscntr += 1
-        
-        sidetotlcolm = colsused 
-        sidetotlcell = destshet.cell(row = 1, column = sidetotlcolm)
-        sidetotlcell.value = "Total"
-        frmttotltitl(sidetotlcell)
-
-        # Total on the right Above
-        sidetotlabov = destshet.cell(row = 2, column = sidetotlcolm)
-        sidetotlabov.value = "=sum(" + sidetotllist[0] + ":" + sidetotllist[-1] + ")"
-        frmttotlvalu(sidetotlabov)
-
-        # Bottom total on the right
-        sidetotlblow = destshet.cell(row = rowscntr, column = colmlast)
-        sidetotlblow.value = "=sum(" + sidetotllist[0] + ":" + sidetotllist[-1] + ")"
-        frmttotlvalu(sidetotlblow)
-
-        # Control at top right
-        sidectrlcell = destshet.cell( row = 3, column=sidetotlcolm)
-        sidectrlcell.value = "=IF(" + sidetotlblow.coordinate+ "=" + sidetotlabov.coordinate + ",TRUE,FALSE)"
-        fontsizenrml(sidectrlcell)
-
-    if len(totlcols) > 0:
-        # Insert the pesky "Total" before the first total column
-        thiscell = destshet.cell( row = 2, column = totlcols[0] - 1 )
-        thiscell.value = "Total"
-        #fontsizelrge(thiscell)
-        fontsizenrml(thiscell)
-        makefontbold(thiscell)
-        frsttotlcolm=totlcols[0]
+    if totlcols:
+        frsttotlcolm = totlcols[0]
+        grndtotlrown = rowslast + 1
     else:
         frsttotlcolm = 6
+        grndtotlrown = None
+
+    # Find the first and last number in each column being added up
+    if numbspan is None:
+        numbspan = {}
+        for colmnmbr in totlcols:
+            colmindx = colmnmbr - 1
+            numbrows = [rowsoffs for rowsoffs, destvals in enumerate(destrows)
+                        if type(destvals[colmindx]) in [int, float]]
+            if numbrows:
+                numbspan[colmnmbr] = (numbrows[0], numbrows[-1])
+    totlrnge = {}
+    for colmnmbr in totlcols:
+        if colmnmbr not in numbspan:
+            raise ValueError("The _SUM_ column " + thisdefn[colmnmbr - 1][1] + " of " + defnname + " has no numbers")
+        frstoffs, lastoffs = numbspan[colmnmbr]
+        totlrnge[colmnmbr] = (
+            get_column_letter(colmnmbr) + str(rowsstrt + 1 + frstoffs) + ":" +
+            get_column_letter(colmnmbr) + str(rowsstrt + 1 + lastoffs)
+        )
+
+    sidecolmltr = get_column_letter(sidetotlcolm) if sidetotlcolm else None
+    sidetotlrnge = None
+    if sidetotlcolm:
+        sidetotlrnge = sidecolmltr + str(rowsstrt + 1) + ":" + sidecolmltr + str(rowslast)
+
+    toprows = defaultdict(dict)
+
+    # Add the title to A1 and the headers of the total columns next to it
+    toprows[1][1] = (busnunitname + " - " + defnname + " - " + cldrmnth + " " + cldryear, "titl")
+    for colmnmbr in totlcols:
+        toprows[1][colmnmbr] = (thisdefn[colmnmbr - 1][1], "hedrline")
+        toprows[2][colmnmbr] = ("=SUM(" + totlrnge[colmnmbr] + ")", "totlvalu")
+        toprows[3][colmnmbr] = (
+            "=IF(" + get_column_letter(colmnmbr) + str(grndtotlrown) + "=" +
+            get_column_letter(colmnmbr) + "2,TRUE,FALSE)", "nrml"
+        )
+
+    if sidetotlcolm:
+        toprows[1][sidetotlcolm] = ("Total", "hedrline")
+        toprows[2][sidetotlcolm] = ("=sum(" + sidetotlrnge + ")", "totlvalu")
+        toprows[3][sidetotlcolm] = (
+            "=IF(" + sidecolmltr + str(grndtotlrown) + "=" + sidecolmltr + "2,TRUE,FALSE)", "nrml"
+        )
+
+    # Insert the pesky "Total" before the first total column
+    if totlcols:
+        toprows[2][frsttotlcolm - 1] = ("Total", "nrmlbold")
+
+    # Add the headcount on line 2 Column A, it takes the place of the
+    # "Total" when the first total column is B
+    if totlcols and frsttotlcolm == 2:
+        toprows[2][1] = ("Total Headcount: " + str(headcntr), "nrmlbold")
+    else:
+        toprows[2][1] = ("Total Headcount: " + str(headcntr), "bold")
 
     # SARS Stuff
-    if len(aftrtotldefn) > 0:
+    if aftrtotldefn:
         aftrtotlrown = 5
         aftrtotlcels = []
         for aftrtotl in aftrtotldefn:
-            aftrtitlcell = destshet.cell( row = aftrtotlrown, column = sidetotlcolm -1 )
-            aftrtitlcell.value = aftrtotl.strip("_")
-            fontsizenrml(aftrtitlcell)
-            makefontbold(aftrtitlcell)
-            fillcellcolr(aftrtitlcell)
-            
-            aftrvalucell = destshet.cell( row = aftrtotlrown, column = sidetotlcolm  )
-            # For the sum of sums
-            aftrtotlcels.append(aftrvalucell.coordinate)
-
-            # Make a list of coordinates
-            aftrsnglcels = []
-            for aftrtotlcolm in aftrtotldefn[aftrtotl]:
-                aftrsnglcell = destshet.cell( row = 2, column = aftrtotlcolm)
-                aftrsnglcels.append(aftrsnglcell.coordinate)
-            # Add them up
-            aftrvalucell.value = "=SUM(" + ",".join(aftrsnglcels) + ")"
-            fontsizenrml(aftrvalucell)
-            makefontbold(aftrvalucell)
-            aftrvalucell.number_format = NUMBER_FORMAT
-
-            aftrtotlrown = aftrtotlrown + 1
-            
-
-        aftrtotltitl = destshet.cell( row = aftrtotlrown, column=sidetotlcolm -1 )
-        fontsizenrml(aftrtotltitl)
-        makefontbold(aftrtotltitl)
-        fillcellcolr(aftrtotltitl)
-        aftrtotltitl.value = "Total"
-        aftrtotlvalu = destshet.cell( row = aftrtotlrown, column=sidetotlcolm )
-        fontsizenrml(aftrtotlvalu)
-        makefontbold(aftrtotlvalu)
-        aftrtotlvalu.value = "=SUM(" + ",".join(aftrtotlcels) + ")"
-        aftrtotlvalu.number_format = NUMBER_FORMAT
-        frmttotlvalu(aftrtotlvalu)
-
-            
+            aftrsnglcels = [get_column_letter(aftrtotlcolm) + "2" for aftrtotlcolm in aftrtotldefn[aftrtotl]]
+            toprows[aftrtotlrown][sidetotlcolm - 1] = (aftrtotl.strip("_"), "aftrtitl")
+            toprows[aftrtotlrown][sidetotlcolm] = ("=SUM(" + ",".join(aftrsnglcels) + ")", "sidenumb")
+            aftrtotlcels.append(sidecolmltr + str(aftrtotlrown))
+            aftrtotlrown += 1
+
+        # The last one is underlined by the total below it
+        toprows[aftrtotlrown - 1][sidetotlcolm] = (toprows[aftrtotlrown - 1][sidetotlcolm][0], "sidenumbline")
+        toprows[aftrtotlrown][sidetotlcolm - 1] = ("Total", "aftrtitl")
+        toprows[aftrtotlrown][sidetotlcolm] = ("=SUM(" + ",".join(aftrtotlcels) + ")", "totlvalu")
+
+    # Create the Column headers
+    for colmnmbr, (maincolm, thiscolm) in enumerate(thisdefn, 1):
+        toprows[rowsstrt][colmnmbr] = (thiscolm, "hedr")
+    if sidetotlcolm:
+        toprows[rowsstrt][sidetotlcolm] = ("Total", "hedr")
+
+    def sheetrows():
+        for rownmbr in sorted(toprows):
+            yield rownmbr, toprows[rownmbr]
+
+        # The data lines with the row totals on the right, the last line is
+        # underlined by the grand totals below it
+        rownmbr = rowsstrt
+        for destvals in destrows:
+            rownmbr += 1
+            lastrow = rownmbr == rowslast
+            rowcels = {}
+            for colmnmbr, destvalu in enumerate(destvals, 1):
+                if colmnmbr in totlcols:
+                    rowcels[colmnmbr] = (destvalu, "numbline" if lastrow else "numb")
+                else:
+                    rowcels[colmnmbr] = (destvalu, "nrml")
+            if sidetotlcolm:
+                sidetotlcels = [get_column_letter(colmnmbr) + str(rownmbr) for colmnmbr in totlcols]
+                rowcels[sidetotlcolm] = ("=SUM(" + ",".join(sidetotlcels) + ")",
+                                         "sidenumbline" if lastrow else "sidenumb")
+            yield rownmbr, rowcels
+
+        # Grand totals below, with every cell in the line coloured
+        if grndtotlrown:
+            rowcels = {}
+            for colmnmbr in range(1, colsused + 1):
+                rowcels[colmnmbr] = (None, "fill")
+            for colmnmbr in totlcols:
+                rowcels[colmnmbr] = ("=SUM(" + totlrnge[colmnmbr] + ")", "grndtotl")
+            if sidetotlcolm:
+                rowcels[sidetotlcolm] = ("=sum(" + sidetotlrnge + ")", "grndtotl")
+            rowcels[1] = ("Grand Total", "hedr")
+            yield grndtotlrown, rowcels
+
     # Merge the cells for the title on the left.
-    destshet.merge_cells(start_row=1, start_column=1, end_row=1, end_column=frsttotlcolm - 1)
+    mergrnge = "A1:" + get_column_letter(frsttotlcolm - 1) + "1"
+
+    return sheetrows(), mergrnge, max(colsused, frsttotlcolm - 1)
+
+
+def writesheetrows(destshet, sheetrows, mergrnge, colsused, cellstyl):
+    """Write laid out rows to a worksheet.
+
+    A regular worksheet has its cells set directly, a write-only worksheet
+    gets the rows appended in order with blank rows for the gaps. The width
+    of every column is measured from the values as they are written and set
+    explicitly, Excel ignores auto_size.
+
+    Args:
+        destshet: Destination worksheet, regular or write-only
+        sheetrows: Iterator of (row, cells) pairs from layoutTheSheet
+        mergrnge: Cell range of the title to merge
+        colsused: Number of columns used by the sheet
+        cellstyl: StyleRegistry of the destination workbook
+    """
+    destshet.row_dimensions[1].height = None
+    colmwdth = ColumnWidths()
+
+    if destshet.parent.write_only:
+        # The widths come before the rows in the file, so the laid out rows
+        # are measured first and turned into cells once the widths are set
+        sheetrows = list(sheetrows)
+        for rownmbr, rowcels in sheetrows:
+            for colmnmbr, (valu, frmtname) in rowcels.items():
+                colmwdth.measure(colmnmbr, valu, frmtname)
+        colmwdth.apply(destshet, colsused)
+        nextrown = 1
+        for rownmbr, rowcels in sheetrows:
+            while nextrown < rownmbr:
+                destshet.append([])
+                nextrown += 1
+            rowlist = [None] * max(rowcels)
+            for colmnmbr, (valu, frmtname) in rowcels.items():
+                destcell = WriteOnlyCell(destshet, value=valu)
+                cellstyl.applycellfrmt(destcell, frmtname)
+                rowlist[colmnmbr - 1] = destcell
+            destshet.append(rowlist)
+            nextrown += 1
+        destshet.merged_cells.add(mergrnge)
+    else:
+        for rownmbr, rowcels in sheetrows:
+            for colmnmbr, (valu, frmtname) in rowcels.items():
+                destcell = destshet.cell(row = rownmbr, column = colmnmbr)
+                destcell.value = valu
+                cellstyl.applycellfrmt(destcell, frmtname)
+                colmwdth.measure(colmnmbr, valu, frmtname)
+        destshet.merge_cells(mergrnge)
+        colmwdth.apply(destshet, colsused)
+
+def buildTheSheet(mainrows, maincolmhdrs, thisdefn, defnname, busnunitname,
+                  cldrmnth, cldryear, totlcols, nzrocols, anzrcols, aftrtotldefn,
+                  maintabl=None):
+    """Filter and lay out a report sheet without touching any worksheet.
+
+    With a columnar.ColumnTable of the main sheet the rows are filtered and
+    added up by the NumPy engine, otherwise row by row with filtrrows.
 
-    # Add the headcount on line 2 Column A
-    headcntrcell = destshet.cell( row = 2, column = 1 ) 
-    headcntrcell.value = 'Total Headcount: ' + str(headcntr)
-    makefontbold(headcntrcell)
+    Args:
+        mainrows: Rows of the main Excel sheet as read by readmainshet
+        maincolmhdrs: Dictionary mapping column names to column indices
+        thisdefn: List of [source_column, dest_column] mappings
+        defnname: Name of this definition/report
+        busnunitname: Business unit name
+        cldrmnth: Calendar month
+        cldryear: Calendar year
+        totlcols: List of column indices to total
+        nzrocols: List of column indices that must be non-zero
+        anzrcols: List of column indices for any-non-zero check
+        aftrtotldefn: Dictionary of additional totals to add after main totals
+        maintabl: ColumnTable of mainrows for the NumPy engine, or None
 
-    # Make all the columns auto sizing
-    for cols in destshet.columns:
-        col = get_column_letter(cols[0].column)
-        destshet.column_dimensions[col].auto_size = True
+    Returns:
+        tuple: (headcntr, sheetlayt) - the number of data rows and the
+               (sheetrows, mergrnge, colsused) result of layoutTheSheet, or
+               None when no rows are left
+    """
+    srcecols = [maincolmhdrs[maincolm] - 1 for maincolm, thiscolm in thisdefn]
+
+    # Without any columns there are no lines to report
+    if not srcecols:
+        return 0, None
+
+    # Keep the rows that pass the _NZ_ and _ANZ_ rules and clean up the
+    # empty values in columns being added up
+    numbspan = None
+    if maintabl is not None:
+        destrows, keptindx, numbspan = maintabl.filtrsection(srcecols, totlcols, nzrocols, anzrcols)
+        if len(destrows) and logger.isEnabledFor(logging.DEBUG):
+            ctrltotl = maintabl.sectiontotals(keptindx, srcecols, totlcols, aftrtotldefn)
+            logger.debug("Control totals of %s: columns %s, grand total %.2f, after totals %s", defnname,
+                         {colmnmbr: round(totl, 2) for colmnmbr, totl in ctrltotl["colmtotl"].items()},
+                         ctrltotl["grndtotl"],
+                         {aftrname: round(totl, 2) for aftrname, totl in ctrltotl["aftrtotl"].items()})
+    else:
+        totlindx = [colmnmbr - 1 for colmnmbr in totlcols]
+        destrows = []
+        for destvals in filtrrows(mainrows, srcecols, nzrocols, anzrcols):
+            if any(destvals[colmindx] is None for colmindx in totlindx):
+                destvals = list(destvals)
+                for colmindx in totlindx:
+                    if destvals[colmindx] is None:
+                        destvals[colmindx] = 0.00
+                destvals = tuple(destvals)
+            destrows.append(destvals)
+
+    # If all the lines were eliminated, the sheet should not be created
+    headcntr = len(destrows)
+    if headcntr == 0: 
+        return headcntr, None
+
+    sheetlayt = layoutTheSheet(
+        destrows, thisdefn, defnname, busnunitname, cldrmnth, cldryear,
+        totlcols, aftrtotldefn, numbspan
+    )
+    return headcntr, sheetlayt
+
+
+def flatfilename(exclfilename, defnname):
+    """Return the path of the upload file of a .FILE section.
+
+    Args:
+        exclfilename: Path to the payroll file, the upload file goes next to it
+        defnname: Name of the section, e.g. "CEPPWAWU.FILE"
+
+    Returns:
+        str: E.g. "<payroll file name> CEPPWAWU.csv"
+    """
+    sectname = defnname[:-len(".FILE")] if defnname.upper().endswith(".FILE") else defnname
+    return path.join(path.dirname(exclfilename),
+                     path.splitext(path.basename(exclfilename))[0] + " " + sectname + ".csv")
+
+
+def exportTheFile(mainrows, maincolmhdrs, flatname, thisdefn, defnname, busnunitname,
+                  cldrmnth, cldryear, totlcols, nzrocols, anzrcols, skipcntr):
+    """Stream a .FILE section to its upload file without building a sheet.
+
+    The rows are filtered by the same _NZ_ and _ANZ_ rules as a tab, one at
+    a time, and written straight to the file.
+
+    Args:
+        mainrows: Rows of the main Excel sheet as read by readmainshet
+        maincolmhdrs: Dictionary mapping column names to column indices
+        flatname: Path of the upload file
+        thisdefn: List of [source_column, dest_column] mappings
+        defnname: Name of this definition
+        busnunitname: Business unit name
+        cldrmnth: Calendar month
+        cldryear: Calendar year
+        totlcols: List of column indices to total
+        nzrocols: List of column indices that must be non-zero
+        anzrcols: List of column indices for any-non-zero check
+        skipcntr: Number of lines before the column headers, SKIP
+
+    Returns:
+        int: Number of rows written, no file is written for none
+    """
+    srcecols = [maincolmhdrs[maincolm] - 1 for maincolm, thiscolm in thisdefn]
+    if not srcecols:
+        return 0
+
+    title = busnunitname + " - " + defnname + " - " + cldrmnth + " " + cldryear
+    return writeflatfile(
+        flatname, filtrrows(mainrows, srcecols, nzrocols, anzrcols),
+        [thiscolm for maincolm, thiscolm in thisdefn], totlcols, title, skipcntr
+    )
+
+
+def sectionfilename(exclfilename, defnname):
+    """Return the path of the workbook of a section in split output.
+
+    Args:
+        exclfilename: Path to the payroll file, the workbook goes next to it
+        defnname: Name of the section
+
+    Returns:
+        str: E.g. "<payroll file name> CEPPWAWU.TAB.xlsx"
+    """
+    return path.join(path.dirname(exclfilename),
+                     path.splitext(path.basename(exclfilename))[0] + " " + defnname + ".xlsx")
+
+
+def outputsuffixes(recipeplan):
+    """Return how the names of the files of the sections of a recipe end.
+
+    Args:
+        recipeplan: The compiled RecipePlan
+
+    Returns:
+        tuple: E.g. (" CEPPWAWU.csv", " Discovery.TAB.xlsx"), the upload
+               files and the split output workbooks
+    """
+    return tuple(
+        path.basename((flatfilename if sectplan.isfile else sectionfilename)("", sectplan.defnname))
+        for sectplan in recipeplan.sections
+    )
+
+
+def isoutputfile(filename, rcpesuffixes=()):
+    """Check whether a file was written by a run, so is no payroll file.
+
+    Args:
+        filename: Name or path of the file
+        rcpesuffixes: Name endings of the section files of the recipe, from
+                      outputsuffixes
+
+    Returns:
+        bool: True for a " Tabs.xlsx" workbook or a file of a section
+    """
+    return path.basename(filename).endswith((" Tabs.xlsx",) + tuple(rcpesuffixes))
+
+
+def savesectionbook(sectfilename, defnname, sheetlayt):
+    """Write a laid out section to a workbook of its own.
+
+    The workbook is write-only, it only ever gets the one tab. It runs in a
+    worker process of the section pool, or in this one without a pool.
+
+    Args:
+        sectfilename: Path of the workbook
+        defnname: Name of the section, the title of the tab
+        sheetlayt: (sheetrows, mergrnge, colsused), with the rows in a list
+                   when it goes to a worker process
+
+    Returns:
+        float: Seconds taken to write and save the workbook
+    """
+    strttime = time.perf_counter()
+    sectbook = Workbook(write_only=True)
+    sectshet = sectbook.create_sheet(title=defnname)
+    sectshet.sheet_view.showGridLines = True
+    writesheetrows(sectshet, *sheetlayt, StyleRegistry())
+    sectbook.save(sectfilename)
+    return time.perf_counter() - strttime
+
+
+# Source data of a section worker process, set once by initsectionworker
+workerdata = {}
+
+
+def initsectionworker(mainrows, maincolmhdrs, usenumpy=False):
+    """Keep the source data in a worker process for all its sections.
+
+    Args:
+        mainrows: Rows of the main Excel sheet as read by readmainshet
+        maincolmhdrs: Dictionary mapping column names to column indices
+        usenumpy: Build the sections with the NumPy engine
+    """
+    workerdata["mainrows"] = mainrows
+    workerdata["maincolmhdrs"] = maincolmhdrs
+    workerdata["maintabl"] = columnar.ColumnTable(mainrows) if usenumpy else None
+
+
+def buildsectionjob(sectjob):
+    """Build one section in a worker process.
+
+    Args:
+        sectjob: The buildTheSheet arguments after maincolmhdrs
+
+    Returns:
+        tuple: (headcntr, sheetlayt, buildsecs) as buildTheSheet, with the
+               rows in a list so that they can be sent back to the main
+               process, and the seconds it took
+    """
+    strttime = time.perf_counter()
+    headcntr, sheetlayt = buildTheSheet(workerdata["mainrows"], workerdata["maincolmhdrs"], *sectjob,
+                                        maintabl=workerdata["maintabl"])
+    if sheetlayt is not None:
+        sheetrows, mergrnge, colsused = sheetlayt
+        sheetlayt = (list(sheetrows), mergrnge, colsused)
+    return headcntr, sheetlayt, time.perf_counter() - strttime
+
+
+def populateTheSheet(mainrows, maincolmhdrs, destshet, thisdefn, defnname, 
+                     busnunitname, cldrmnth, cldryear, totlcols, nzrocols, 
+                     anzrcols, aftrtotldefn, cellstyl=None, maintabl=None):
+    """Populate a worksheet with formatted data from the main Excel sheet.
+    
+    Nothing is written to the worksheet when no rows pass the filters.
+
+    Args:
+        mainrows: Rows of the main Excel sheet as read by readmainshet
+        maincolmhdrs: Dictionary mapping column names to column indices
+        destshet: Destination worksheet to populate, regular or write-only
+        thisdefn: List of [source_column, dest_column] mappings
+        defnname: Name of this definition/report
+        busnunitname: Business unit name
+        cldrmnth: Calendar month
+        cldryear: Calendar year
+        totlcols: List of column indices to total
+        nzrocols: List of column indices that must be non-zero
+        anzrcols: List of column indices for any-non-zero check
+        aftrtotldefn: Dictionary of additional totals to add after main totals
+        cellstyl: StyleRegistry shared by the sheets of the destination
+                  workbook, a new one is used when omitted
+        maintabl: ColumnTable of mainrows for the NumPy engine, or None
+        
+    Returns:
+        int: Number of data rows (headcount) in the populated sheet
+    """
+    headcntr, sheetlayt = buildTheSheet(
+        mainrows, maincolmhdrs, thisdefn, defnname, busnunitname, cldrmnth,
+        cldryear, totlcols, nzrocols, anzrcols, aftrtotldefn, maintabl
+    )
+    if sheetlayt is None:
+        return headcntr
+
+    if cellstyl is None:
+        cellstyl = StyleRegistry()
+    writesheetrows(destshet, *sheetlayt, cellstyl)
 
     return headcntr
     
 
-def processFiles(defnfilename, exclfilename, cldrmnth, cldryear, busnunitname, debug_enabled):
+class ProcessingCancelled(Exception):
+    """Raised between two sections when the caller cancelled the run."""
+
+
+def processFiles(defnfilename, exclfilename, cldrmnth, cldryear, busnunitname, debug_enabled,
+                 readonly=False, writeonly=False, workers=1, recipeplan=None, engine="auto",
+                 runreport=None, usecache=True, incremental=False, progress=None, cancel=None,
+                 source=None, splitoutput=False):
     """Process Excel payroll files according to definition file specifications.
     
     Reads a definition INI file and an Excel payroll file, then creates formatted
@@ -430,18 +1020,56 @@ def processFiles(defnfilename, exclfilename, cldrmnth, cldryear, busnunitname, d
     
     Args:
         defnfilename: Path to the INI definition file
-        exclfilename: Path to the Excel payroll file
+        exclfilename: Path to the Excel payroll file, or to a CSV or TSV
+                      export of its main sheet
         cldrmnth: Calendar month (e.g., "Jan", "Feb")
         cldryear: Calendar year (e.g., "2025")
         busnunitname: Business unit name
         debug_enabled: Whether to enable debug logging (currently unused, uses logging level)
-        
+        readonly: Open the payroll file read-only and write the tabs to a
+                  separate workbook that does not contain the source sheet,
+                  the source table may come from the source cache
+        writeonly: Stream the tabs to a separate write-only workbook that
+                   does not contain the source sheet, the source table may
+                   come from the source cache
+        workers: Number of processes building the sections, and saving them
+                 in split output, in parallel. The sheets are still added to
+                 the workbook in INI order. With 1 nothing runs in another
+                 process.
+        recipeplan: The compiled RecipePlan of the definition file, it is
+                    loaded from defnfilename (or the recipe cache) when omitted
+        engine: "numpy" to filter and add up the rows with NumPy, "python"
+                for the plain Python path, or "auto" to use NumPy when it
+                is installed
+        runreport: RunReport filled in with the timings of every phase and
+                   section and the row counts of the run
+        usecache: Use the recipe and source caches, set to False to read
+                  both files again
+        incremental: Only build the sections whose recipe or source data
+                     changed since an earlier run, the others come from the
+                     section store, and leave an up to date output alone
+        progress: Called as progress(defnname, sectnmbr, sectcount, rowsdone)
+                  after every section, with the number of sections done, the
+                  number of sections of the run and the data rows written
+        cancel: A threading.Event, when it is set the run stops before the
+                next section and nothing is saved
+        source: The payroll file as loaded by loadsource with the same
+                readonly and writeonly, it is loaded here when omitted. A
+                loaded workbook gets the tabs added, so it is used only once.
+        splitoutput: Write every tab to a workbook of its own next to the
+                     payroll file instead of one " Tabs.xlsx", the workbooks
+                     are saved on the same pool of workers processes that
+                     builds the sections, or one after the other when
+                     workers is 1
+
     Returns:
-        tuple: (status, result) where status is "Success" or "Failed" and result is 
-               empty string on success or error message on failure
+        tuple: (status, result) where status is "Success", "Failed" or
+               "Cancelled" and result is empty string on success or error
+               message otherwise
     """
     datafilefldr = path.dirname(exclfilename)
-    newxfilename = path.join(datafilefldr, str(path.basename(exclfilename.replace(".xlsx", " Tabs.xlsx"))))
+    newxfilename = path.join(datafilefldr, path.splitext(path.basename(exclfilename))[0] + " Tabs.xlsx")
+    flatdlmt = flatdelimiter(exclfilename)
 
     logger.info("Running in folder: %s", os.getcwd())
     logger.info("Selected Month: %s", cldrmnth)
@@ -452,6 +1080,10 @@ def processFiles(defnfilename, exclfilename, cldrmnth, cldryear, busnunitname, d
     logger.info("New Main Excel file: %s", os.path.basename(newxfilename))
     logger.info("New files created here: %s", datafilefldr)
 
+    if runreport is None:
+        runreport = RunReport()
+    runreport.files = {"defn": defnfilename, "excl": exclfilename, "output": newxfilename}
+
     # Main, start of the program
     try:
 
@@ -471,121 +1103,246 @@ def processFiles(defnfilename, exclfilename, cldrmnth, cldryear, busnunitname, d
         if not filepass:
             return("Failed","Invalid files selected")
 
-        # Parse the definition file
-        defndict = defnfileprse(defnfilename)
-
-        # Open the input Excel sheet and request the result of instead of
-        # the formulas itself and take some measurements.
-        exclmainbook = load_workbook(exclfilename,data_only=True)
-        exclmainshet = exclmainbook[exclmainbook.sheetnames[0]]
-        exclcolsused = exclmainshet.max_column
-      
-        # Make a list of column headers from the input sheet
-        colmcntr = 1
-        maincolmhdrs = {}
-        while colmcntr <= exclcolsused:
-            maincolmname=exclmainshet.cell(row = 1, column = colmcntr).value
-            maincolmhdrs[maincolmname] = colmcntr
-            colmcntr += 1
-
-        # Process each section in the INI file
-        for defn in defndict:
-            
-            givndefn = defndict[defn]
-            defnname = defn
-            if defnname == "COMPANIES":
+        if engine not in ("auto", "numpy", "python"):
+            return("Failed", "Unknown engine: " + str(engine))
+        usenumpy = engine == "numpy" or (engine == "auto" and columnar.available())
+        if usenumpy and not columnar.available():
+            return("Failed", "The numpy engine needs NumPy to be installed")
+
+        # Compile the definition file, or take it from the recipe cache
+        with runreport.phase("recipe"):
+            if recipeplan is None:
+                recipeplan = loadrecipeplan(defnfilename, usecache)
+
+        # In incremental mode a re-run of the same recipe on the same source
+        # leaves an output that is up to date alone, as long as the upload
+        # files of its .FILE sections are still there. Split output has no one
+        # output to check, only its sections are reused. The hash of the
+        # source is worked out once, the source cache uses it as well.
+        srcedigest = None
+        if incremental:
+            with runreport.phase("incremental"):
+                srcedigest = filedigest(exclfilename)
+                outputmode = "tabs" if readonly or writeonly or flatdlmt else "full"
+                thisrunkey = runkey(recipeplan, srcedigest, cldrmnth, cldryear, busnunitname, outputmode)
+                uptodate = not splitoutput and isuptodate(newxfilename, thisrunkey)
+            if uptodate:
+                logger.info("Output %s is up to date", os.path.basename(newxfilename))
+                runreport.finish("Success", "")
+                return("Success", "")
+
+        # Read the main sheet once into memory, the sections are projected
+        # out of this table. When the tabs go into a new workbook the source
+        # workbook itself is not needed and the table can come from the
+        # source cache. A CSV or TSV export has no workbook at all.
+        # Split output does not need the source workbook either.
+        if source is None:
+            source = loadsource(exclfilename, readonly or splitoutput, writeonly, usecache, runreport, srcedigest)
+        exclmainbook, maincolmhdrs, mainrows = source
+        runreport.sourcerows = len(mainrows)
+        runreport.sourcecols = len(maincolmhdrs)
+
+        # The tabs are added to the source workbook when it was loaded,
+        # otherwise they go into a new workbook. A write-only workbook has
+        # no default sheet. Split output makes a workbook per section.
+        if splitoutput:
+            destbook = None
+            dfltshet = None
+        elif exclmainbook is None:
+            destbook = Workbook(write_only=writeonly)
+            dfltshet = None if writeonly else destbook.active
+        else:
+            destbook = exclmainbook
+            dfltshet = None
+
+        # The cell formats are resolved once for the whole output workbook
+        cellstyl = StyleRegistry()
+
+        # Resolve each section of the recipe against the columns of the
+        # input sheet, leaving out the sheets that cannot be created. The
+        # .FILE sections are upload files and are streamed out separately.
+        sectjobs = []
+        filejobs = []
+        for sectplan in recipeplan.sections:
+            defnname = sectplan.defnname
+            with runreport.phase("bind"):
+                sectbind = sectplan.bind(maincolmhdrs)
+
+            logger.debug("Sheet selected: %s for %s", sectbind is not None, defnname)
+            if sectbind is None:
+                runreport.addsection(defnname, "not selected")
                 continue
-            
-            # Create a list of input and output column mappings where the
-            # input column exists.
-            # nzro - no zeroes allowed
-            # anzr - any column msrked with this and has a value will result in
-            # inclusion
-            # totl These columns will be added up
-            thisdefn = list()
-            nzrocols = [] 
-            anzrcols = []
-            totlcols = []
-            destcols = defaultdict()
-
-            colmcntr = 1
-            aftrtotldefn = defaultdict(list)
-
-            shetslct = True
-            anzrpres = False
-            for maincolm, thiscolm in givndefn:
-                maincolm = maincolm.strip()
-                thiscolm = thiscolm.strip()
-
-                # Summed totals to be added after 
-                
-                if maincolm.startswith("_") and maincolm.endswith("_"):
-                    for aftrcolm in thiscolm.split("+"):
-                        aftrcolm=aftrcolm.strip()
-                        if aftrcolm in maincolmhdrs:
-                            if destcols[aftrcolm] in totlcols:
-                                aftrtotldefn[maincolm].append(destcols[aftrcolm])
-                    
-
-                
-                if "_ANZ_" in thiscolm:
-                    anzrpres = True
-                # Ignore columns that cannot be found in the input sheet.
-                if maincolm not in maincolmhdrs:
-                    if "_NZ_" in thiscolm:
-                        shetslct = False
-                        break
-                    continue
 
-                # _ANZ_ will have rows with an empty or zero value in this column to to be excluded
-                # _ANZ_ is not compatible with _NZ_ and takes priority
-                if "_ANZ_" in thiscolm:
-                    anzrcols.append(colmcntr)
-                    thiscolm = thiscolm.replace("_NZ_", "").strip()
-                    thiscolm = thiscolm.replace("_ANZ_", "").strip()
-                    
-                # _NZ_ will have rows with an empty or zero value in this column to to be excluded
-                if "_NZ_" in thiscolm:
-                    nzrocols.append(colmcntr)
-                    thiscolm = thiscolm.replace("_NZ_", "").strip()
-
-                # _SUM_ will have the values in this column added up and shown below
-                if "_SUM_" in thiscolm:
-                    totlcols.append(colmcntr)
-                    thiscolm = thiscolm.replace("_SUM_", "").strip()
-                destcols[maincolm] = colmcntr
-                thisdefn.append([maincolm, thiscolm])
-                colmcntr += 1
-
-            if anzrpres and len(anzrcols) == 0:
-                logger.warning("No ANZ columns found in main sheet for %s", defnname)
-                shetslct = False
-
-            logger.debug("Sheet selected: %s for %s", shetslct, defnname)
-            if not shetslct:
+            thisdefn, totlcols, nzrocols, anzrcols, aftrtotldefn = sectbind
+            if sectplan.isfile:
+                filejobs.append((thisdefn, defnname, busnunitname, cldrmnth, cldryear,
+                                 totlcols, nzrocols, anzrcols, sectplan.skip))
                 continue
+            sectjobs.append((
+                thisdefn, defnname, busnunitname, cldrmnth, cldryear,
+                totlcols, nzrocols, anzrcols, aftrtotldefn
+            ))
+
+        # In incremental mode the sections that did not change since they
+        # were last built come from the section store
+        sectkeys = []
+        storedsects = {}
+        if incremental:
+            with runreport.phase("incremental"):
+                for sectindx, sectjob in enumerate(sectjobs):
+                    sectkeys.append(sectionkey(sectjob, srcedigest))
+                    storedsect = loadsection(sectkeys[-1])
+                    if storedsect is not None:
+                        storedsects[sectindx] = storedsect
+        buildjobs = [sectjob for sectindx, sectjob in enumerate(sectjobs) if sectindx not in storedsects]
+
+        # Build the sheets, on a pool of worker processes if asked for. The
+        # results come back in INI order whatever the number of workers.
+        def buildserial(maintabl):
+            for sectjob in buildjobs:
+                strttime = time.perf_counter()
+                headcntr, sheetlayt = buildTheSheet(mainrows, maincolmhdrs, *sectjob, maintabl=maintabl)
+                yield headcntr, sheetlayt, time.perf_counter() - strttime
+
+        def allsections(builtsects):
+            for sectindx in range(len(sectjobs)):
+                if cancel is not None and cancel.is_set():
+                    raise ProcessingCancelled("Processing cancelled")
+                if sectindx in storedsects:
+                    yield (*storedsects[sectindx], 0.0, True)
+                    continue
+                headcntr, sheetlayt, buildsecs = next(builtsects)
+                if incremental:
+                    if sheetlayt is not None:
+                        sheetrows, mergrnge, colsused = sheetlayt
+                        sheetlayt = (list(sheetrows), mergrnge, colsused)
+                    storesection(sectkeys[sectindx], headcntr, sheetlayt)
+                yield headcntr, sheetlayt, buildsecs, False
+
+        sectstrt = time.perf_counter()
+        with ExitStack() as poolstck:
+            # One pool of at most workers processes builds the sections and
+            # saves the workbooks of split output. The workers only get the
+            # source table when they build more than one section.
+            poolbuild = len(buildjobs) > 1
+            executor = None
+            if workers > 1 and (poolbuild or splitoutput and len(sectjobs) > 1):
+                executor = ProcessPoolExecutor(
+                    max_workers=min(workers, len(sectjobs)),
+                    **(dict(initializer=initsectionworker, initargs=(mainrows, maincolmhdrs, usenumpy))
+                       if poolbuild else {})
+                )
+                poolstck.callback(executor.shutdown, cancel_futures=True)
+            if executor is not None and poolbuild:
+                builtsects = executor.map(buildsectionjob, buildjobs)
+            else:
+                with runreport.phase("columnar"):
+                    maintabl = columnar.ColumnTable(mainrows) if usenumpy and buildjobs else None
+                builtsects = buildserial(maintabl)
+            savejobs = []
+
+            rowsdone = 0
+            sectcount = len(sectjobs) + len(filejobs)
+            for sectnmbr, (sectjob, (headcntr, sheetlayt, buildsecs, reused)) in enumerate(
+                    zip(sectjobs, allsections(builtsects)), 1):
+                defnname = sectjob[1]
+
+                # No sheet if the report has a zero headcount
+                if sheetlayt is None:
+                    logger.info("Sheet '%s' skipped due to zero headcount", defnname)
+                    runreport.addsection(defnname, "skipped", headcntr, buildsecs)
+                    if progress is not None:
+                        progress(defnname, sectnmbr, sectcount, rowsdone)
+                    continue
 
-            # Create a tab in the copy of the main Excel file
-            destshet = exclmainbook.create_sheet(title=defnname)
-            destshet.sheet_view.showGridLines = True
-            headcntr = populateTheSheet(
-                exclmainshet, maincolmhdrs, destshet, thisdefn, defnname,
-                busnunitname, cldrmnth, cldryear, totlcols, nzrocols, 
-                anzrcols, aftrtotldefn
-            )
-            logger.info("Sheet '%s' created with headcount: %d", defnname, headcntr)
-            
-            # Remove the sheet if the report has a zero headcount
-            if headcntr <= 0:
-                exclmainbook.remove(destshet)
-                logger.info("Sheet '%s' removed due to zero headcount", defnname)
-
-    
-
-        # Save the copy with schedules only at the end.
-        exclmainbook.save(newxfilename)
-
+                # Save the workbook of the section, or hand it to the pool
+                # and fill in its time once it is saved
+                if splitoutput:
+                    sectfilename = sectionfilename(exclfilename, defnname)
+                    if executor is None:
+                        with runreport.phase("save"):
+                            writesecs = savesectionbook(sectfilename, defnname, sheetlayt)
+                        runreport.addsection(defnname, "reused" if reused else "created", headcntr, buildsecs,
+                                             writesecs)
+                        logger.info("Sheet '%s' saved to %s with headcount: %d", defnname,
+                                    path.basename(sectfilename), headcntr)
+                    else:
+                        sheetrows, mergrnge, colsused = sheetlayt
+                        savefutr = executor.submit(savesectionbook, sectfilename, defnname,
+                                                   (list(sheetrows), mergrnge, colsused))
+                        runreport.addsection(defnname, "reused" if reused else "created", headcntr, buildsecs)
+                        savejobs.append((runreport.sections[-1], sectfilename, savefutr))
+                    rowsdone += headcntr
+                    if progress is not None:
+                        progress(defnname, sectnmbr, sectcount, rowsdone)
+                    continue
 
+                # Create a tab in the copy of the main Excel file
+                strttime = time.perf_counter()
+                destshet = destbook.create_sheet(title=defnname)
+                destshet.sheet_view.showGridLines = True
+                writesheetrows(destshet, *sheetlayt, cellstyl)
+                runreport.addsection(defnname, "reused" if reused else "created", headcntr, buildsecs,
+                                     time.perf_counter() - strttime)
+                logger.info("Sheet '%s' created with headcount: %d", defnname, headcntr)
+                rowsdone += headcntr
+                if progress is not None:
+                    progress(defnname, sectnmbr, sectcount, rowsdone)
+
+            if savejobs:
+                with runreport.phase("save"):
+                    for sectrprt, sectfilename, savefutr in savejobs:
+                        sectrprt["write"] = round(savefutr.result(), 4)
+                        logger.info("Sheet '%s' saved to %s with headcount: %d", sectrprt["name"],
+                                    path.basename(sectfilename), sectrprt["keptrows"])
+        runreport.phases["sections"] = time.perf_counter() - sectstrt
+
+        # Stream the upload files of the .FILE sections
+        flatnames = []
+        with runreport.phase("files"):
+            for sectnmbr, filejob in enumerate(filejobs, len(sectjobs) + 1):
+                if cancel is not None and cancel.is_set():
+                    raise ProcessingCancelled("Processing cancelled")
+                defnname = filejob[1]
+                flatname = flatfilename(exclfilename, defnname)
+                strttime = time.perf_counter()
+                headcntr = exportTheFile(mainrows, maincolmhdrs, flatname, *filejob)
+                if headcntr:
+                    flatnames.append(flatname)
+                    logger.info("File '%s' written with headcount: %d", path.basename(flatname), headcntr)
+                    runreport.addsection(defnname, "file", headcntr, 0.0, time.perf_counter() - strttime)
+                else:
+                    logger.info("File '%s' skipped due to zero headcount", path.basename(flatname))
+                    runreport.addsection(defnname, "skipped", headcntr)
+                rowsdone += headcntr
+                if progress is not None:
+                    progress(defnname, sectnmbr, sectcount, rowsdone)
+
+
+        if destbook is not None:
+            # Drop the empty default sheet of a new workbook, unless there
+            # is nothing else to save.
+            if dfltshet is not None and len(destbook.sheetnames) > 1:
+                destbook.remove(dfltshet)
+            if not destbook.sheetnames:
+                destbook.create_sheet()
+
+            # Save the copy with schedules only at the end.
+            with runreport.phase("save"):
+                destbook.save(newxfilename)
+            if incremental:
+                saverun(newxfilename, thisrunkey, flatnames)
+
+
+    except ProcessingCancelled as e:
+        # The sheets of a write-only workbook are streams, close them as the
+        # workbook is not saved
+        if destbook is not None and destbook.write_only:
+            for destshet in destbook.worksheets:
+                destshet.close()
+        logger.info("Run cancelled, %s not saved", os.path.basename(newxfilename))
+        status = "Cancelled"
+        result = e
     except Exception as e:
         status = "Failed"
         result = e
@@ -593,4 +1350,8 @@ def processFiles(defnfilename, exclfilename, cldrmnth, cldryear, busnunitname, d
         status = "Success"
         result = ""
 
+    runreport.finish(status, result)
+    logger.debug("Run took %.2fs, phases: %s", runreport.seconds,
+                 {phasename: round(secs, 2) for phasename, secs in runreport.phases.items()})
+
     return(status, result)
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""Compiled recipe plans for definition (INI) files.
+
+A recipe plan holds every section of a definition file with its _NZ_, _ANZ_
+and _SUM_ markers and _NAME_ after-total keys already interpreted, and its
+directives such as SKIP taken out of the columns. The plan
+does not depend on the payroll file: SectionPlan.bind resolves it against the
+column headers of a main sheet. Plans are validated once when compiled and
+cached on disk keyed by the file's path, modification time and content hash,
+so repeated runs with the same recipe skip parsing altogether. Plans pickle,
+so they can be handed to worker processes as they are.
+"""
+
+import logging
+from os import path
+from collections import defaultdict
+
+from cachestore import cacheentry, filedigest, readcache, writecache
+
+logger = logging.getLogger(__name__)
+
+
+def defnfileprse(file_path):
+    """Parse an INI-style definition file.
+    
+    Parses a file with [SECTIONS] and key=value pairs into a dictionary structure.
+    
+    Args:
+        file_path: Path to the INI file
+        
+    Returns:
+        dict: Dictionary with section names as keys and lists of [key, value] pairs as values
+    """
+    ini_data = dict()
+
+    with open(file_path, 'r') as file:
+        currsect = None
+        for line in file:
+            line = line.strip()
+            if line.startswith('[') and line.endswith(']'):
+                currsect = line[1:-1]
+                ini_data[currsect] = list()
+            elif '=' in line:
+                key, value = map(str.strip, line.split('=', 1))
+                if key:  # Simplified - empty string is falsy
+                    if currsect is None:
+                        raise ValueError(f"{file_path}: '{key}' is not inside a [SECTION]")
+                    ini_data[currsect].append([key, value])
+    return ini_data
+
+
+# Bump when the layout of the plan classes changes, older cache entries are
+# then compiled again
+PLAN_VERSION = 2
+
+# Keys of a section that are settings of the section, not columns
+SECTION_DIRECTIVES = ("SKIP",)
+
+
+class ColumnPlan:
+    """One key = value line of a section, with its markers interpreted."""
+
+    __slots__ = ("maincolm", "thiscolm", "anzr", "nzro", "totl", "dropsheet", "aftrcolms")
+
+    def __init__(self, maincolm, thiscolm):
+        """Interpret one line of a section.
+
+        Args:
+            maincolm: Name of the column in the main sheet (the key)
+            thiscolm: Header in the report with its markers (the value)
+        """
+        maincolm = maincolm.strip()
+        thiscolm = thiscolm.strip()
+        self.maincolm = maincolm
+
+        # Summed totals to be added after the main totals
+        self.aftrcolms = None
+        if maincolm.startswith("_") and maincolm.endswith("_"):
+            self.aftrcolms = [aftrcolm.strip() for aftrcolm in thiscolm.split("+")]
+
+        # A _NZ_ column that is not in the main sheet drops the whole sheet
+        self.dropsheet = "_NZ_" in thiscolm
+
+        # _ANZ_ is not compatible with _NZ_ and takes priority
+        self.anzr = "_ANZ_" in thiscolm
+        if self.anzr:
+            thiscolm = thiscolm.replace("_NZ_", "").strip()
+            thiscolm = thiscolm.replace("_ANZ_", "").strip()
+
+        self.nzro = "_NZ_" in thiscolm
+        if self.nzro:
+            thiscolm = thiscolm.replace("_NZ_", "").strip()
+
+        self.totl = "_SUM_" in thiscolm
+        if self.totl:
+            thiscolm = thiscolm.replace("_SUM_", "").strip()
+
+        self.thiscolm = thiscolm
+
+
+class SectionPlan:
+    """A compiled [SECTION] of a definition file.
+
+    A section named NAME.FILE is a provider upload file, written as a flat
+    file instead of a tab. Its SKIP = n directive is the number of lines the
+    provider skips before the column headers.
+    """
+
+    def __init__(self, defnname, givndefn):
+        """Compile the lines of a section.
+
+        Args:
+            defnname: Name of the section
+            givndefn: List of [key, value] pairs as parsed by defnfileprse
+        """
+        self.defnname = defnname
+        self.isfile = defnname.upper().endswith(".FILE")
+        self.directives = {maincolm.strip().upper(): thiscolm.strip() for maincolm, thiscolm in givndefn
+                           if maincolm.strip().upper() in SECTION_DIRECTIVES}
+        self.columns = [ColumnPlan(maincolm, thiscolm) for maincolm, thiscolm in givndefn
+                        if maincolm.strip().upper() not in SECTION_DIRECTIVES]
+        self.anzrpres = any(colmplan.anzr for colmplan in self.columns)
+
+        skipvalu = self.directives.get("SKIP", "0")
+        self.skip = int(skipvalu) if skipvalu.isdigit() else 0
+
+    def validate(self):
+        """Check the section for recipe mistakes.
+
+        Returns:
+            list: Description of every problem found, empty when none
+        """
+        problems = []
+        if not self.columns:
+            problems.append(f"[{self.defnname}] has no columns")
+        if "SKIP" in self.directives:
+            if not self.directives["SKIP"].isdigit():
+                problems.append(f"[{self.defnname}] SKIP = {self.directives['SKIP']} is not a number of lines, "
+                                f"no lines are skipped")
+            elif not self.isfile:
+                problems.append(f"[{self.defnname}] SKIP only applies to .FILE sections")
+
+        defined = set()
+        for colmplan in self.columns:
+            if colmplan.aftrcolms is not None:
+                for aftrcolm in colmplan.aftrcolms:
+                    if aftrcolm not in defined:
+                        problems.append(f"[{self.defnname}] {colmplan.maincolm} adds up {aftrcolm}, "
+                                        f"which is not a column above it")
+            elif colmplan.anzr and colmplan.dropsheet:
+                problems.append(f"[{self.defnname}] {colmplan.maincolm} is both _ANZ_ and _NZ_, _ANZ_ is used")
+            defined.add(colmplan.maincolm)
+        return problems
+
+    def bind(self, maincolmhdrs):
+        """Resolve the section against the column headers of a main sheet.
+
+        Columns that cannot be found in the main sheet are left out, the
+        column numbers are those of the report sheet.
+
+        Args:
+            maincolmhdrs: Dictionary mapping column names to column indices
+
+        Returns:
+            tuple: (thisdefn, totlcols, nzrocols, anzrcols, aftrtotldefn) as
+                   taken by populateTheSheet, or None when the sheet should
+                   not be created
+        """
+        thisdefn = []
+        nzrocols = []
+        anzrcols = []
+        totlcols = []
+        destcols = {}
+        aftrtotldefn = defaultdict(list)
+
+        colmcntr = 1
+        for colmplan in self.columns:
+            maincolm = colmplan.maincolm
+
+            if colmplan.aftrcolms is not None:
+                for aftrcolm in colmplan.aftrcolms:
+                    if aftrcolm in maincolmhdrs:
+                        if aftrcolm not in destcols:
+                            raise ValueError(f"{maincolm} of {self.defnname} adds up {aftrcolm} before it is defined")
+                        if destcols[aftrcolm] in totlcols:
+                            aftrtotldefn[maincolm].append(destcols[aftrcolm])
+
+            # Ignore columns that cannot be found in the input sheet.
+            if maincolm not in maincolmhdrs:
+                if colmplan.dropsheet:
+                    return None
+                continue
+
+            if colmplan.anzr:
+                anzrcols.append(colmcntr)
+            if colmplan.nzro:
+                nzrocols.append(colmcntr)
+            if colmplan.totl:
+                totlcols.append(colmcntr)
+            destcols[maincolm] = colmcntr
+            thisdefn.append([maincolm, colmplan.thiscolm])
+            colmcntr += 1
+
+        if self.anzrpres and len(anzrcols) == 0:
+            logger.warning("No ANZ columns found in main sheet for %s", self.defnname)
+            return None
+
+        return thisdefn, totlcols, nzrocols, anzrcols, aftrtotldefn
+
+
+class RecipePlan:
+    """A compiled definition file."""
+
+    def __init__(self, defndict, defnfilename=None):
+        """Compile a parsed definition file.
+
+        Args:
+            defndict: Dictionary of sections as parsed by defnfileprse
+            defnfilename: Path of the file, for reference only
+        """
+        self.defnfilename = defnfilename
+        self.companies = [value for key, value in defndict.get("COMPANIES", [])]
+        self.sections = [
+            SectionPlan(defnname, givndefn)
+            for defnname, givndefn in defndict.items() if defnname != "COMPANIES"
+        ]
+        self.problems = []
+        for sectplan in self.sections:
+            self.problems.extend(sectplan.validate())
+
+
+def compilerecipe(defnfilename):
+    """Parse, compile and validate a definition file without any caching.
+
+    Args:
+        defnfilename: Path to the INI definition file
+
+    Returns:
+        RecipePlan: The compiled plan
+    """
+    recipeplan = RecipePlan(defnfileprse(defnfilename), defnfilename)
+    logproblems(recipeplan, defnfilename)
+    return recipeplan
+
+
+def logproblems(recipeplan, defnfilename):
+    """Warn about the problems found when a recipe was compiled.
+
+    Args:
+        recipeplan: The compiled plan
+        defnfilename: Path to the INI definition file
+    """
+    for problem in recipeplan.problems:
+        logger.warning("Recipe %s: %s", path.basename(defnfilename), problem)
+
+
+def loadrecipeplan(defnfilename, usecache=True):
+    """Return the compiled plan of a definition file, from the cache if valid.
+
+    A cache entry is used when it was compiled from a file with the same
+    path, modification time and content hash. The problems found when the
+    plan was compiled are logged again on every load.
+
+    Args:
+        defnfilename: Path to the INI definition file
+        usecache: Set to False to always compile the file
+
+    Returns:
+        RecipePlan: The compiled plan
+    """
+    if not usecache:
+        return compilerecipe(defnfilename)
+
+    fullname = path.abspath(defnfilename)
+    cachekey = (PLAN_VERSION, fullname, path.getmtime(fullname), filedigest(fullname))
+    cachefile = cacheentry("recipes", fullname)
+
+    cacheentr = readcache(cachefile)
+    if cacheentr is not None and cacheentr[0] == cachekey:
+        logger.debug("Recipe plan for %s loaded from cache", defnfilename)
+        logproblems(cacheentr[1], defnfilename)
+        return cacheentr[1]
+
+    recipeplan = compilerecipe(defnfilename)
+    writecache(cachefile, (cachekey, recipeplan))
+    return recipeplan
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""Compact in-memory table of the main sheet of a payroll file.
+
+A list of row tuples costs a Python object for every cell, which a payroll
+export of a few hundred thousand rows and a hundred and more payroll code
+columns cannot afford. The RowStore keeps the table column by column
+instead:
+
+- A numeric column, e.g. "Basic Salary (A000)" or "PAYE (/260)", is an
+  array('d') of its values with a byte per cell telling what the cell holds:
+  empty, a float, an int or a value from the column's dictionary. The bytes
+  are the null mask of the column, they are left out when every cell holds
+  a float.
+- A text column, e.g. "Race", "Gender" or "PayGroupCodeDesc", is
+  dictionary-encoded: every distinct value is kept once, strings interned,
+  and the cells are codes into the dictionary in the smallest array type
+  that holds them. Code 0 is the empty cell.
+- A column that mixes numbers with text, dates or booleans keeps the
+  numbers in the array and codes the other values into its dictionary.
+
+Every value comes back as the object that was stored, with its type: an int
+stays an int and a float stays a float. The buffers pickle as bytes, so the
+table is cheap to cache and to hand to worker processes, and the NumPy
+engine views them as arrays without copying.
+"""
+
+import sys
+from array import array
+from itertools import repeat, zip_longest
+
+# What a cell of a numeric or mixed column holds
+NULL = 0
+FLOAT = 1
+INT = 2
+CODED = 3
+
+# Larger ints do not survive the round trip through a double, they are coded
+MAX_EXACT_INT = 2 ** 53
+
+# Array type codes of the dictionary codes, smallest first
+CODE_TYPES = [("B", 2 ** 8), ("H", 2 ** 16), ("I", 2 ** 32)]
+
+
+class StoreColumn:
+    """One column of a RowStore."""
+
+    __slots__ = ("values", "kinds", "codes", "dictvals", "dictcode")
+
+    def __init__(self):
+        """Start an empty column, it is built as a numeric or mixed column."""
+        self.values = array("d")
+        self.kinds = bytearray()
+        self.codes = None
+        self.dictvals = [None]
+        self.dictcode = {}
+
+    def append(self, valu):
+        """Add the value of the next row.
+
+        Args:
+            valu: The cell value
+        """
+        if valu is None:
+            self.values.append(0.0)
+            self.kinds.append(NULL)
+        elif type(valu) is float:
+            self.values.append(valu)
+            self.kinds.append(FLOAT)
+        elif type(valu) is int and -MAX_EXACT_INT <= valu <= MAX_EXACT_INT:
+            self.values.append(valu)
+            self.kinds.append(INT)
+        else:
+            # Keyed by type as well, 1, 1.0 and True are equal dictionary keys
+            dictkey = (type(valu), valu)
+            code = self.dictcode.get(dictkey)
+            if code is None:
+                code = len(self.dictvals)
+                self.dictcode[dictkey] = code
+                self.dictvals.append(sys.intern(valu) if type(valu) is str else valu)
+            self.values.append(code)
+            self.kinds.append(CODED)
+
+    def finish(self):
+        """Pack the column once every row is in.
+
+        A column of dictionary values only becomes a text column of codes, a
+        column of floats only drops its null mask.
+        """
+        kindset = set(self.kinds)
+        if kindset <= {NULL, CODED}:
+            typecode = next(typecode for typecode, limit in CODE_TYPES if len(self.dictvals) <= limit)
+            self.codes = array(typecode, map(int, self.values))
+            self.values = None
+            self.kinds = None
+        elif kindset == {FLOAT}:
+            self.kinds = None
+        self.dictcode = None
+
+    def decode(self, valu, kind):
+        """Turn a cell of a numeric or mixed column back into its value.
+
+        Args:
+            valu: The number in the values array
+            kind: The kind of the cell
+
+        Returns:
+            The cell value
+        """
+        if kind == FLOAT:
+            return valu
+        if kind == INT:
+            return int(valu)
+        if kind == NULL:
+            return None
+        return self.dictvals[int(valu)]
+
+    def __iter__(self):
+        if self.codes is not None:
+            return map(self.dictvals.__getitem__, self.codes)
+        if self.kinds is None:
+            return iter(self.values)
+        return map(self.decode, self.values, self.kinds)
+
+    def take(self, rowsindx):
+        """Return the values of some rows.
+
+        Args:
+            rowsindx: Zero based row indices
+
+        Returns:
+            list: The values, in the order of the indices
+        """
+        if self.codes is not None:
+            codes = self.codes
+            dictvals = self.dictvals
+            return [dictvals[codes[rowindx]] for rowindx in rowsindx]
+        values = self.values
+        if self.kinds is None:
+            return [values[rowindx] for rowindx in rowsindx]
+        kinds = self.kinds
+        return [self.decode(values[rowindx], kinds[rowindx]) for rowindx in rowsindx]
+
+    def nbytes(self):
+        """Return the memory taken by the column.
+
+        Returns:
+            int: Size in bytes of the buffers and the dictionary
+        """
+        colmsize = sys.getsizeof(self.dictvals) + sum(sys.getsizeof(valu) for valu in self.dictvals[1:])
+        for buffer in (self.values, self.kinds, self.codes):
+            if buffer is not None:
+                colmsize += sys.getsizeof(buffer)
+        return colmsize
+
+
+class RowStore:
+    """The rows of the main sheet, stored column by column."""
+
+    def __init__(self, rowsiter, colscntr):
+        """Read the rows into the columns.
+
+        Args:
+            rowsiter: Iterator of row value tuples, header excluded
+            colscntr: Number of columns, a short row is padded with empty
+                      cells and the cells past the last column are dropped
+        """
+        self.columns = [StoreColumn() for _ in range(colscntr)]
+        self.rowscntr = 0
+        appenders = [column.append for column in self.columns]
+        for mainrow in rowsiter:
+            self.rowscntr += 1
+            for append, valu in zip_longest(appenders, mainrow[:colscntr]):
+                append(valu)
+        for column in self.columns:
+            column.finish()
+
+    def __len__(self):
+        return self.rowscntr
+
+    def __iter__(self):
+        return self.project(range(len(self.columns)))
+
+    def column(self, colmindx):
+        """Return the values of one column, decoded as they are read.
+
+        Args:
+            colmindx: Zero based index of the column
+
+        Returns:
+            iterator: The value of the column in every row
+        """
+        return iter(self.columns[colmindx])
+
+    def project(self, srcecols):
+        """Read some columns of every row, without decoding the others.
+
+        Args:
+            srcecols: Zero based index of every column to read, a column
+                      may be read more than once
+
+        Returns:
+            iterator: A tuple of the values of the columns for every row
+        """
+        if not srcecols:
+            return repeat((), self.rowscntr)
+        return zip(*[self.column(colmindx) for colmindx in srcecols])
+
+    def take(self, colmindx, rowsindx):
+        """Return the values of one column in some rows.
+
+        Args:
+            colmindx: Zero based index of the column
+            rowsindx: Zero based row indices
+
+        Returns:
+            list: The values, in the order of the indices
+        """
+        return self.columns[colmindx].take(rowsindx)
+
+    def nbytes(self):
+        """Return the memory taken by the table.
+
+        Returns:
+            int: Size in bytes
+        """
+        return sys.getsizeof(self.columns) + sum(column.nbytes() for column in self.columns)
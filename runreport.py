@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""Run report of processFiles.
+
+A RunReport collects where the time of one run went: every phase of
+processFiles, the build and write time of every section, the number of
+source rows and the rows each section kept or filtered out, and the peak
+memory of the process. It is passed in by the caller, filled during the run
+and can be written out as JSON.
+"""
+
+import json
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def windowspeakmemory():
+    """Return the peak working set of this process on Windows.
+
+    Windows has no resource module, the peak comes from GetProcessMemoryInfo
+    of psapi.
+
+    Returns:
+        int: Peak working set in kilobytes, or None when it cannot be read
+    """
+    try:
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [
+                ("cb", wintypes.DWORD),
+                ("PageFaultCount", wintypes.DWORD),
+                ("PeakWorkingSetSize", ctypes.c_size_t),
+                ("WorkingSetSize", ctypes.c_size_t),
+                ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                ("PagefileUsage", ctypes.c_size_t),
+                ("PeakPagefileUsage", ctypes.c_size_t),
+            ]
+
+        kernel32 = ctypes.WinDLL("kernel32")
+        psapi = ctypes.WinDLL("psapi")
+        kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+        psapi.GetProcessMemoryInfo.argtypes = [
+            wintypes.HANDLE, ctypes.POINTER(PROCESS_MEMORY_COUNTERS), wintypes.DWORD
+        ]
+        psapi.GetProcessMemoryInfo.restype = wintypes.BOOL
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        if not psapi.GetProcessMemoryInfo(kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+            return None
+    except (AttributeError, ImportError, OSError, ValueError):
+        return None
+    return counters.PeakWorkingSetSize // 1024
+
+
+def peakmemory():
+    """Return the peak resident memory of this process so far.
+
+    Returns:
+        int: Peak RSS, the peak working set on Windows, in kilobytes, or
+             None where it cannot be measured
+    """
+    if resource is None:
+        return windowspeakmemory() if sys.platform == "win32" else None
+    peakrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peakrss // 1024 if sys.platform == "darwin" else peakrss
+
+
+class RunReport:
+    """Timings and row counts of one processFiles run."""
+
+    def __init__(self):
+        """Start an empty report, the clock starts running now."""
+        self.started = datetime.now().isoformat(timespec="seconds")
+        self.strttime = time.perf_counter()
+        self.files = {}
+        self.status = None
+        self.result = ""
+        self.seconds = None
+        self.sourcerows = None
+        self.sourcecols = None
+        self.phases = {}
+        self.sections = []
+        self.peakrss_kb = None
+
+    @contextmanager
+    def phase(self, phasename):
+        """Time a phase of the run, phases of the same name add up.
+
+        Args:
+            phasename: Name of the phase, e.g. "load"
+        """
+        strttime = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[phasename] = self.phases.get(phasename, 0.0) + time.perf_counter() - strttime
+
+    def addsection(self, defnname, status, keptrows=0, buildsecs=0.0, writesecs=0.0):
+        """Record the outcome of a section.
+
+        Args:
+            defnname: Name of the section
+            status: "created", "reused" when it came from the section store,
+                    "file" for the upload file of a .FILE section,
+                    "skipped" when no rows were left or "not selected"
+                    when the recipe left the sheet out
+            keptrows: Number of data rows in the sheet
+            buildsecs: Seconds taken to filter and lay out the rows
+            writesecs: Seconds taken to write the rows to the worksheet
+        """
+        sourcerows = self.sourcerows or 0
+        self.sections.append({
+            "name": defnname,
+            "status": status,
+            "sourcerows": sourcerows,
+            "keptrows": keptrows,
+            "filteredrows": sourcerows - keptrows if status != "not selected" else 0,
+            "build": round(buildsecs, 4),
+            "write": round(writesecs, 4),
+        })
+
+    def finish(self, status, result):
+        """Close the report at the end of the run.
+
+        Args:
+            status: "Success" or "Failed"
+            result: Error of a failed run, empty on success
+        """
+        self.status = status
+        self.result = str(result)
+        self.seconds = time.perf_counter() - self.strttime
+        self.peakrss_kb = peakmemory()
+
+    def todict(self):
+        """Return the report as plain data.
+
+        Returns:
+            dict: The report, ready for json.dump
+        """
+        return {
+            "started": self.started,
+            "files": self.files,
+            "status": self.status,
+            "result": self.result,
+            "seconds": round(self.seconds, 4) if self.seconds is not None else None,
+            "sourcerows": self.sourcerows,
+            "sourcecols": self.sourcecols,
+            "phases": {phasename: round(secs, 4) for phasename, secs in self.phases.items()},
+            "sections": self.sections,
+            "peakrss_kb": self.peakrss_kb,
+        }
+
+    def writejson(self, filename):
+        """Write the report to a JSON file.
+
+        Args:
+            filename: Path of the JSON file
+        """
+        with open(filename, "w") as rprtfile:
+            json.dump(self.todict(), rprtfile, indent=2)
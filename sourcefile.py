@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""Input adapters for flat (CSV and TSV) payroll exports.
+
+The payroll system can export the main sheet as a delimited text file. Such
+a file is streamed with the csv module, which is much faster than unzipping
+and parsing the XML of a workbook, and its rows are converted to the cell
+values openpyxl would have read: empty fields become None, TRUE and FALSE
+become booleans and numbers become int or float, except for numbers with
+leading zeros, which are codes and stay text.
+"""
+
+import codecs
+import csv
+import re
+
+# Delimiter of every flat file type, by extension
+FLAT_DELIMITERS = {".csv": ",", ".tsv": "\t"}
+
+# Fields Excel reads as logical values, in any case
+BOOLEAN_VALUES = {"TRUE": True, "FALSE": False}
+
+# Bytes of a flat file decoded at a time to tell its encoding
+ENCODING_PROBE_BYTES = 1 << 16
+
+INTEGER_PATTERN = re.compile(r"[-+]?(0|[1-9]\d*)")
+DECIMAL_PATTERN = re.compile(r"[-+]?(0|[1-9]\d*)?\.\d+([eE][-+]?\d+)?|[-+]?(0|[1-9]\d*)[eE][-+]?\d+")
+
+
+def flatdelimiter(filename):
+    """Return the delimiter of a flat source file.
+
+    Args:
+        filename: Path to the source file
+
+    Returns:
+        str: The delimiter, or None when the file is not a flat file
+    """
+    for extension, delimiter in FLAT_DELIMITERS.items():
+        if filename.lower().endswith(extension):
+            return delimiter
+    return None
+
+
+def convertvalu(text):
+    """Convert a field of a flat file to the value of a worksheet cell.
+
+    Args:
+        text: The field as read by the csv module
+
+    Returns:
+        object: None for an empty field, a bool for TRUE or FALSE, an int or
+                float for a number and the text otherwise
+    """
+    if text == "":
+        return None
+    if text.upper() in BOOLEAN_VALUES:
+        return BOOLEAN_VALUES[text.upper()]
+    if INTEGER_PATTERN.fullmatch(text):
+        return int(text)
+    if DECIMAL_PATTERN.fullmatch(text):
+        return float(text)
+    return text
+
+
+def fileencoding(filename):
+    """Work out the encoding of a flat file.
+
+    The whole file is decoded as UTF-8, a block at a time, because the first
+    accented name of a cp1252 export can be anywhere in it. A character cut
+    off between two blocks is completed by the next one.
+
+    Args:
+        filename: Path to the source file
+
+    Returns:
+        str: "utf-8-sig" when the file is valid UTF-8, "cp1252" otherwise
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    with open(filename, "rb") as flatfile:
+        try:
+            for block in iter(lambda: flatfile.read(ENCODING_PROBE_BYTES), b""):
+                decoder.decode(block)
+            decoder.decode(b"", final=True)
+        except UnicodeDecodeError:
+            return "cp1252"
+    return "utf-8-sig"
+
+
+def readflatrows(filename, delimiter=None):
+    """Stream the rows of a flat file as tuples of cell values.
+
+    Args:
+        filename: Path to the CSV or TSV file
+        delimiter: Field delimiter, taken from the extension when omitted
+
+    Yields:
+        tuple: The converted values of a row, the header row first
+    """
+    delimiter = delimiter or flatdelimiter(filename) or ","
+    with open(filename, "r", newline="", encoding=fileencoding(filename)) as flatfile:
+        for row in csv.reader(flatfile, delimiter=delimiter):
+            yield tuple([convertvalu(text) for text in row])
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""Startup time of the programs, measured with python -X importtime.
+
+Every entry point is imported in a fresh interpreter with -X importtime, a
+number of times. The median cumulative import time of the module is compared
+with its budget in STARTUP_BUDGETS_MS, together with the modules that took
+longest to import. The wall time of the whole interpreter, start up and
+shut down included, is reported alongside.
+
+The exit status is 1 when an entry point is over its budget, so the numbers
+can be tracked from a build script.
+
+Usage:
+    python startupbench.py --runs 5 --output startup.json
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from os import path
+from datetime import datetime
+
+BENCHFLDR = path.dirname(path.abspath(__file__))
+
+# Budget of the cumulative import time of every entry point, in milliseconds
+STARTUP_BUDGETS_MS = {
+    "Cmdline": 100,
+    "Payroll": 150,
+}
+
+# Number of slowest imports reported per entry point
+SLOWEST_IMPORTS = 10
+
+
+def parseimporttime(stderr):
+    """Read the output of -X importtime.
+
+    Args:
+        stderr: What the interpreter wrote to stderr
+
+    Returns:
+        dict: Module name to (self, cumulative) import time in microseconds
+    """
+    importimes = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        selfus, cumlus, modlname = line[len("import time:"):].split("|")
+        importimes[modlname.strip()] = (int(selfus), int(cumlus))
+    return importimes
+
+
+def timeimport(modlname):
+    """Import a module in a fresh interpreter and time it.
+
+    Args:
+        modlname: Name of the entry point module
+
+    Returns:
+        tuple: (importimes, walltime) - the times of every imported module
+               as parseimporttime and the wall time of the interpreter in
+               seconds
+    """
+    strttime = time.perf_counter()
+    procrslt = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {modlname}"],
+        cwd=BENCHFLDR, capture_output=True, text=True
+    )
+    walltime = time.perf_counter() - strttime
+    if procrslt.returncode != 0:
+        lastline = procrslt.stderr.strip().splitlines()[-1] if procrslt.stderr.strip() else ""
+        raise RuntimeError(f"import {modlname} failed: {lastline}")
+    return parseimporttime(procrslt.stderr), walltime
+
+
+def measure(modlname, runs):
+    """Measure the startup of an entry point.
+
+    Args:
+        modlname: Name of the entry point module
+        runs: Number of fresh interpreters to take the median of
+
+    Returns:
+        dict: Median import and wall time in milliseconds, the budget, whether
+              it was kept and the slowest imports of the last run
+    """
+    importmss = []
+    wallmss = []
+    for _ in range(runs):
+        importimes, walltime = timeimport(modlname)
+        importmss.append(importimes[modlname][1] / 1000)
+        wallmss.append(walltime * 1000)
+
+    slowest = sorted(importimes.items(), key=lambda item: item[1][0], reverse=True)[:SLOWEST_IMPORTS]
+    budgetms = STARTUP_BUDGETS_MS.get(modlname)
+    importms = statistics.median(importmss)
+    return {
+        "import_ms": round(importms, 1),
+        "wall_ms": round(statistics.median(wallmss), 1),
+        "budget_ms": budgetms,
+        "within_budget": budgetms is None or importms <= budgetms,
+        "slowest": [{"module": name, "self_ms": round(selfus / 1000, 1), "cumulative_ms": round(cumlus / 1000, 1)}
+                    for name, (selfus, cumlus) in slowest],
+    }
+
+
+def main():
+    """Measure every entry point, print and write the results."""
+    parser = argparse.ArgumentParser(description="Measure the startup time of Cmdline.py and Payroll.py")
+    parser.add_argument("--modules", nargs="+", default=list(STARTUP_BUDGETS_MS),
+                        help="Entry point modules to measure (default: " + " ".join(STARTUP_BUDGETS_MS) + ")")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per module (default: 5)")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = {}
+    failed = False
+    for modlname in args.modules:
+        try:
+            results[modlname] = measure(modlname, args.runs)
+        except RuntimeError as e:
+            print(f"{modlname:<12} {e}")
+            results[modlname] = {"error": str(e)}
+            failed = True
+            continue
+        modlrslt = results[modlname]
+        verdict = "ok" if modlrslt["within_budget"] else "OVER BUDGET"
+        print(f"{modlname:<12} import {modlrslt['import_ms']:>7.1f} ms  wall {modlrslt['wall_ms']:>7.1f} ms  "
+              f"budget {modlrslt['budget_ms']} ms  {verdict}")
+        failed = failed or not modlrslt["within_budget"]
+
+    if args.output:
+        with open(args.output, "w") as rsltfile:
+            json.dump({
+                "started": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "runs": args.runs,
+                "results": results,
+            }, rsltfile, indent=2)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import json
+from os import path
+
+import pytest
+
+import batch
+from batch import globjobs, readmanifest, runbatchjob
+
+REPO_FOLDER = path.dirname(path.dirname(path.abspath(__file__)))
+
+
+def test_readmanifest_rejects_short_csv_row(tmp_path):
+    manifest = tmp_path / "jobs.csv"
+    manifest.write_text("defn,excl,month,year,unit\nDalisu.ini,june.xlsx,Jun\n")
+    with pytest.raises(ValueError, match="year, unit"):
+        readmanifest(str(manifest))
+
+
+def test_readmanifest_rejects_json_null(tmp_path):
+    manifest = tmp_path / "jobs.json"
+    manifest.write_text(json.dumps([
+        {"defn": "Dalisu.ini", "excl": "june.xlsx", "month": "Jun", "year": "2025", "unit": None},
+    ]))
+    with pytest.raises(ValueError, match="unit"):
+        readmanifest(str(manifest))
+
+
+def test_readmanifest_reads_complete_jobs(tmp_path):
+    manifest = tmp_path / "jobs.csv"
+    manifest.write_text("defn,excl,month,year,unit\nDalisu.ini,june.xlsx,Jun,2025,Dalisu\n")
+    batchjobs = readmanifest(str(manifest))
+    assert batchjobs == [{
+        "defn": str(tmp_path / "Dalisu.ini"), "excl": str(tmp_path / "june.xlsx"),
+        "month": "Jun", "year": "2025", "unit": "Dalisu",
+    }]
+
+
+def test_globjobs_leaves_out_outputs_of_earlier_runs(tmp_path, monkeypatch):
+    monkeypatch.setenv("PAROOL_CACHE_DIR", str(tmp_path / "cache"))
+    defnfilename = path.join(REPO_FOLDER, "Dalisu.ini")
+    for filename in ["june.xlsx", "june Tabs.xlsx", "june CEPPWAWU.TAB.xlsx",
+                     "june Discovery.TAB.xlsx", "june CEPPWAWU.csv"]:
+        (tmp_path / filename).write_bytes(b"")
+
+    batchjobs = globjobs(str(tmp_path / "*.xlsx"), defnfilename, "Jun", "2025", "Dalisu")
+    assert [jobsdefn["excl"] for jobsdefn in batchjobs] == [str(tmp_path / "june.xlsx")]
+    batchjobs = globjobs(str(tmp_path / "*.csv"), defnfilename, "Jun", "2025", "Dalisu")
+    assert batchjobs == []
+
+
+def test_runbatchjob_never_starts_a_pool_of_its_own(monkeypatch):
+    procopts = {}
+
+    def fakeprocess(*args, **options):
+        procopts.update(options)
+        return "Success", ""
+
+    monkeypatch.setattr(batch, "processFiles", fakeprocess)
+    jobsdefn = {"defn": "Dalisu.ini", "excl": "june.xlsx", "month": "Jun", "year": "2025", "unit": "Dalisu"}
+    jobsrslt = runbatchjob(jobsdefn, None, {"splitoutput": True, "workers": 4})
+    assert jobsrslt["status"] == "Success"
+    assert procopts["workers"] == 1
+    assert procopts["splitoutput"] is True
@@ -0,0 +1,29 @@
+import os
+import stat
+
+import pytest
+
+from flatexport import FILE_MODE, writeflatfile
+
+COLMHDRS = ["PersonCode", "Deducted Amount"]
+
+
+@pytest.mark.skipif(os.name != "posix", reason="file modes are POSIX")
+def test_writeflatfile_gives_the_umask_permissions(tmp_path):
+    flatfilename = tmp_path / "june CEPPWAWU.csv"
+    assert writeflatfile(str(flatfilename), iter([(1, 10.0)]), COLMHDRS, [2], "Title") == 1
+    assert stat.S_IMODE(os.stat(flatfilename).st_mode) == FILE_MODE
+
+    os.chmod(flatfilename, 0o640)
+    writeflatfile(str(flatfilename), iter([(1, 10.0)]), COLMHDRS, [2], "Title")
+    assert stat.S_IMODE(os.stat(flatfilename).st_mode) == 0o640
+
+
+def test_writeflatfile_removes_the_file_of_an_earlier_run_without_rows(tmp_path):
+    flatfilename = tmp_path / "june CEPPWAWU.csv"
+    writeflatfile(str(flatfilename), iter([(1, 10.0)]), COLMHDRS, [2], "Title")
+    assert flatfilename.exists()
+
+    assert writeflatfile(str(flatfilename), iter([]), COLMHDRS, [2], "Title") == 0
+    assert not flatfilename.exists()
+    assert os.listdir(tmp_path) == []
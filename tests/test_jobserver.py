@@ -0,0 +1,17 @@
+from jobserver import JobServer
+
+
+def test_output_locks_are_dropped_when_the_jobs_are_done(tmp_path):
+    jobserver = JobServer(jobs=2, cachemb=1)
+    jobsids = [
+        jobserver.submit({"defn": str(tmp_path / "missing.ini"), "excl": str(tmp_path / f"june{jobsnmbr % 2}.xlsx"),
+                          "month": "Jun", "year": "2025", "unit": "Dalisu"})["id"]
+        for jobsnmbr in range(4)
+    ]
+    jobserver.executor.shutdown(wait=True)
+
+    assert jobserver.outputlocks == {}
+    for jobsid in jobsids:
+        jobsrslt = jobserver.job(jobsid)
+        assert jobsrslt["status"] == "Failed"
+        assert jobsrslt["cache"] is not jobserver.jobs[jobsid]["cache"]
@@ -0,0 +1,28 @@
+from datetime import datetime
+
+import pytest
+from openpyxl import Workbook, load_workbook
+
+from processFiles import NUMBER_FORMAT, StyleRegistry, writesheetrows
+
+
+@pytest.mark.parametrize("writeonly", [False, True])
+def test_writesheetrows_keeps_date_number_format(tmp_path, writeonly):
+    destbook = Workbook(write_only=writeonly)
+    destshet = destbook.create_sheet("TAB")
+    sheetrows = [
+        (1, {1: ("Title", "titl")}),
+        (2, {1: (datetime(2025, 6, 1), "nrml"), 2: (100.5, "numb")}),
+        (3, {1: (datetime(2025, 6, 2), "nrml"), 2: (200.25, "numb")}),
+        (4, {1: ("Unit A", "nrml"), 2: (datetime(2025, 6, 3), "nrml")}),
+    ]
+    writesheetrows(destshet, iter(sheetrows), "A1:B1", 2, StyleRegistry())
+    destbook.save(tmp_path / "tabs.xlsx")
+
+    destshet = load_workbook(tmp_path / "tabs.xlsx")["TAB"]
+    for celladdr in ["A2", "A3", "B4"]:
+        assert destshet[celladdr].is_date
+        assert destshet[celladdr].number_format != "General"
+    assert destshet["A4"].number_format == "General"
+    assert destshet["B2"].number_format == NUMBER_FORMAT
+    assert destshet["B3"].number_format == NUMBER_FORMAT
@@ -0,0 +1,26 @@
+import logging
+
+from recipeplan import loadrecipeplan
+
+RECIPE = """[COMPANIES]
+1 = Dalisu
+
+[Union.TAB]
+SKIP = 2
+PersonCode = Salary Number _NZ_
+"""
+
+
+def test_loadrecipeplan_warns_again_from_cache(tmp_path, monkeypatch, caplog):
+    monkeypatch.setenv("PAROOL_CACHE_DIR", str(tmp_path / "cache"))
+    defnfilename = tmp_path / "recipe.ini"
+    defnfilename.write_text(RECIPE)
+
+    for _ in range(2):
+        caplog.clear()
+        with caplog.at_level(logging.WARNING, logger="recipeplan"):
+            recipeplan = loadrecipeplan(str(defnfilename))
+        assert recipeplan.problems == ["[Union.TAB] SKIP only applies to .FILE sections"]
+        assert [record.getMessage() for record in caplog.records] == [
+            "Recipe recipe.ini: [Union.TAB] SKIP only applies to .FILE sections"
+        ]
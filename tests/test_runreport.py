@@ -0,0 +1,20 @@
+import runreport
+from runreport import peakmemory, windowspeakmemory
+
+
+def test_peakmemory_measures_this_process():
+    peakkb = peakmemory()
+    assert isinstance(peakkb, int)
+    assert peakkb > 1024
+
+
+def test_peakmemory_without_resource_reads_the_windows_counters(monkeypatch):
+    monkeypatch.setattr(runreport, "resource", None)
+    monkeypatch.setattr(runreport.sys, "platform", "win32")
+    monkeypatch.setattr(runreport, "windowspeakmemory", lambda: 2048)
+    assert peakmemory() == 2048
+
+
+def test_windowspeakmemory_never_raises():
+    peakkb = windowspeakmemory()
+    assert peakkb is None or peakkb > 0
@@ -0,0 +1,27 @@
+from sourcefile import ENCODING_PROBE_BYTES, fileencoding, readflatrows
+
+
+def test_fileencoding_small_cp1252_file(tmp_path):
+    flatfile = tmp_path / "export.csv"
+    flatfile.write_bytes(b"E1,Caf\xe9\n")
+    assert fileencoding(str(flatfile)) == "cp1252"
+    assert list(readflatrows(str(flatfile))) == [("E1", "Café")]
+
+
+def test_fileencoding_utf8_cut_off_at_end_of_block(tmp_path):
+    flatfile = tmp_path / "export.csv"
+    flatfile.write_bytes(b"a" * (ENCODING_PROBE_BYTES - 1) + "é\n".encode("utf-8"))
+    assert fileencoding(str(flatfile)) == "utf-8-sig"
+
+
+def test_fileencoding_utf8(tmp_path):
+    flatfile = tmp_path / "export.csv"
+    flatfile.write_bytes("E1,Café\n".encode("utf-8"))
+    assert fileencoding(str(flatfile)) == "utf-8-sig"
+
+
+def test_fileencoding_cp1252_after_the_first_block(tmp_path):
+    flatfile = tmp_path / "export.csv"
+    flatfile.write_bytes(b"E1,Smith\n" * (ENCODING_PROBE_BYTES // 9 + 1) + b"E2,Caf\xe9\n")
+    assert fileencoding(str(flatfile)) == "cp1252"
+    assert list(readflatrows(str(flatfile)))[-1] == ("E2", "Café")
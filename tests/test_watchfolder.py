@@ -0,0 +1,40 @@
+import pytest
+
+from cachestore import clearcache
+from watchfolder import WatchLedger, inferjob
+
+COMPANIES = ["Dalisu", "Unit"]
+
+
+def test_inferjob_year_month_wins_over_month_word():
+    jobsdefn = inferjob("/drop/Unit Marketing 2025-06.xlsx", COMPANIES)
+    assert (jobsdefn["unit"], jobsdefn["month"], jobsdefn["year"]) == ("Unit", "Jun", "2025")
+
+
+@pytest.mark.parametrize("filename", [
+    "Dalisu Marketing.xlsx", "Dalisu Decorations.xlsx", "Dalisu Mayfair.xlsx", "Dalisu Octagon.xlsx",
+])
+def test_inferjob_ignores_words_starting_with_a_month(filename):
+    jobsdefn = inferjob("/drop/" + filename, COMPANIES, "Jan", "2024")
+    assert (jobsdefn["month"], jobsdefn["year"]) == ("Jan", "2024")
+
+
+@pytest.mark.parametrize("filename, cldrmnth", [
+    ("Dalisu June 2025.xlsx", "Jun"),
+    ("Dalisu_sep_2025.csv", "Sep"),
+    ("Dalisu-September-2025.xlsx", "Sep"),
+    ("Dalisu 2025 may.xlsx", "May"),
+])
+def test_inferjob_month_names(filename, cldrmnth):
+    jobsdefn = inferjob("/drop/" + filename, COMPANIES)
+    assert (jobsdefn["unit"], jobsdefn["month"], jobsdefn["year"]) == ("Dalisu", cldrmnth, "2025")
+
+
+def test_ledger_survives_clearing_the_caches(tmp_path, monkeypatch):
+    monkeypatch.setenv("PAROOL_CACHE_DIR", str(tmp_path / "cache"))
+    watchdir = tmp_path / "drop"
+    watchdir.mkdir()
+    WatchLedger(str(watchdir)).record("abc123", {"excl": "june.xlsx", "unit": "Dalisu",
+                                                 "month": "Jun", "year": "2025"})
+    clearcache()
+    assert "abc123" in WatchLedger(str(watchdir))
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""Watch a drop folder and process every payroll export that lands in it.
+
+The folder is polled. A new file is only taken once it is completely
+written: its size and modification time must be the same on two polls in a
+row and an Excel file must be a complete zip archive. The business unit, the
+month and the year of a file are taken from its name where it names them,
+from the defaults given otherwise. The jobs run on a pool of worker
+processes with at most as many files in flight as there are workers, so a
+burst of files at month end is worked through in order of arrival.
+
+The content hash of every file that was processed successfully is kept in a
+ledger, a hidden file in the drop folder itself: it is state, not a cache,
+and clearing the caches must not make the folder be processed again. A file
+with the same content as one in the ledger, or as one still being processed,
+is skipped, so a file that is dropped twice or copied under another name is
+processed only once.
+"""
+
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+import zipfile
+from os import path
+from concurrent.futures import ProcessPoolExecutor
+
+from batch import runbatchjob
+from cachestore import filedigest
+from logsetup import setuplogging
+from processFiles import isoutputfile, outputsuffixes
+from recipeplan import loadrecipeplan
+
+logger = logging.getLogger(__name__)
+
+# The files a drop folder may receive, by extension
+WATCH_EXTENSIONS = (".xlsx", ".csv", ".tsv")
+
+MONTH_NAMES = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+# A month written out or abbreviated to three letters in a file name, e.g.
+# "June" or "jun", as a word of its own so that "Marketing" is no month
+MONTH_PATTERN = re.compile(
+    r"(?<![a-z])(jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?"
+    r"|sep(?:tember)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)(?![a-z])", re.IGNORECASE
+)
+# A year followed by a month number, e.g. "2025-06" or "202506"
+YEAR_MONTH_PATTERN = re.compile(r"(?<!\d)(20\d\d)[-_. ]?(0[1-9]|1[0-2])(?!\d)")
+YEAR_PATTERN = re.compile(r"(?<!\d)(20\d\d)(?!\d)")
+
+# Name of the ledger in the drop folder, hidden so it is never taken as input
+LEDGER_NAME = ".parool-watch.json"
+
+
+def iswatchfile(filename, rcpesuffixes=()):
+    """Check whether a file in the drop folder is a payroll export.
+
+    Outputs of earlier runs, Excel lock files and hidden files are not.
+
+    Args:
+        filename: Name of the file
+        rcpesuffixes: Endings of the names of the section files the recipe
+                      writes, from processFiles.outputsuffixes
+
+    Returns:
+        bool: True when the file should be processed
+    """
+    basename = path.basename(filename)
+    if basename.startswith(("~$", ".")) or isoutputfile(basename, rcpesuffixes):
+        return False
+    return basename.lower().endswith(WATCH_EXTENSIONS)
+
+
+def iscomplete(filename):
+    """Check whether a file that stopped growing can be read as a whole.
+
+    An Excel workbook is a zip archive whose directory is written last, so
+    a workbook that is still being copied is not a valid zip file yet.
+
+    Args:
+        filename: Path to the file
+
+    Returns:
+        bool: True when the file is complete
+    """
+    if filename.lower().endswith(".xlsx"):
+        return zipfile.is_zipfile(filename)
+    return True
+
+
+def inferjob(filename, complist, cldrmnth=None, cldryear=None, busnunitname=None):
+    """Work out the business unit, month and year of a payroll file.
+
+    The unit is the first company of the recipe that the file name contains,
+    the month the month number after the year or else a month name, the
+    year a four digit year. What the name does not tell comes from the
+    defaults.
+
+    Args:
+        filename: Path to the payroll file
+        complist: Companies of the recipe
+        cldrmnth: Month when the name has none
+        cldryear: Year when the name has none
+        busnunitname: Business unit when the name names no company
+
+    Returns:
+        dict: The job with the JOB_FIELDS except defn, a field is None when
+              it could not be worked out
+    """
+    basename = path.splitext(path.basename(filename))[0]
+    lowrname = basename.lower()
+    unitname = next((compname for compname in complist if compname.lower() in lowrname), busnunitname)
+
+    yearmnth = YEAR_MONTH_PATTERN.search(basename)
+    mnthmtch = MONTH_PATTERN.search(basename)
+    yearmtch = YEAR_PATTERN.search(basename)
+    if yearmnth:
+        cldrmnth = MONTH_NAMES[int(yearmnth.group(2)) - 1]
+    elif mnthmtch:
+        cldrmnth = MONTH_NAMES[[name.lower() for name in MONTH_NAMES].index(mnthmtch.group(1)[:3].lower())]
+    if yearmnth:
+        cldryear = yearmnth.group(1)
+    elif yearmtch:
+        cldryear = yearmtch.group(1)
+
+    return {"excl": filename, "month": cldrmnth, "year": cldryear, "unit": unitname}
+
+
+class WatchLedger:
+    """Content hashes of the files of a drop folder that were processed."""
+
+    def __init__(self, watchdir):
+        """Load the ledger of a drop folder.
+
+        Args:
+            watchdir: The drop folder
+        """
+        self.ledgerfile = path.join(watchdir, LEDGER_NAME)
+        try:
+            with open(self.ledgerfile, "r", encoding="utf-8") as ledger:
+                self.entries = json.load(ledger)
+        except FileNotFoundError:
+            self.entries = {}
+
+    def __contains__(self, filehash):
+        return filehash in self.entries
+
+    def record(self, filehash, jobsrslt):
+        """Add a processed file and save the ledger.
+
+        Args:
+            filehash: Content hash of the file
+            jobsrslt: The job as returned by runbatchjob
+        """
+        self.entries[filehash] = {
+            "excl": jobsrslt["excl"], "unit": jobsrslt["unit"], "month": jobsrslt["month"],
+            "year": jobsrslt["year"], "processed": time.time(),
+        }
+        self.save()
+
+    def save(self):
+        """Write the ledger, replacing the previous one in one step."""
+        filehndl, tempname = tempfile.mkstemp(dir=path.dirname(self.ledgerfile), prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(filehndl, "w", encoding="utf-8") as ledger:
+                json.dump(self.entries, ledger, indent=1)
+            os.replace(tempname, self.ledgerfile)
+        except BaseException:
+            os.unlink(tempname)
+            raise
+
+
+def watchfolder(watchdir, defnfilename, cldrmnth=None, cldryear=None, busnunitname=None,
+                workers=None, interval=2.0, once=False, **options):
+    """Process the payroll files dropped into a folder until interrupted.
+
+    Args:
+        watchdir: The drop folder
+        defnfilename: Path to the INI definition file used for all files
+        cldrmnth: Month of the files whose name has none
+        cldryear: Year of the files whose name has none
+        busnunitname: Business unit of the files that name no company
+        workers: Number of files processed at the same time, defaults to
+                 the number of CPUs
+        interval: Seconds between two polls of the folder
+        once: Stop once the files already in the folder are processed
+        **options: Extra keyword arguments for processFiles, e.g. readonly
+
+    Returns:
+        int: Number of files that failed
+    """
+    workers = workers or os.cpu_count()
+    ledger = WatchLedger(watchdir)
+    recipekey = None
+    failcntr = 0
+
+    lastseen = {}   # path -> (size, mtime_ns) on the previous poll
+    handled = {}    # path -> (size, mtime_ns) when it was taken or passed over
+    inflight = {}   # future -> content hash
+
+    logger.info("Watching %s every %.1fs with %d workers", watchdir, interval, workers)
+    with ProcessPoolExecutor(max_workers=workers, initializer=setuplogging) as executor:
+        try:
+            while True:
+                # Take in the files that were processed
+                for future in [future for future in inflight if future.done()]:
+                    filehash = inflight.pop(future)
+                    try:
+                        jobsrslt = future.result()
+                    except Exception as e:
+                        logger.error("Job failed: %s", e)
+                        failcntr += 1
+                        continue
+                    if jobsrslt["status"] == "Success":
+                        ledger.record(filehash, jobsrslt)
+                        logger.info("Processed %s in %.2fs", jobsrslt["excl"], jobsrslt["seconds"])
+                    else:
+                        logger.error("Failed %s: %s", jobsrslt["excl"], jobsrslt["result"])
+                        failcntr += 1
+
+                # The recipe is compiled again when it changes
+                thisrcpekey = os.stat(defnfilename).st_mtime_ns
+                if thisrcpekey != recipekey:
+                    recipeplan = loadrecipeplan(defnfilename, options.get("usecache", True))
+                    recipekey = thisrcpekey
+                    rcpesuffixes = outputsuffixes(recipeplan)
+
+                waiting = False
+                with os.scandir(watchdir) as direntrs:
+                    filenames = sorted(direntr.path for direntr in direntrs
+                                       if direntr.is_file() and iswatchfile(direntr.name, rcpesuffixes))
+                for exclfilename in filenames:
+                    try:
+                        filestat = os.stat(exclfilename)
+                    except OSError:
+                        continue
+                    filestmp = (filestat.st_size, filestat.st_mtime_ns)
+                    if handled.get(exclfilename) == filestmp:
+                        continue
+
+                    # Wait until the file has stopped changing and is whole
+                    stable = lastseen.get(exclfilename) == filestmp
+                    lastseen[exclfilename] = filestmp
+                    if not stable or not iscomplete(exclfilename):
+                        waiting = True
+                        continue
+                    if len(inflight) >= workers:
+                        waiting = True
+                        break
+
+                    handled[exclfilename] = filestmp
+                    filehash = filedigest(exclfilename)
+                    if filehash in ledger or filehash in inflight.values():
+                        logger.info("Skipped %s, its content was already processed or is being processed", exclfilename)
+                        continue
+
+                    jobsdefn = inferjob(exclfilename, recipeplan.companies, cldrmnth, cldryear, busnunitname)
+                    missfields = [field for field in ("unit", "month", "year") if not jobsdefn[field]]
+                    if missfields:
+                        logger.error("Skipped %s, no %s in its name or given", exclfilename, ", ".join(missfields))
+                        failcntr += 1
+                        continue
+                    jobsdefn["defn"] = defnfilename
+
+                    logger.info("Queued %s for %s %s %s", exclfilename, jobsdefn["unit"],
+                                jobsdefn["month"], jobsdefn["year"])
+                    inflight[executor.submit(runbatchjob, jobsdefn, recipeplan, options)] = filehash
+
+                # Forget the files that were removed from the folder
+                for exclfilename in set(lastseen) - set(filenames):
+                    del lastseen[exclfilename]
+                    handled.pop(exclfilename, None)
+
+                if once and not waiting and not inflight:
+                    break
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            logger.info("Stopped watching %s", watchdir)
+
+    return failcntr